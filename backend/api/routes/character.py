@@ -1,20 +1,37 @@
+import time
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, Dict, Any, List
 from services.zhipu_service import zhipu_service
 from services.mcp_service import mcp_service
+from services.project_store import project_store, NotFoundError
+from services.sse import event_stream, SSE_HEADERS, StreamEvent
+from services.json_stream import stream_json_events
+from utils.config import settings
+from utils.json_extract import extract_json
+from utils.responses import catalog
 
 router = APIRouter()
 
-class CharacterGenerateRequest(BaseModel):
+class CharacterSpec(BaseModel):
     name: Optional[str] = None  # 角色姓名
     type: str  # 角色类型：主角、配角、反派等
-    setting: str  # 故事背景
     description: Optional[str] = None  # 额外描述
     age: Optional[str] = None  # 年龄段
     gender: Optional[str] = None  # 性别
     personality: Optional[str] = None  # 性格特征
 
+class CharacterGenerateRequest(CharacterSpec):
+    setting: str  # 故事背景
+    use_cache: bool = False  # 允许复用相同请求的缓存结果
+
+class CharacterBatchRequest(BaseModel):
+    setting: str  # 故事背景（所有角色共用）
+    characters: List[CharacterSpec]  # 角色列表
+    project_id: Optional[str] = None  # 生成完成的角色保存到该项目
+    use_cache: bool = False  # 允许复用相同请求的缓存结果
+
 class CharacterResponse(BaseModel):
     success: bool
     character: Optional[Dict[str, Any]] = None
@@ -33,23 +50,12 @@ class CharacterImageResponse(BaseModel):
     prompt_used: Optional[str] = None
     error: Optional[str] = None
 
-@router.post("/generate", response_model=CharacterResponse)
-async def generate_character(request: CharacterGenerateRequest):
-    """生成角色设定"""
-    try:
-        # 直接使用 GLM-4.6 生成角色，不依赖MCP
-        background_materials = []
-
-        system_prompt = f"""
-        你是一个专业的角色设计师，请根据以下信息创建一个完整的角色设定：
-
-        角色姓名：{request.name or '待定'}
-        角色类型：{request.type}
-        故事背景：{request.setting}
-        年龄段：{request.age or '不限'}
-        性别：{request.gender or '不限'}
-        性格特征：{request.personality or '待定'}
-        额外描述：{request.description or '无'}
+def _character_system_prompt(setting: str) -> str:
+    """角色设计的 system 消息：固定的字段要求在前、故事背景在后，不含具体角色信息，
+    同一背景下的所有角色共用完全相同的前缀（可命中上游的前缀缓存）
+    """
+    return f"""
+        你是一个专业的角色设计师，请根据故事背景和用户给出的角色信息创建一个完整的角色设定。
 
         请生成详细的角色设定，包括以下字段：
         1. basic_info（基本信息）:
@@ -104,48 +110,56 @@ async def generate_character(request: CharacterGenerateRequest):
            - catchphrase: 标志性台词
            - communication_style: 沟通风格
 
+        故事背景：{setting}
+
         请以JSON格式返回，确保所有字段都有内容，便于后续使用。
         """
 
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": f"请为我创建一个{request.type}角色。"}
-        ]
+def _character_messages(spec: CharacterSpec, setting: str) -> List[Dict[str, str]]:
+    user_prompt = f"""请为我创建一个{spec.type}角色：
+角色姓名：{spec.name or '待定'}
+角色类型：{spec.type}
+年龄段：{spec.age or '不限'}
+性别：{spec.gender or '不限'}
+性格特征：{spec.personality or '待定'}
+额外描述：{spec.description or '无'}"""
+
+    return [
+        {"role": "system", "content": _character_system_prompt(setting)},
+        {"role": "user", "content": user_prompt}
+    ]
+
+def _parse_character(content: str, name: Optional[str], source: str) -> Dict[str, Any]:
+    """解析角色设定JSON，失败时保留原文"""
+    extraction = extract_json(content, source=source, expect=dict)
+    if extraction.ok:
+        return extraction.value
+    return {
+        "raw_content": extraction.text,
+        "basic_info": {"name": name or "未命名角色"},
+        "appearance": {"description": "详细外貌见原文内容"},
+        "personality": {"description": "详细性格见原文内容"},
+        "background": {"description": "详细背景见原文内容"}
+    }
+
+@router.post("/generate", response_model=CharacterResponse)
+async def generate_character(request: CharacterGenerateRequest):
+    """生成角色设定"""
+    try:
+        # 直接使用 GLM-4.6 生成角色，不依赖MCP
+        background_materials = []
 
         response = await zhipu_service.chat_completion(
             model="glm-4.6",
-            messages=messages,
+            messages=_character_messages(request, request.setting),
             max_tokens=3000,
+            cache=request.use_cache,
             thinking={"type": "disabled"}
         )
 
         message = response.get("choices", [{}])[0].get("message", {})
         content = message.get("content", "") or message.get("reasoning_content", "")
-        
-        # 清理markdown代码块
-        content = content.strip()
-        if content.startswith("```json"):
-            content = content[7:]
-        if content.startswith("```"):
-            content = content[3:]
-        if content.endswith("```"):
-            content = content[:-3]
-        content = content.strip()
-
-        try:
-            import json
-            character_data = json.loads(content)
-            print(f"[DEBUG] Character parsed successfully")
-        except Exception as e:
-            print(f"[ERROR] JSON parse failed: {str(e)}")
-            print(f"[DEBUG] Content: {content[:500]}")
-            character_data = {
-                "raw_content": content,
-                "basic_info": {"name": request.name or "未命名角色"},
-                "appearance": {"description": "详细外貌见原文内容"},
-                "personality": {"description": "详细性格见原文内容"},
-                "background": {"description": "详细背景见原文内容"}
-            }
+        character_data = _parse_character(content, request.name, "character.generate")
 
         return CharacterResponse(
             success=True,
@@ -158,6 +172,89 @@ async def generate_character(request: CharacterGenerateRequest):
             detail=f"角色生成失败: {str(e)}"
         )
 
+@router.post("/generate/stream")
+async def generate_character_stream(request: CharacterGenerateRequest):
+    """流式生成角色设定：每个顶层字段（basic_info、appearance ...）生成完毕即推送
+
+    SSE事件：field（{"key", "value"}）/ heartbeat / result（完整角色设定）/ usage / done / error
+    """
+    events = stream_json_events(
+        zhipu_service.stream_chat_completion(
+            model="glm-4.6",
+            messages=_character_messages(request, request.setting),
+            max_tokens=3000,
+            thinking={"type": "disabled"}
+        ),
+        mode="fields",
+        event_name="field"
+    )
+    return StreamingResponse(event_stream(events), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@router.post("/generate/batch")
+async def generate_character_batch(request: CharacterBatchRequest):
+    """批量生成角色设定：同一故事背景下的多个角色并发生成（受密钥池并发限额约束），每完成一个即推送
+
+    SSE事件：character（{"index", "name", "character", "character_id"?}）/ character_error（{"index", "name", "error"}）/
+    heartbeat / summary（成功数、失败数、耗时、用量）/ done / error
+    """
+    if not request.characters:
+        raise HTTPException(status_code=400, detail="至少需要1个角色")
+    if len(request.characters) > settings.character_batch_max_size:
+        raise HTTPException(status_code=400, detail=f"单次最多生成{settings.character_batch_max_size}个角色")
+    if request.project_id:
+        try:
+            await project_store.get_project(request.project_id)
+        except NotFoundError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+
+    async def events():
+        started = time.perf_counter()
+        succeeded = failed = 0
+        usage = {"prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+        async for index, response, error in zhipu_service.batch_chat_completion(
+            [_character_messages(spec, request.setting) for spec in request.characters],
+            model="glm-4.6",
+            max_tokens=3000,
+            cache=request.use_cache,
+            thinking={"type": "disabled"}
+        ):
+            spec = request.characters[index]
+            if error:
+                failed += 1
+                yield StreamEvent("character_error", data={"index": index, "name": spec.name, "error": error})
+                continue
+
+            message = response.get("choices", [{}])[0].get("message", {})
+            content = message.get("content", "") or message.get("reasoning_content", "")
+            character = _parse_character(content, spec.name, "character.batch")
+            data = {"index": index, "name": spec.name, "character": character}
+            if request.project_id:
+                name = (character.get("basic_info") or {}).get("name") or spec.name or "未命名角色"
+                try:
+                    saved = await project_store.save_character(request.project_id, name=name, data=character)
+                    data["character_id"] = saved["id"]
+                except Exception as e:
+                    print(f"[WARN] Saving batch character {index + 1} failed: {str(e)}")
+                    data["save_error"] = str(e)
+
+            succeeded += 1
+            response_usage = response.get("usage") or {}
+            usage["prompt_tokens"] += response_usage.get("prompt_tokens", 0)
+            usage["completion_tokens"] += response_usage.get("completion_tokens", 0)
+            usage["cached_tokens"] += (response_usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+            yield StreamEvent("character", data=data)
+
+        yield StreamEvent("summary", data={
+            "total": len(request.characters),
+            "succeeded": succeeded,
+            "failed": failed,
+            "elapsed": round(time.perf_counter() - started, 2),
+            "usage": usage
+        })
+        yield StreamEvent("done", finish_reason="stop" if succeeded else "error")
+
+    return StreamingResponse(event_stream(events()), media_type="text/event-stream", headers=SSE_HEADERS)
+
 @router.post("/image", response_model=CharacterImageResponse)
 async def generate_character_image(request: CharacterImageRequest):
     """生成角色立绘"""
@@ -212,6 +309,7 @@ async def generate_character_image(request: CharacterImageRequest):
         )
 
 @router.get("/types")
+@catalog
 async def get_character_types():
     """获取角色类型列表"""
     return {
@@ -228,6 +326,7 @@ async def get_character_types():
     }
 
 @router.get("/traits")
+@catalog
 async def get_character_traits():
     """获取角色特征库"""
     return {
@@ -3,6 +3,7 @@ from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Optional
 from services.zhipu_service import zhipu_service
+from services.sse import event_stream, SSE_HEADERS
 
 router = APIRouter()
 
@@ -14,14 +15,11 @@ class CharacterStreamRequest(BaseModel):
 
 @router.post("/stream")
 async def generate_character_stream(request: CharacterStreamRequest):
-    """流式生成角色"""
-    async def generate():
-        async for chunk in zhipu_service.generate_character_stream(
-            character_type=request.type,
-            setting=request.setting,
-            name=request.name,
-            description=request.description
-        ):
-            yield chunk
-    
-    return StreamingResponse(generate(), media_type="text/plain")
+    """流式生成角色（SSE事件：delta / heartbeat / usage / done / error）"""
+    events = zhipu_service.generate_character_stream(
+        character_type=request.type,
+        setting=request.setting,
+        name=request.name,
+        description=request.description
+    )
+    return StreamingResponse(event_stream(events), media_type="text/event-stream", headers=SSE_HEADERS)
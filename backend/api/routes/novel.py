@@ -3,6 +3,12 @@ from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
 from services.zhipu_service import zhipu_service
 from services.mcp_service import mcp_service
+from services.summarizer import manuscript_summarizer, split_recent
+from services.retrieval import retrieval_service
+from services.project_store import project_store, NotFoundError
+from utils.config import settings
+from utils.json_extract import extract_json
+from utils.responses import catalog
 
 router = APIRouter()
 
@@ -23,6 +29,7 @@ class OutlineRequest(BaseModel):
     style: str  # 风格
     keywords: List[str]  # 关键词
     target_length: str = "medium"  # 目标长度
+    use_cache: bool = False  # 允许复用相同请求的缓存结果
 
 class OutlineResponse(BaseModel):
     success: bool
@@ -31,19 +38,26 @@ class OutlineResponse(BaseModel):
     error: Optional[str] = None
 
 class ChapterContinueRequest(BaseModel):
-    previous_content: str  # 前文内容
+    previous_content: Optional[str] = None  # 前文内容（传 project_id / chapter_id 时可省略）
+    project_id: Optional[str] = None  # 以项目已保存的章节作为前文
+    chapter_id: Optional[str] = None  # 前文截止到该章节（含）；不传 project_id 时仅以该章节作为前文
+    save_as_chapter: bool = False  # 将续写结果保存为项目的新章节
     continuation_direction: Optional[str] = None  # 续写方向提示
     target_length: int = 1000  # 目标字数
+    use_cache: bool = False  # 允许复用相同请求的缓存结果
 
 class ChapterContinueResponse(BaseModel):
     success: bool
     continued_content: Optional[str] = None
+    chapter_id: Optional[str] = None  # 保存为新章节时的章节ID
     error: Optional[str] = None
 
 class StyleAdjustRequest(BaseModel):
-    content: str  # 原始内容
+    content: Optional[str] = None  # 原始内容（传 chapter_id 时可省略）
+    chapter_id: Optional[str] = None  # 调整已保存章节的正文
     target_style: str  # 目标风格
     style_description: Optional[str] = None  # 风格描述
+    use_cache: bool = False  # 允许复用相同请求的缓存结果
 
 class StyleAdjustResponse(BaseModel):
     success: bool
@@ -81,6 +95,7 @@ async def generate_novel(request: NovelGenerateRequest):
         )
 
 @router.get("/genres")
+@catalog
 async def get_novel_genres():
     """获取小说类型列表"""
     return {
@@ -132,31 +147,15 @@ async def generate_outline(request: OutlineRequest):
             model="glm-4.6",
             messages=messages,
             max_tokens=3000,
+            cache=request.use_cache,
             thinking={"type": "disabled"}
         )
 
         message = response.get("choices", [{}])[0].get("message", {})
         content = message.get("content", "") or message.get("reasoning_content", "")
 
-        # 清理markdown代码块
-        content = content.strip()
-        if content.startswith("```json"):
-            content = content[7:]
-        if content.startswith("```"):
-            content = content[3:]
-        if content.endswith("```"):
-            content = content[:-3]
-        content = content.strip()
-
-        # 尝试解析JSON
-        try:
-            import json
-            outline_data = json.loads(content)
-            print(f"[DEBUG] Outline parsed successfully")
-        except Exception as e:
-            print(f"[ERROR] Outline JSON parse failed: {str(e)}")
-            print(f"[DEBUG] Content: {content[:500]}")
-            outline_data = {"raw_content": content}
+        extraction = extract_json(content, source="novel.outline")
+        outline_data = extraction.value if extraction.ok else {"raw_content": extraction.text}
 
         return OutlineResponse(
             success=True,
@@ -172,44 +171,24 @@ async def generate_outline(request: OutlineRequest):
 @router.post("/continue", response_model=ChapterContinueResponse)
 async def continue_chapter(request: ChapterContinueRequest):
     """章节续写"""
+    if request.save_as_chapter and not request.project_id:
+        raise HTTPException(status_code=400, detail="保存为新章节需要提供 project_id")
+    previous_content = await _resolve_previous_content(request)
     try:
-        # 使用 context7 MCP 进行长文本增强处理
-        context_enhanced_content = await enhance_long_text_context(request.previous_content)
+        continued_content = await write_continuation(request, previous_content)
 
-        system_prompt = f"""
-        你是一个专业小说家，请根据已有内容续写故事。
-
-        前文内容：
-        {context_enhanced_content}
-
-        续写要求：
-        {f"方向提示：{request.continuation_direction}" if request.continuation_direction else "请自然延续故事情节"}
-        目标字数：约{request.target_length}字
-        保持与前文一致的文风和人物性格
-        情节发展要合理，保持故事的连贯性
-        适当增加细节描写和心理活动
-
-        请直接输出续写内容，不要添加任何说明或标题。
-        """
-
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": "请续写下一章节。"}
-        ]
-
-        response = await zhipu_service.chat_completion(
-            model="glm-4.6",
-            messages=messages,
-            max_tokens=2000,
-            thinking={"type": "disabled"}
-        )
-
-        message = response.get("choices", [{}])[0].get("message", {})
-        continued_content = message.get("content", "") or message.get("reasoning_content", "")
+        chapter_id = None
+        if request.project_id and request.save_as_chapter and continued_content:
+            # 前文截止到某章时，新章节插在该章之后，而不是追加到项目末尾
+            chapter = await project_store.add_chapter(
+                request.project_id, content=continued_content, after_chapter_id=request.chapter_id
+            )
+            chapter_id = chapter["id"]
 
         return ChapterContinueResponse(
             success=True,
-            continued_content=continued_content
+            continued_content=continued_content,
+            chapter_id=chapter_id
         )
     except Exception as e:
         raise HTTPException(
@@ -220,6 +199,7 @@ async def continue_chapter(request: ChapterContinueRequest):
 @router.post("/rewrite", response_model=StyleAdjustResponse)
 async def adjust_style(request: StyleAdjustRequest):
     """风格调整"""
+    content = await _resolve_text(request.content, request.chapter_id)
     try:
         system_prompt = f"""
         你是一个专业文学编辑，请将以下文本调整为{request.target_style}风格。
@@ -234,7 +214,7 @@ async def adjust_style(request: StyleAdjustRequest):
         5. 适当增加该风格特色的表现手法
 
         原文内容：
-        {request.content}
+        {content}
 
         请直接输出调整后的文本，不要添加任何说明。
         """
@@ -248,6 +228,7 @@ async def adjust_style(request: StyleAdjustRequest):
             model="glm-4.6",
             messages=messages,
             max_tokens=2000,
+            cache=request.use_cache,
             thinking={"type": "disabled"}
         )
 
@@ -264,20 +245,94 @@ async def adjust_style(request: StyleAdjustRequest):
             detail=f"风格调整失败: {str(e)}"
         )
 
-async def enhance_long_text_context(content: str) -> str:
-    """使用context7增强长文本理解"""
+async def write_continuation(request: ChapterContinueRequest, previous_content: str) -> str:
+    """根据前文生成续写正文（只生成、不保存；续写接口和生成流水线共用）"""
+    # 长前文使用分层摘要 + 相关前文片段 + 末尾原文
+    related = await _related_passages(request, previous_content)
+    context_enhanced_content = await enhance_long_text_context(previous_content, related)
+
+    system_prompt = f"""
+        你是一个专业小说家，请根据已有内容续写故事。
+
+        前文内容：
+        {context_enhanced_content}
+
+        续写要求：
+        {f"方向提示：{request.continuation_direction}" if request.continuation_direction else "请自然延续故事情节"}
+        目标字数：约{request.target_length}字
+        保持与前文一致的文风和人物性格
+        情节发展要合理，保持故事的连贯性
+        适当增加细节描写和心理活动
+
+        请直接输出续写内容，不要添加任何说明或标题。
+        """
+
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": "请续写下一章节。"}
+    ]
+
+    response = await zhipu_service.chat_completion(
+        model="glm-4.6",
+        messages=messages,
+        max_tokens=2000,
+        cache=request.use_cache,
+        thinking={"type": "disabled"}
+    )
+
+    message = response.get("choices", [{}])[0].get("message", {})
+    return message.get("content", "") or message.get("reasoning_content", "")
+
+async def _resolve_text(content: Optional[str], chapter_id: Optional[str]) -> str:
+    """请求中的正文或章节ID → 正文"""
     try:
-        # 模拟context7功能，实际应调用真实的context7 MCP服务
-        # 这里简化为内容摘要，保持主要情节线索
-        if len(content) > 2000:
-            # 提取前500字和后500字，中间用省略号连接
-            summary = content[:500] + "\n\n[前文概要：此处省略中间内容，主要情节发展...]\n\n" + content[-500:]
-            return summary
-        return content
-    except:
+        text, _ = await project_store.resolve_text(content, chapter_id)
+        return text
+    except NotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def _resolve_previous_content(request: ChapterContinueRequest) -> str:
+    """续写前文：项目章节（可截止到某章）、单个章节或请求中的正文"""
+    if not request.project_id:
+        return await _resolve_text(request.previous_content, request.chapter_id)
+    try:
+        return await project_store.manuscript(request.project_id, request.chapter_id)
+    except NotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+async def _related_passages(request: ChapterContinueRequest, previous_content: str) -> Optional[str]:
+    """以末尾原文为查询，从项目章节索引中检索相关的较早片段（只用于项目前文，失败时忽略）"""
+    if not (settings.retrieval_enabled and request.project_id) or len(previous_content) <= settings.summary_trigger_chars:
+        return None
+    try:
+        _, recent = split_recent(previous_content, settings.summary_recent_chars)
+        passages = await retrieval_service.related_passages(
+            request.project_id,
+            recent,
+            until_chapter_id=request.chapter_id,
+            recent_chars=settings.summary_recent_chars
+        )
+        return retrieval_service.format_passages(passages) or None
+    except Exception as e:
+        print(f"[WARN] Passage retrieval failed: {str(e)}")
+        return None
+
+async def enhance_long_text_context(content: str, related: Optional[str] = None) -> str:
+    """长文本前文处理：较早部分替换为分层摘要（按分块缓存），插入相关前文片段，保留末尾原文"""
+    if len(content) <= settings.summary_trigger_chars:
         return content
+    try:
+        return await manuscript_summarizer.build_context(content, related)
+    except Exception as e:
+        print(f"[WARN] Manuscript summarization failed, falling back to head/tail: {str(e)}")
+        # 摘要失败时提取前500字和后500字，中间用省略号连接
+        middle = f"【相关前文片段】\n{related}" if related else "[前文概要：此处省略中间内容，主要情节发展...]"
+        return content[:500] + "\n\n" + middle + "\n\n" + content[-500:]
 
 @router.get("/styles")
+@catalog
 async def get_novel_styles():
     """获取小说风格列表"""
     return {
@@ -3,6 +3,7 @@ from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Optional
 from services.zhipu_service import zhipu_service
+from services.sse import event_stream, SSE_HEADERS
 
 router = APIRouter()
 
@@ -15,15 +16,12 @@ class NovelStreamRequest(BaseModel):
 
 @router.post("/stream")
 async def generate_novel_stream(request: NovelStreamRequest):
-    """流式生成小说"""
-    async def generate():
-        async for chunk in zhipu_service.generate_novel_stream(
-            genre=request.genre,
-            theme=request.theme,
-            length=request.length,
-            style=request.style,
-            prompt=request.prompt
-        ):
-            yield chunk
-    
-    return StreamingResponse(generate(), media_type="text/plain")
+    """流式生成小说（SSE事件：delta / heartbeat / usage / done / error）"""
+    events = zhipu_service.generate_novel_stream(
+        genre=request.genre,
+        theme=request.theme,
+        length=request.length,
+        style=request.style,
+        prompt=request.prompt
+    )
+    return StreamingResponse(event_stream(events), media_type="text/event-stream", headers=SSE_HEADERS)
@@ -0,0 +1,233 @@
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel
+from typing import Optional, List, Dict, Any
+from services.pipeline import pipeline_engine, Stage, StageContext
+from services.project_store import project_store, NotFoundError
+from api.routes.novel import generate_outline, write_continuation, OutlineRequest, ChapterContinueRequest
+from api.routes.script import convert_to_script, ScriptConvertRequest
+from api.routes.storyboard import generate_storyboard, generate_storyboard_images, StoryboardGenerateRequest
+from services.video_jobs import video_job_manager, SUCCESS, FAILED as JOB_FAILED
+from utils.config import settings
+import json
+
+router = APIRouter()
+
+class PipelineRequest(BaseModel):
+    genre: str  # 题材
+    style: str  # 风格
+    keywords: List[str]  # 关键词
+    target_length: str = "medium"  # 大纲目标长度
+    project_id: Optional[str] = None  # 章节保存到已有项目（为空时新建项目）
+    title: Optional[str] = None  # 新建项目的标题
+    chapters: int = 3  # 生成章节数
+    chapter_length: int = 1000  # 每章目标字数
+    chapter_directions: Optional[List[str]] = None  # 各章方向提示（缺省时取大纲中的章节大纲）
+    script_format: str = "standard"  # 剧本格式
+    storyboard_style: str = "cinematic"  # 分镜风格
+    shots: int = 6  # 每章镜头数量
+    image_size: str = "1024x1024"  # 分镜图片尺寸
+    generate_video: bool = True  # 是否为每章生成视频
+    video_prompt: str = "让画面动起来，展现分镜内容"
+    use_cache: bool = False  # 允许复用相同请求的缓存结果
+
+# ---- 阶段 ----
+# outline → chapter:1 → chapter:2 → ...（章节依次续写）
+# chapter:N → script:N → storyboard:N → images:N → video:N（各章的后续阶段互不依赖，并发执行）
+
+def _chapter_direction(params: Dict[str, Any], outline: Dict[str, Any], number: int) -> str:
+    """第N章的续写方向：请求中的方向提示 > 大纲中的章节大纲 > 通用提示"""
+    directions = params.get("chapter_directions") or []
+    if number <= len(directions) and directions[number - 1]:
+        return directions[number - 1]
+    for key, value in outline.items():
+        if "章节" in key and isinstance(value, list) and number <= len(value):
+            item = value[number - 1]
+            return f"第{number}章：" + (item if isinstance(item, str) else json.dumps(item, ensure_ascii=False))
+    return f"第{number}章，按照大纲推进情节"
+
+async def _outline_stage(context: StageContext) -> Dict[str, Any]:
+    params = context.params
+    response = await generate_outline(OutlineRequest(
+        genre=params["genre"],
+        style=params["style"],
+        keywords=params["keywords"],
+        target_length=params["target_length"],
+        use_cache=params["use_cache"]
+    ))
+    return {"outline": response.outline}
+
+async def _chapter_stage(context: StageContext, number: int) -> Dict[str, Any]:
+    """续写第N章并保存：只调用生成函数，保存由本阶段负责（插在上一章之后）"""
+    params = context.params
+    outline = context.outputs["outline"]["outline"]
+    request = ChapterContinueRequest(
+        continuation_direction=_chapter_direction(params, outline, number),
+        target_length=params["chapter_length"],
+        use_cache=params["use_cache"]
+    )
+    previous_chapter_id = None
+    if number == 1:
+        previous_content = "故事大纲：\n" + json.dumps(outline, ensure_ascii=False, indent=2)
+    else:
+        # 以项目中截止到上一章的正文作为前文（长前文自动使用摘要和相关片段）
+        previous_chapter_id = context.outputs[f"chapter:{number - 1}"]["chapter_id"]
+        request.project_id = context.project_id
+        request.chapter_id = previous_chapter_id
+        previous_content = await project_store.manuscript(context.project_id, previous_chapter_id)
+    content = await write_continuation(request, previous_content)
+    if not content:
+        raise Exception("续写结果为空")
+    chapter = await project_store.add_chapter(
+        context.project_id, content, title=f"第{number}章", after_chapter_id=previous_chapter_id
+    )
+    return {"chapter_id": chapter["id"], "title": chapter["title"], "chars": chapter["char_count"]}
+
+async def _script_stage(context: StageContext, number: int) -> Dict[str, Any]:
+    params = context.params
+    response = await convert_to_script(ScriptConvertRequest(
+        chapter_id=context.outputs[f"chapter:{number}"]["chapter_id"],
+        format=params["script_format"],
+        use_cache=params["use_cache"]
+    ))
+    if not response.script_id:
+        raise Exception("剧本转换结果为空")
+    return {"script_id": response.script_id, "reused": response.reused, "chars": len(response.script or "")}
+
+async def _storyboard_stage(context: StageContext, number: int) -> Dict[str, Any]:
+    params = context.params
+    response = await generate_storyboard(StoryboardGenerateRequest(
+        script_id=context.outputs[f"script:{number}"]["script_id"],
+        style=params["storyboard_style"],
+        shots=params["shots"],
+        use_cache=params["use_cache"]
+    ))
+    if not response.storyboard_id:
+        raise Exception("分镜结果无法解析")
+    return {"storyboard_id": response.storyboard_id, "reused": response.reused, "shots": response.storyboard}
+
+async def _images_stage(context: StageContext, number: int) -> Dict[str, Any]:
+    """全部镜头并发生图；每批结果立即写入检查点，重新执行时只补生成失败的镜头"""
+    shots = [
+        {**shot, "shot_number": shot.get("shot_number", i + 1)}
+        for i, shot in enumerate(context.outputs[f"storyboard:{number}"]["shots"])
+    ]
+    order = {shot["shot_number"]: i for i, shot in enumerate(shots)}
+    images = list((context.previous or {}).get("images", []))
+    done = {image["shot_number"] for image in images}
+    remaining = [shot for shot in shots if shot["shot_number"] not in done]
+
+    generated = 0
+    if remaining:
+        result = await generate_storyboard_images({"shots": remaining, "size": context.params["image_size"]})
+        generated = len(result["images"])
+        images = sorted(images + result["images"], key=lambda image: order.get(image["shot_number"], 0))
+        await context.checkpoint({"images": images})
+        if result["failures"]:
+            failures = result["failures"]
+            raise Exception(f"{len(failures)}个镜头图片生成失败: {failures[0]['error']}")
+    return {"images": images, "generated": generated}
+
+async def _video_stage(context: StageContext, number: int) -> Dict[str, Any]:
+    """提交首尾帧视频任务，等待渲染期间让出阶段槽位；任务ID写入检查点，重新执行时复用未失败的任务"""
+    images = [image["image_url"] for image in context.outputs[f"images:{number}"]["images"]]
+    if len(images) < 2:
+        raise Exception("至少需要2张图片生成视频")
+    job = None
+    job_id = (context.previous or {}).get("job_id")
+    if job_id:
+        job = video_job_manager.get(job_id)
+        if job and job.status == JOB_FAILED:
+            job = None
+    if job is None:
+        job = await video_job_manager.submit(
+            image_urls=[images[0], images[-1]],
+            prompt=context.params["video_prompt"]
+        )
+        await context.checkpoint({"job_id": job.id})
+
+    async with context.yield_slot():
+        job = await video_job_manager.wait(job.id, timeout=settings.video_job_timeout)
+    if not job.finished:
+        raise Exception(f"视频渲染超时（任务 {job.id} 仍在处理，重新执行时继续等待）")
+    if job.status != SUCCESS:
+        raise Exception(job.error or "视频生成失败")
+    return {"job_id": job.id, "video_url": job.video_url, "first_frame": images[0], "last_frame": images[-1]}
+
+def _build_stages(params: Dict[str, Any]) -> List[Stage]:
+    stages = [Stage("outline", _outline_stage)]
+    for n in range(1, params["chapters"] + 1):
+        chapter_deps = ["outline"] if n == 1 else ["outline", f"chapter:{n - 1}"]
+        stages.append(Stage(f"chapter:{n}", lambda context, n=n: _chapter_stage(context, n), chapter_deps))
+        stages.append(Stage(f"script:{n}", lambda context, n=n: _script_stage(context, n), [f"chapter:{n}"]))
+        stages.append(Stage(f"storyboard:{n}", lambda context, n=n: _storyboard_stage(context, n), [f"script:{n}"]))
+        stages.append(Stage(f"images:{n}", lambda context, n=n: _images_stage(context, n), [f"storyboard:{n}"]))
+        if params["generate_video"]:
+            stages.append(Stage(f"video:{n}", lambda context, n=n: _video_stage(context, n), [f"images:{n}"]))
+    return stages
+
+# ---- 接口 ----
+
+@router.post("/runs")
+async def create_pipeline_run(request: PipelineRequest):
+    """创建并在后台执行流水线：大纲 → 章节 → 剧本 → 分镜 → 分镜图片 → 视频，立即返回流水线状态"""
+    if not 1 <= request.chapters <= settings.pipeline_max_chapters:
+        raise HTTPException(status_code=400, detail=f"章节数需在1到{settings.pipeline_max_chapters}之间")
+    if request.project_id:
+        try:
+            await project_store.get_project(request.project_id)
+        except NotFoundError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+
+    try:
+        project_id = request.project_id
+        if not project_id:
+            project = await project_store.create_project(
+                title=request.title or f"{request.genre}：{'、'.join(request.keywords)}",
+                genre=request.genre,
+                style=request.style
+            )
+            project_id = project["id"]
+        params = request.model_dump(exclude={"project_id", "title"})
+        run = await pipeline_engine.store.create_run(params, project_id=project_id)
+        pipeline_engine.start(run, _build_stages(params))
+        return {"success": True, **await pipeline_engine.describe(run["id"])}
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"流水线创建失败: {str(e)}"
+        )
+
+@router.get("/runs")
+async def list_pipeline_runs(limit: int = 50, offset: int = 0):
+    """获取流水线列表"""
+    runs = await pipeline_engine.store.list_runs(limit=min(limit, 200), offset=offset)
+    for run in runs:
+        run["active"] = pipeline_engine.is_active(run["id"])
+    return {"runs": runs}
+
+@router.get("/runs/{run_id}")
+async def get_pipeline_run(run_id: str):
+    """获取流水线状态：各阶段状态、产出、耗时和执行次数"""
+    try:
+        return await pipeline_engine.describe(run_id)
+    except NotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@router.post("/runs/{run_id}/resume")
+async def resume_pipeline_run(run_id: str):
+    """从检查点继续执行：已完成的阶段跳过，失败和被阻塞的阶段重新执行"""
+    try:
+        run = await pipeline_engine.store.get_run(run_id)
+    except NotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    if pipeline_engine.is_active(run_id):
+        raise HTTPException(status_code=409, detail="流水线正在执行中")
+
+    try:
+        pipeline_engine.start(run, _build_stages(run["params"]))
+        return {"success": True, **await pipeline_engine.describe(run_id)}
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"流水线继续执行失败: {str(e)}"
+        )
@@ -0,0 +1,208 @@
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel
+from typing import Optional, Dict, Any
+from services.project_store import project_store, NotFoundError
+from services.retrieval import retrieval_service
+
+router = APIRouter()
+
+class ProjectCreateRequest(BaseModel):
+    title: str  # 项目名称
+    description: Optional[str] = None  # 项目简介
+    genre: Optional[str] = None  # 小说类型
+    style: Optional[str] = None  # 写作风格
+
+class ProjectUpdateRequest(BaseModel):
+    title: Optional[str] = None
+    description: Optional[str] = None
+    genre: Optional[str] = None
+    style: Optional[str] = None
+
+class ChapterCreateRequest(BaseModel):
+    content: str  # 章节正文
+    title: Optional[str] = None  # 章节标题
+    position: Optional[int] = None  # 章节序号（为空时追加到末尾）
+
+class ChapterUpdateRequest(BaseModel):
+    content: Optional[str] = None
+    title: Optional[str] = None
+    position: Optional[int] = None
+
+class CharacterSaveRequest(BaseModel):
+    name: str  # 角色姓名
+    data: Dict[str, Any]  # 角色设定（/api/character/generate 的结果）
+
+@router.post("")
+async def create_project(request: ProjectCreateRequest):
+    """创建项目"""
+    try:
+        return await project_store.create_project(
+            title=request.title,
+            description=request.description,
+            genre=request.genre,
+            style=request.style
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"创建项目失败: {str(e)}")
+
+@router.get("")
+async def list_projects(limit: int = 50, offset: int = 0):
+    """项目列表（按最近更新排序）"""
+    try:
+        return {"projects": await project_store.list_projects(limit=limit, offset=offset)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取项目列表失败: {str(e)}")
+
+@router.get("/{project_id}")
+async def get_project(project_id: str):
+    """项目详情：章节目录（不含正文）、角色、剧本/分镜数量"""
+    try:
+        return await project_store.get_project(project_id)
+    except NotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取项目失败: {str(e)}")
+
+@router.patch("/{project_id}")
+async def update_project(project_id: str, request: ProjectUpdateRequest):
+    """更新项目信息"""
+    try:
+        return await project_store.update_project(project_id, **request.model_dump())
+    except NotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"更新项目失败: {str(e)}")
+
+@router.delete("/{project_id}")
+async def delete_project(project_id: str):
+    """删除项目（章节、角色、剧本、分镜一并删除）"""
+    try:
+        await project_store.delete_project(project_id)
+        retrieval_service.drop(project_id)
+        return {"success": True}
+    except NotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"删除项目失败: {str(e)}")
+
+@router.post("/{project_id}/chapters")
+async def add_chapter(project_id: str, request: ChapterCreateRequest):
+    """添加章节"""
+    try:
+        return await project_store.add_chapter(
+            project_id,
+            content=request.content,
+            title=request.title,
+            position=request.position
+        )
+    except NotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"添加章节失败: {str(e)}")
+
+@router.get("/{project_id}/chapters/{chapter_id}")
+async def get_chapter(project_id: str, chapter_id: str):
+    """获取章节正文"""
+    try:
+        chapter = await project_store.get_chapter(chapter_id)
+        if chapter["project_id"] != project_id:
+            raise NotFoundError("章节不存在")
+        return chapter
+    except NotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取章节失败: {str(e)}")
+
+@router.put("/{project_id}/chapters/{chapter_id}")
+async def update_chapter(project_id: str, chapter_id: str, request: ChapterUpdateRequest):
+    """更新章节（正文、标题或序号）"""
+    try:
+        chapter = await project_store.get_chapter(chapter_id)
+        if chapter["project_id"] != project_id:
+            raise NotFoundError("章节不存在")
+        return await project_store.update_chapter(
+            chapter_id,
+            content=request.content,
+            title=request.title,
+            position=request.position
+        )
+    except NotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"更新章节失败: {str(e)}")
+
+@router.delete("/{project_id}/chapters/{chapter_id}")
+async def delete_chapter(project_id: str, chapter_id: str):
+    """删除章节"""
+    try:
+        chapter = await project_store.get_chapter(chapter_id)
+        if chapter["project_id"] != project_id:
+            raise NotFoundError("章节不存在")
+        await project_store.delete_chapter(chapter_id)
+        return {"success": True}
+    except NotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"删除章节失败: {str(e)}")
+
+@router.get("/{project_id}/characters")
+async def list_characters(project_id: str):
+    """项目角色列表"""
+    try:
+        return {"characters": await project_store.list_characters(project_id)}
+    except NotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取角色列表失败: {str(e)}")
+
+@router.post("/{project_id}/characters")
+async def save_character(project_id: str, request: CharacterSaveRequest):
+    """保存角色设定到项目"""
+    try:
+        return await project_store.save_character(project_id, name=request.name, data=request.data)
+    except NotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"保存角色失败: {str(e)}")
+
+@router.delete("/{project_id}/characters/{character_id}")
+async def delete_character(project_id: str, character_id: str):
+    """删除角色"""
+    try:
+        await project_store.delete_character(project_id, character_id)
+        return {"success": True}
+    except NotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"删除角色失败: {str(e)}")
+
+@router.get("/{project_id}/artifacts")
+async def list_artifacts(project_id: str):
+    """项目下已生成的剧本与分镜（不含正文）"""
+    try:
+        return await project_store.list_artifacts(project_id)
+    except NotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取生成记录失败: {str(e)}")
+
+@router.get("/{project_id}/search")
+async def search_passages(project_id: str, q: str, limit: int = 1500):
+    """在项目章节中检索与 q 相关的片段（BM25，本地索引）"""
+    try:
+        passages = await retrieval_service.related_passages(project_id, q, budget_chars=limit)
+        return {"query": q, "passages": passages}
+    except NotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"检索前文失败: {str(e)}")
+
+@router.get("/scripts/{script_id}")
+async def get_script(script_id: str):
+    """获取已保存的剧本"""
+    try:
+        return await project_store.get_script(script_id)
+    except NotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取剧本失败: {str(e)}")
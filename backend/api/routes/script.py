@@ -2,32 +2,61 @@ from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from typing import Optional, List
 from services.zhipu_service import zhipu_service
+from services.project_store import project_store, NotFoundError
+from utils.responses import catalog
 
 router = APIRouter()
 
 class ScriptConvertRequest(BaseModel):
-    content: str  # 原始文本内容
+    content: Optional[str] = None  # 原始文本内容（传 chapter_id 时可省略）
+    chapter_id: Optional[str] = None  # 转换已保存的章节；结果保存到项目，章节未修改时直接复用
+    regenerate: bool = False  # 忽略已保存的转换结果重新生成
     format: str = "standard"  # 剧本格式：standard、cinema、tv、theater
     characters: Optional[List[str]] = None  # 主要角色列表
+    use_cache: bool = False  # 允许复用相同请求的缓存结果
 
 class ScriptResponse(BaseModel):
     success: bool
     script: Optional[str] = None
+    script_id: Optional[str] = None  # 已保存的剧本ID（按章节转换时返回）
+    reused: bool = False  # 是否复用了已保存的结果
     error: Optional[str] = None
 
 @router.post("/convert", response_model=ScriptResponse)
 async def convert_to_script(request: ScriptConvertRequest):
     """将文本转换为剧本格式"""
     try:
+        content, chapter = await project_store.resolve_text(request.content, request.chapter_id)
+    except NotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        params = {"format": request.format, "characters": request.characters}
+        if chapter and not request.regenerate:
+            saved = await project_store.find_script(chapter["project_id"], content, params)
+            if saved:
+                return ScriptResponse(success=True, script=saved["content"], script_id=saved["id"], reused=True)
+
         script_content = await zhipu_service.convert_to_script(
-            content=request.content,
+            content=content,
             script_format=request.format,
-            characters=request.characters
+            characters=request.characters,
+            cache=request.use_cache
         )
 
+        script_id = None
+        if chapter and script_content:
+            saved = await project_store.save_script(
+                content, params, script_content, project_id=chapter["project_id"], chapter_id=chapter["id"]
+            )
+            script_id = saved["id"]
+
         return ScriptResponse(
             success=True,
-            script=script_content
+            script=script_content,
+            script_id=script_id
         )
     except Exception as e:
         raise HTTPException(
@@ -36,6 +65,7 @@ async def convert_to_script(request: ScriptConvertRequest):
         )
 
 @router.get("/formats")
+@catalog
 async def get_script_formats():
     """获取剧本格式列表"""
     return {
@@ -69,6 +99,7 @@ async def get_script_formats():
     }
 
 @router.get("/structure")
+@catalog
 async def get_script_structure():
     """获取剧本结构说明"""
     return {
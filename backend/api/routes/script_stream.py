@@ -3,6 +3,7 @@ from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, List
 from services.zhipu_service import zhipu_service
+from services.sse import event_stream, SSE_HEADERS
 
 router = APIRouter()
 
@@ -13,13 +14,10 @@ class ScriptStreamRequest(BaseModel):
 
 @router.post("/stream")
 async def convert_script_stream(request: ScriptStreamRequest):
-    """流式剧本转换"""
-    async def generate():
-        async for chunk in zhipu_service.convert_to_script_stream(
-            content=request.content,
-            script_format=request.script_format,
-            characters=request.characters
-        ):
-            yield chunk
-    
-    return StreamingResponse(generate(), media_type="text/plain")
+    """流式剧本转换（SSE事件：delta / heartbeat / usage / done / error）"""
+    events = zhipu_service.convert_to_script_stream(
+        content=request.content,
+        script_format=request.script_format,
+        characters=request.characters
+    )
+    return StreamingResponse(event_stream(events), media_type="text/event-stream", headers=SSE_HEADERS)
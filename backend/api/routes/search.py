@@ -3,6 +3,9 @@ from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
 from services.mcp_service import mcp_service
 from services.zhipu_service import zhipu_service
+from services.search_cache import search_cache, normalize_query
+from utils.json_extract import extract_json
+from utils.responses import catalog
 
 router = APIRouter()
 
@@ -32,6 +35,7 @@ class InspirationRequest(BaseModel):
     theme: Optional[str] = None  # 主题
     style: Optional[str] = None  # 风格
     keywords: Optional[List[str]] = None  # 关键词
+    use_cache: bool = False  # 允许复用相同请求的缓存结果
 
 class InspirationResponse(BaseModel):
     success: bool
@@ -53,12 +57,17 @@ class EnhancedSearchResponse(BaseModel):
 
 @router.post("/materials", response_model=MaterialSearchResponse)
 async def search_materials(request: MaterialSearchRequest):
-    """搜索创作素材"""
+    """搜索创作素材（结果按查询 + 素材类型缓存）"""
     try:
-        results = await mcp_service.search_materials(
-            query=request.query,
-            material_type=request.type,
-            limit=request.limit
+        results = await search_cache.get_or_fetch(
+            "materials",
+            (normalize_query(request.query), request.type),
+            lambda: mcp_service.search_materials(
+                query=request.query,
+                material_type=request.type,
+                limit=request.limit
+            ),
+            cacheable=bool
         )
 
         return MaterialSearchResponse(
@@ -74,8 +83,8 @@ async def search_materials(request: MaterialSearchRequest):
 
 @router.post("/enhanced-search", response_model=EnhancedSearchResponse)
 async def enhanced_search(request: EnhancedSearchRequest):
-    """增强搜索功能"""
-    try:
+    """增强搜索功能（结果按规范化后的查询缓存）"""
+    async def fetch():
         # 直接使用GLM-4-Air联网搜索
         search_result = await zhipu_service.web_search(
             query=request.query,
@@ -84,7 +93,7 @@ async def enhanced_search(request: EnhancedSearchRequest):
 
         if search_result and "choices" in search_result:
             content = search_result["choices"][0]["message"]["content"]
-            
+
             return EnhancedSearchResponse(
                 success=True,
                 results=[{
@@ -95,15 +104,23 @@ async def enhanced_search(request: EnhancedSearchRequest):
                 }],
                 summary=content[:500] if len(content) > 500 else content,
                 related_topics=[request.query]
-            )
+            ).model_dump(exclude_none=True)
         else:
             return EnhancedSearchResponse(
                 success=True,
                 results=[],
                 summary="搜索未找到相关结果",
                 related_topics=[]
-            )
+            ).model_dump(exclude_none=True)
 
+    try:
+        data = await search_cache.get_or_fetch(
+            "enhanced_search",
+            (normalize_query(request.query),),
+            fetch,
+            cacheable=lambda data: bool(data["results"])
+        )
+        return EnhancedSearchResponse(**data)
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -112,8 +129,8 @@ async def enhanced_search(request: EnhancedSearchRequest):
 
 @router.post("/hot-topics", response_model=HotTopicsResponse)
 async def get_hot_topics(request: HotTopicsRequest):
-    """获取热点话题"""
-    try:
+    """获取热点话题（按分类缓存，过期后先返回旧结果并后台刷新）"""
+    async def fetch():
         category_queries = {
             "social": "最新社会热点话题",
             "technology": "科技前沿热点趋势",
@@ -136,8 +153,7 @@ async def get_hot_topics(request: HotTopicsRequest):
             content = search_result["choices"][0]["message"]["content"]
 
             # 解析搜索结果为结构化数据
-            import json
-            topics_data = [
+            return [
                 {
                     "title": f"{request.category or '社会'}领域热点",
                     "heat": "高热度",
@@ -148,11 +164,6 @@ async def get_hot_topics(request: HotTopicsRequest):
                     "full_content": content
                 }
             ]
-
-            return HotTopicsResponse(
-                success=True,
-                topics=topics_data
-            )
         else:
             # MCP搜索失败，使用降级方案：直接生成热点话题
             fallback_prompt = f"""
@@ -178,18 +189,23 @@ async def get_hot_topics(request: HotTopicsRequest):
             )
             
             content = response["choices"][0]["message"]["content"]
-            try:
-                import json
-                topics_data = json.loads(content)
-                if not isinstance(topics_data, list):
-                    topics_data = [topics_data]
-            except:
-                topics_data = []
-            
-            return HotTopicsResponse(
-                success=True,
-                topics=topics_data
-            )
+            extraction = extract_json(content, source="search.hot_topics")
+            if extraction.ok:
+                return extraction.value if isinstance(extraction.value, list) else [extraction.value]
+            return []
+
+    try:
+        topics_data = await search_cache.get_or_fetch(
+            "hot_topics",
+            (normalize_query(request.category or "social"), request.limit),
+            fetch,
+            cacheable=bool
+        )
+
+        return HotTopicsResponse(
+            success=True,
+            topics=topics_data
+        )
 
     except Exception as e:
         raise HTTPException(
@@ -226,25 +242,16 @@ async def get_inspiration(request: InspirationRequest):
         response = await zhipu_service.chat_completion(
             model="glm-4.6",
             messages=messages,
-            max_tokens=3000
+            max_tokens=3000,
+            cache=request.use_cache
         )
 
         content = response["choices"][0]["message"]["content"]
-        content = content.strip()
-        if content.startswith("```json"):
-            content = content[7:]
-        if content.startswith("```"):
-            content = content[3:]
-        if content.endswith("```"):
-            content = content[:-3]
-        content = content.strip()
-
-        try:
-            import json
-            inspirations_data = json.loads(content)
-            if not isinstance(inspirations_data, list):
-                inspirations_data = [inspirations_data]
-        except:
+        extraction = extract_json(content, source="search.inspiration")
+        if extraction.ok:
+            inspirations_data = extraction.value if isinstance(extraction.value, list) else [extraction.value]
+        else:
+            content = extraction.text
             inspirations_data = [{
                 "title": "创作灵感",
                 "description": content[:500] if content else "请尝试修改搜索条件",
@@ -268,6 +275,7 @@ async def get_inspiration(request: InspirationRequest):
 class ImageAnalysisRequest(BaseModel):
     image_url: str  # 图片URL
     analysis_type: str = "composition"  # 分析类型：composition、style、character、scene
+    use_cache: bool = True  # 复用相同图片、相同分析类型的缓存结果
 
 @router.post("/analyze-image", response_model=Dict[str, Any])
 async def analyze_reference_image(request: ImageAnalysisRequest):
@@ -275,7 +283,8 @@ async def analyze_reference_image(request: ImageAnalysisRequest):
     try:
         result = await mcp_service.analyze_reference_image(
             image_url=request.image_url,
-            analysis_type=request.analysis_type
+            analysis_type=request.analysis_type,
+            cache=request.use_cache
         )
 
         return {
@@ -312,6 +321,7 @@ async def generate_visual_reference(request: VisualReferenceRequest):
         )
 
 @router.get("/search-categories")
+@catalog
 async def get_search_categories():
     """获取搜索分类"""
     return {
@@ -350,6 +360,7 @@ async def get_search_categories():
     }
 
 @router.get("/popular-searches")
+@catalog
 async def get_popular_searches():
     """获取热门搜索词"""
     return {
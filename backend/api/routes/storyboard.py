@@ -1,28 +1,45 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
 from services.zhipu_service import zhipu_service
 from services.mcp_service import mcp_service
-import uuid
+from services.video_jobs import video_job_manager
+from services.upload_service import upload_service, UploadTooLargeError, UnsupportedFileTypeError, InvalidUploadError
+from services.media_store import media_store
+from services.image_processor import image_processor
+from services.project_store import project_store, NotFoundError
+from services.sse import event_stream, SSE_HEADERS, StreamEvent
+from services.json_stream import stream_json_events
+from utils.json_extract import extract_json
+from utils.config import settings
+from utils.responses import catalog
+import json
 import os
 
 router = APIRouter()
 
 class StoryboardGenerateRequest(BaseModel):
-    script: str  # 剧本内容
+    script: Optional[str] = None  # 剧本内容（传 script_id 时可省略）
+    script_id: Optional[str] = None  # 使用已保存的剧本；结果保存到项目，相同参数直接复用
+    regenerate: bool = False  # 忽略已保存的分镜重新生成
     style: str = "cinematic"  # 分镜风格
     shots: int = 6  # 镜头数量
     scene_description: Optional[str] = None  # 场景描述
+    use_cache: bool = False  # 允许复用相同请求的缓存结果
 
 class StoryboardResponse(BaseModel):
     success: bool
     storyboard: Optional[List[Dict[str, Any]]] = None
+    storyboard_id: Optional[str] = None  # 已保存的分镜ID（按剧本ID生成时返回）
+    reused: bool = False  # 是否复用了已保存的结果
     error: Optional[str] = None
 
 class ReferenceAnalysisRequest(BaseModel):
     image_url: str  # 图片URL
     analysis_type: str = "composition"  # 分析类型：composition、lighting、color、style
     description: Optional[str] = None  # 额外描述
+    use_cache: bool = True  # 复用相同图片、相同分析要求的缓存结果
 
 class ReferenceAnalysisResponse(BaseModel):
     success: bool
@@ -33,22 +50,34 @@ class VideoAnalysisRequest(BaseModel):
     video_url: Optional[str] = None  # 视频URL
     analysis_focus: str = "storyboard"  # 分析重点：storyboard、cinematography、editing
     description: Optional[str] = None  # 额外描述
+    use_cache: bool = True  # 复用相同视频、相同分析要求的缓存结果
 
 class VideoAnalysisResponse(BaseModel):
     success: bool
     analysis: Optional[Dict[str, Any]] = None
     error: Optional[str] = None
 
-@router.post("/generate", response_model=StoryboardResponse)
-async def generate_storyboard(request: StoryboardGenerateRequest):
-    """生成分镜脚本"""
-    try:
-        # 使用 GLM-4.6 生成文字转分镜
-        system_prompt = f"""
+async def _resolve_script(request: StoryboardGenerateRequest) -> tuple:
+    """请求中的剧本或剧本ID → (剧本内容, 已保存的剧本记录或None)"""
+    if request.script_id:
+        try:
+            saved = await project_store.get_script(request.script_id)
+        except NotFoundError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        return saved["content"], saved
+    if not request.script:
+        raise HTTPException(status_code=400, detail="需要提供剧本内容或剧本ID")
+    return request.script, None
+
+def _storyboard_params(request: StoryboardGenerateRequest) -> Dict[str, Any]:
+    return {"style": request.style, "shots": request.shots, "scene_description": request.scene_description}
+
+def _storyboard_messages(request: StoryboardGenerateRequest, script: str) -> List[Dict[str, str]]:
+    system_prompt = f"""
         你是一个专业的分镜师，请根据以下剧本内容生成详细的分镜脚本：
 
         剧本内容：
-        {request.script}
+        {script}
 
         分镜风格：{request.style}
         镜头数量：{request.shots}
@@ -73,37 +102,36 @@ async def generate_storyboard(request: StoryboardGenerateRequest):
         以JSON数组格式返回分镜数据。
         """
 
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": "请为这段剧本生成分镜脚本。"}
-        ]
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": "请为这段剧本生成分镜脚本。"}
+    ]
 
+@router.post("/generate", response_model=StoryboardResponse)
+async def generate_storyboard(request: StoryboardGenerateRequest):
+    """生成分镜脚本"""
+    script, saved_script = await _resolve_script(request)
+    try:
+        if saved_script and not request.regenerate:
+            saved = await project_store.find_storyboard(
+                saved_script["project_id"], script, _storyboard_params(request)
+            )
+            if saved:
+                return StoryboardResponse(success=True, storyboard=saved["data"], storyboard_id=saved["id"], reused=True)
+
+        # 使用 GLM-4.6 生成文字转分镜
         response = await zhipu_service.chat_completion(
             model="glm-4.6",
-            messages=messages,
-            max_tokens=4000
+            messages=_storyboard_messages(request, script),
+            max_tokens=4000,
+            cache=request.use_cache
         )
 
         content = response["choices"][0]["message"]["content"]
         
-        # 清理markdown代码块
-        content = content.strip()
-        if content.startswith("```json"):
-            content = content[7:]
-        if content.startswith("```"):
-            content = content[3:]
-        if content.endswith("```"):
-            content = content[:-3]
-        content = content.strip()
-
-        # 尝试解析JSON
-        try:
-            import json
-            storyboard_data = json.loads(content)
-            
-            print(f"[DEBUG] Parsed storyboard data type: {type(storyboard_data)}")
-            print(f"[DEBUG] Storyboard data keys: {storyboard_data.keys() if isinstance(storyboard_data, dict) else 'is list'}")
-            
+        extraction = extract_json(content, source="storyboard.generate")
+        if extraction.ok:
+            storyboard_data = extraction.value
             if not isinstance(storyboard_data, list):
                 # 如果不是数组，尝试提取数组内容
                 if isinstance(storyboard_data, dict) and 'storyboard' in storyboard_data:
@@ -111,12 +139,8 @@ async def generate_storyboard(request: StoryboardGenerateRequest):
                 else:
                     # 可能是单个对象，包装成数组
                     storyboard_data = [storyboard_data]
-            
             print(f"[DEBUG] Final storyboard count: {len(storyboard_data)}")
-            
-        except Exception as e:
-            print(f"[ERROR] JSON parse failed: {str(e)}")
-            print(f"[DEBUG] Content preview: {content[:500]}")
+        else:
             # 如果JSON解析失败，返回原始内容
             storyboard_data = [
                 {
@@ -134,13 +158,22 @@ async def generate_storyboard(request: StoryboardGenerateRequest):
                     "composition": "-",
                     "mood": "-",
                     "note": "JSON解析失败，请查看raw_content字段",
-                    "raw_content": content
+                    "raw_content": extraction.text
                 }
             ]
 
+        storyboard_id = None
+        if saved_script and extraction.ok:
+            saved = await project_store.save_storyboard(
+                script, _storyboard_params(request), storyboard_data,
+                project_id=saved_script["project_id"], script_id=saved_script["id"]
+            )
+            storyboard_id = saved["id"]
+
         return StoryboardResponse(
             success=True,
-            storyboard=storyboard_data
+            storyboard=storyboard_data,
+            storyboard_id=storyboard_id
         )
     except Exception as e:
         raise HTTPException(
@@ -148,6 +181,24 @@ async def generate_storyboard(request: StoryboardGenerateRequest):
             detail=f"分镜生成失败: {str(e)}"
         )
 
+@router.post("/generate/stream")
+async def generate_storyboard_stream(request: StoryboardGenerateRequest):
+    """流式生成分镜脚本：每个镜头对象生成完毕即推送
+
+    SSE事件：shot（{"index", "value"}）/ heartbeat / result（完整分镜列表）/ usage / done / error
+    """
+    script, _ = await _resolve_script(request)
+    events = stream_json_events(
+        zhipu_service.stream_chat_completion(
+            model="glm-4.6",
+            messages=_storyboard_messages(request, script),
+            max_tokens=4000
+        ),
+        mode="items",
+        event_name="shot"
+    )
+    return StreamingResponse(event_stream(events), media_type="text/event-stream", headers=SSE_HEADERS)
+
 @router.post("/analyze", response_model=ReferenceAnalysisResponse)
 async def analyze_reference(request: ReferenceAnalysisRequest):
     """分析参考图片"""
@@ -190,7 +241,8 @@ async def analyze_reference(request: ReferenceAnalysisRequest):
         # 使用MAX密钥的图像理解功能
         analysis_text = await zhipu_service.analyze_image(
             image_url=request.image_url,
-            prompt=prompt
+            prompt=prompt,
+            cache=request.use_cache
         )
 
         return ReferenceAnalysisResponse(
@@ -241,7 +293,8 @@ async def analyze_video(request: VideoAnalysisRequest):
         # 使用MAX密钥的视频理解功能
         analysis_text = await zhipu_service.analyze_video(
             video_url=request.video_url,
-            prompt=prompt
+            prompt=prompt,
+            cache=request.use_cache
         )
 
         return VideoAnalysisResponse(
@@ -254,77 +307,82 @@ async def analyze_video(request: VideoAnalysisRequest):
             detail=f"视频分析失败: {str(e)}"
         )
 
-@router.post("/upload-image")
-async def upload_image(file: UploadFile = File(...)):
-    """上传图片文件"""
-    try:
-        # 创建上传目录
-        upload_dir = "uploads/storyboard"
-        os.makedirs(upload_dir, exist_ok=True)
+# 上传接口直接解析请求体流，在文档中声明 multipart 请求体
+_UPLOAD_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {"multipart/form-data": {"schema": {
+            "type": "object",
+            "required": ["file"],
+            "properties": {"file": {"type": "string", "format": "binary"}}
+        }}}
+    }
+}
 
-        # 生成唯一文件名
-        file_extension = os.path.splitext(file.filename)[1]
-        unique_filename = f"{uuid.uuid4()}{file_extension}"
-        file_path = os.path.join(upload_dir, unique_filename)
+@router.post("/upload-image", openapi_extra=_UPLOAD_BODY)
+async def upload_image(request: Request):
+    """上传图片文件（multipart 字段 file）"""
+    try:
+        # 边接收边写入磁盘，超过 max_file_size 立即中止
+        saved = await upload_service.save(request, max_size=settings.max_file_size)
 
-        # 保存文件
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
+        # 返回完整URL（按内容寻址，相同图片得到相同URL）
+        file_url = f"http://localhost:8000/uploads/{saved['path']}"
 
-        # 返回完整URL
-        file_url = f"http://localhost:8000/uploads/storyboard/{unique_filename}"
+        # 生成缩略图供前端列表展示
+        thumbnail = await image_processor.thumbnail(os.path.join(settings.upload_dir, saved["path"]))
+        thumbnail_url = None
+        if thumbnail:
+            thumbnail_url = "http://localhost:8000/uploads/" + os.path.relpath(thumbnail, settings.upload_dir).replace(os.sep, "/")
 
         return {
             "success": True,
             "file_url": file_url,
-            "filename": unique_filename
+            "thumbnail_url": thumbnail_url,
+            "filename": saved["filename"],
+            "size": saved["size"],
+            "sha256": saved["sha256"],
+            "width": saved["width"],
+            "height": saved["height"],
+            "deduplicated": saved["deduplicated"]
         }
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except (UnsupportedFileTypeError, InvalidUploadError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"文件上传失败: {str(e)}"
         )
 
-@router.post("/upload-video")
-async def upload_video(file: UploadFile = File(...)):
-    """上传视频文件"""
+@router.post("/upload-video", openapi_extra=_UPLOAD_BODY)
+async def upload_video(request: Request):
+    """上传视频文件（multipart 字段 file）"""
     try:
-        # 检查文件类型
-        allowed_extensions = ['.mp4', '.mov', '.avi', '.mkv', '.webm']
-        file_extension = os.path.splitext(file.filename)[1].lower()
-
-        if file_extension not in allowed_extensions:
-            raise ValueError(f"不支持的文件格式。支持的格式: {', '.join(allowed_extensions)}")
-
-        # 创建上传目录
-        upload_dir = "uploads/storyboard/videos"
-        os.makedirs(upload_dir, exist_ok=True)
-
-        # 生成唯一文件名
-        unique_filename = f"{uuid.uuid4()}{file_extension}"
-        file_path = os.path.join(upload_dir, unique_filename)
-
-        # 分块保存文件，适合大文件
-        print(f"[INFO] Starting video upload: {file.filename}")
-        with open(file_path, "wb") as buffer:
-            chunk_size = 1024 * 1024  # 1MB chunks
-            while True:
-                chunk = await file.read(chunk_size)
-                if not chunk:
-                    break
-                buffer.write(chunk)
-        
-        print(f"[INFO] Video uploaded successfully: {unique_filename}")
+        # 边接收边写入磁盘（不阻塞事件循环），超过 max_video_file_size 立即中止
+        saved = await upload_service.save(
+            request,
+            max_size=settings.max_video_file_size,
+            allowed_extensions=['.mp4', '.mov', '.avi', '.mkv', '.webm']
+        )
+        print(f"[INFO] Video uploaded successfully: {saved['filename']}")
 
-        # 返回完整URL
-        file_url = f"http://localhost:8000/uploads/storyboard/videos/{unique_filename}"
+        # 返回完整URL（按内容寻址，相同视频得到相同URL）
+        file_url = f"http://localhost:8000/uploads/{saved['path']}"
 
         return {
             "success": True,
             "file_url": file_url,
-            "filename": file.filename
+            "filename": saved["original_name"],
+            "size": saved["size"],
+            "sha256": saved["sha256"],
+            "deduplicated": saved["deduplicated"]
         }
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except (UnsupportedFileTypeError, InvalidUploadError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"[ERROR] Video upload failed: {str(e)}")
         raise HTTPException(
@@ -332,31 +390,58 @@ async def upload_video(file: UploadFile = File(...)):
             detail=f"视频上传失败: {str(e)}"
         )
 
+@router.get("/media/{sha256}")
+async def get_media(sha256: str):
+    """查询媒体库中的对象（MIME、大小、尺寸、引用计数）"""
+    meta = await media_store.get(sha256)
+    if meta is None:
+        raise HTTPException(status_code=404, detail="媒体文件不存在")
+    return {**meta, "file_url": f"http://localhost:8000/uploads/{meta['path']}"}
+
+@router.delete("/media/{sha256}")
+async def release_media(sha256: str):
+    """释放一次对媒体文件的引用，引用计数归零后可被淘汰"""
+    meta = await media_store.release(sha256)
+    if meta is None:
+        raise HTTPException(status_code=404, detail="媒体文件不存在")
+    return {"success": True, "sha256": sha256, "refcount": meta["refcount"]}
+
+def _shot_prompt(shot: Dict[str, Any]) -> str:
+    return f"{shot.get('description', '')} {shot.get('composition', '')} {shot.get('mood', '')}"
+
 @router.post("/generate-images")
 async def generate_storyboard_images(request: Dict[str, Any]):
-    """批量生成分镜图片（3张）"""
+    """批量生成分镜图片（全部镜头并发生成，单张失败记录在failures中）"""
     try:
         shots = request.get("shots", [])
-        if len(shots) < 3:
-            raise ValueError("至少需要3个分镜描述")
-        
-        # 生成前3个分镜的图片
+        if not shots:
+            raise ValueError("至少需要1个分镜描述")
+
+        prompts = [_shot_prompt(shot) for shot in shots]
+        results = {}
+        async for index, image_url, error in zhipu_service.generate_images(
+            prompts,
+            size=request.get("size", "1024x1024")
+        ):
+            results[index] = (image_url, error)
+
         images = []
-        for i, shot in enumerate(shots[:3]):
-            prompt = f"{shot.get('description', '')} {shot.get('composition', '')} {shot.get('mood', '')}"
-            image_url = await zhipu_service.generate_image(
-                prompt=prompt,
-                size="1024x1024"
-            )
-            images.append({
-                "shot_number": shot.get("shot_number", i+1),
-                "image_url": image_url,
-                "prompt": prompt
-            })
-        
+        failures = []
+        for i, shot in enumerate(shots):
+            image_url, error = results[i]
+            shot_number = shot.get("shot_number", i+1)
+            if error:
+                failures.append({"shot_number": shot_number, "error": error, "prompt": prompts[i]})
+            else:
+                images.append({"shot_number": shot_number, "image_url": image_url, "prompt": prompts[i]})
+
+        if not images:
+            raise Exception(failures[0]["error"])
+
         return {
             "success": True,
-            "images": images
+            "images": images,
+            "failures": failures
         }
     except Exception as e:
         raise HTTPException(
@@ -364,9 +449,54 @@ async def generate_storyboard_images(request: Dict[str, Any]):
             detail=f"批量图像生成失败: {str(e)}"
         )
 
+@router.post("/generate-images/stream")
+async def generate_storyboard_images_stream(request: Dict[str, Any]):
+    """批量生成分镜图片 - 流式输出（NDJSON，每完成一张推送一行）
+
+    每行：{"type": "image", ...} 或 {"type": "error", ...}，最后一行 {"type": "done", ...}
+    """
+    shots = request.get("shots", [])
+    if not shots:
+        raise HTTPException(status_code=400, detail="至少需要1个分镜描述")
+
+    prompts = [_shot_prompt(shot) for shot in shots]
+
+    async def generate():
+        succeeded = 0
+        async for index, image_url, error in zhipu_service.generate_images(
+            prompts,
+            size=request.get("size", "1024x1024")
+        ):
+            event = {
+                "shot_number": shots[index].get("shot_number", index+1),
+                "prompt": prompts[index]
+            }
+            if error:
+                event.update(type="error", error=error)
+            else:
+                succeeded += 1
+                event.update(type="image", image_url=image_url)
+            yield json.dumps(event, ensure_ascii=False) + "\n"
+
+        yield json.dumps({
+            "type": "done",
+            "total": len(shots),
+            "succeeded": succeeded,
+            "failed": len(shots) - succeeded
+        }, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+class VideoJobRequest(BaseModel):
+    images: List[str]  # 分镜图片URL，使用首尾帧生成视频
+    prompt: str = "让画面动起来，展现分镜内容"
+    quality: str = "quality"
+    size: str = "1920x1080"
+    fps: int = 30
+
 @router.post("/generate-video")
 async def generate_storyboard_video(request: Dict[str, Any]):
-    """根据分镜图片生成视频"""
+    """根据分镜图片生成视频（等待渲染完成后返回，长任务建议使用 /video-jobs）"""
     try:
         images = request.get("images", [])
         if len(images) < 2:
@@ -377,24 +507,82 @@ async def generate_storyboard_video(request: Dict[str, Any]):
         last_image = images[-1]
         prompt = request.get("prompt", "让画面动起来，展现分镜内容")
         
-        video_url = await zhipu_service.generate_video(
+        job = await video_job_manager.submit(
             image_urls=[first_image, last_image],
             prompt=prompt
         )
+        job = await video_job_manager.wait(job.id, timeout=settings.video_job_timeout)
+        if not job.finished:
+            raise TimeoutError(f"视频渲染超时（任务 {job.id} 仍在处理，可通过 /video-jobs/{job.id} 查询）")
+        if job.status != "SUCCESS":
+            raise Exception(job.error or "视频生成失败")
         
         return {
             "success": True,
-            "video_url": video_url,
+            "video_url": job.video_url,
             "first_frame": first_image,
             "last_frame": last_image
         }
+    except TimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"视频生成失败: {str(e)}"
         )
 
+@router.post("/video-jobs")
+async def submit_video_job(request: VideoJobRequest):
+    """提交视频生成任务，立即返回任务ID"""
+    if len(request.images) < 2:
+        raise HTTPException(status_code=400, detail="至少需要2张图片生成视频")
+    try:
+        job = await video_job_manager.submit(
+            image_urls=[request.images[0], request.images[-1]],
+            prompt=request.prompt,
+            quality=request.quality,
+            size=request.size,
+            fps=request.fps
+        )
+        return {"success": True, **job.to_dict()}
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"视频任务提交失败: {str(e)}"
+        )
+
+@router.get("/video-jobs")
+async def list_video_jobs():
+    """获取视频任务列表"""
+    return {"jobs": [job.to_dict() for job in video_job_manager.list_jobs()]}
+
+@router.get("/video-jobs/{job_id}")
+async def get_video_job(job_id: str, wait: float = 0):
+    """查询视频任务状态；wait>0 时最多等待wait秒（长轮询）"""
+    job = video_job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="视频任务不存在")
+    if wait > 0 and not job.finished:
+        job = await video_job_manager.wait(job_id, timeout=min(wait, 60))
+    return job.to_dict()
+
+@router.get("/video-jobs/{job_id}/events")
+async def subscribe_video_job(job_id: str):
+    """订阅视频任务（SSE），任务完成时推送 done 事件"""
+    job = video_job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="视频任务不存在")
+
+    async def events():
+        yield StreamEvent("status", data=job.to_dict())
+        # 等待期间由 event_stream 发送 heartbeat
+        await video_job_manager.wait(job_id, timeout=settings.video_job_timeout)
+        yield StreamEvent("done", data=job.to_dict())
+
+    return StreamingResponse(event_stream(events()), media_type="text/event-stream", headers=SSE_HEADERS)
+
 @router.get("/styles")
+@catalog
 async def get_storyboard_styles():
     """获取分镜风格列表"""
     return {
@@ -433,6 +621,7 @@ async def get_storyboard_styles():
     }
 
 @router.get("/shot-types")
+@catalog
 async def get_shot_types():
     """获取镜头类型说明"""
     return {
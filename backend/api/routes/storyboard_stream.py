@@ -3,6 +3,7 @@ from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Optional
 from services.zhipu_service import zhipu_service
+from services.sse import event_stream, SSE_HEADERS
 
 router = APIRouter()
 
@@ -14,13 +15,10 @@ class StoryboardStreamRequest(BaseModel):
 
 @router.post("/stream")
 async def generate_storyboard_stream(request: StoryboardStreamRequest):
-    """流式分镜生成"""
-    async def generate():
-        async for chunk in zhipu_service.generate_storyboard_stream(
-            script=request.script,
-            style=request.style,
-            shots=request.shots
-        ):
-            yield chunk
-    
-    return StreamingResponse(generate(), media_type="text/plain")
+    """流式分镜生成（SSE事件：delta / heartbeat / usage / done / error）"""
+    events = zhipu_service.generate_storyboard_stream(
+        script=request.script,
+        style=request.style,
+        shots=request.shots
+    )
+    return StreamingResponse(event_stream(events), media_type="text/event-stream", headers=SSE_HEADERS)
@@ -0,0 +1,56 @@
+from fastapi import APIRouter, HTTPException
+from services.http_client import http_pool
+from services.cache import completion_cache, analysis_cache, summary_cache
+from services.rate_limiter import rate_governor
+from services.key_pool import key_pool, max_key_pool
+from services.quota_ledger import quota_ledger
+from services.video_jobs import video_job_manager
+from services.upload_service import upload_service
+from services.media_store import media_store
+from services.image_processor import image_processor
+from services.sse import sse_stats
+from services.summarizer import manuscript_summarizer
+from services.retrieval import retrieval_service
+from services.singleflight import upstream_flight
+from services.search_cache import search_cache
+from utils.compression import compression_stats
+from utils.responses import catalog_stats
+from services.project_store import project_store
+from services.pipeline import pipeline_engine
+from utils.json_extract import json_extract_stats
+
+router = APIRouter()
+
+@router.get("/stats")
+async def get_system_stats():
+    """获取服务运行统计（连接池、缓存、限流等）"""
+    return {
+        "http_pool": http_pool.get_stats(),
+        "completion_cache": completion_cache.get_stats(),
+        "analysis_cache": analysis_cache.get_stats(),
+        "summary_cache": summary_cache.get_stats(),
+        "rate_limiter": rate_governor.get_stats(),
+        "key_pools": [key_pool.get_stats(), max_key_pool.get_stats()],
+        "quota": quota_ledger.get_stats(),
+        "video_jobs": video_job_manager.get_stats(),
+        "uploads": upload_service.get_stats(),
+        "media_store": await media_store.get_stats(),
+        "image_processor": image_processor.get_stats(),
+        "sse": sse_stats.to_dict(),
+        "json_extract": json_extract_stats.to_dict(),
+        "summarizer": manuscript_summarizer.get_stats(),
+        "retrieval": retrieval_service.get_stats(),
+        "singleflight": upstream_flight.get_stats(),
+        "search_cache": search_cache.get_stats(),
+        "http": {"catalog": catalog_stats.to_dict(), "compression": compression_stats.to_dict()},
+        "projects": await project_store.get_stats(),
+        "pipeline": await pipeline_engine.get_stats()
+    }
+
+@router.get("/quota")
+async def get_quota():
+    """获取资源包剩余额度及按模型、路由的用量明细"""
+    try:
+        return await quota_ledger.get_summary()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取额度信息失败: {str(e)}")
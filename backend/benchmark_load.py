@@ -0,0 +1,320 @@
+"""
+Load Benchmark - 端到端并发压测
+向所有 /api/* 路由施加并发流量，统计 p50/p95/p99 延迟、吞吐量和错误率
+在 test_comprehensive.TestAnalyzer 的基础上扩展统计
+
+建议配合本地模拟上游使用，避免消耗真实配额：
+    python mock_zhipu_server.py --port 8100
+    ZHIPU_BASE_URL=http://127.0.0.1:8100/api/paas/v4/ uvicorn main:app --port 8000
+    python benchmark_load.py --concurrency 20 --requests 400
+"""
+import argparse
+import asyncio
+import io
+import json
+import random
+import time
+import httpx
+from typing import Dict, Any, List, Optional
+from test_comprehensive import TestAnalyzer
+
+BASE_URL = "http://localhost:8000"
+
+# 每个场景：名称、方法、路径、请求体、权重；stream=True 时额外统计首字节时间
+SCENARIOS: List[Dict[str, Any]] = [
+    # 目录类（GET）
+    {"name": "novel.genres", "method": "GET", "endpoint": "/api/novel/genres", "weight": 2},
+    {"name": "novel.styles", "method": "GET", "endpoint": "/api/novel/styles", "weight": 2},
+    {"name": "character.types", "method": "GET", "endpoint": "/api/character/types", "weight": 2},
+    {"name": "character.traits", "method": "GET", "endpoint": "/api/character/traits", "weight": 2},
+    {"name": "script.formats", "method": "GET", "endpoint": "/api/script/formats", "weight": 2},
+    {"name": "script.structure", "method": "GET", "endpoint": "/api/script/structure", "weight": 2},
+    {"name": "storyboard.styles", "method": "GET", "endpoint": "/api/storyboard/styles", "weight": 2},
+    {"name": "storyboard.shot_types", "method": "GET", "endpoint": "/api/storyboard/shot-types", "weight": 2},
+    {"name": "search.categories", "method": "GET", "endpoint": "/api/search/search-categories", "weight": 2},
+    {"name": "search.popular", "method": "GET", "endpoint": "/api/search/popular-searches", "weight": 2},
+    # 文本生成
+    {"name": "novel.generate", "method": "POST", "endpoint": "/api/novel/generate", "weight": 2,
+     "json": {"genre": "科幻", "theme": "AI", "length": "short", "style": "modern"}},
+    {"name": "novel.outline", "method": "POST", "endpoint": "/api/novel/outline", "weight": 4,
+     "json": {"genre": "科幻", "style": "modern", "keywords": ["AI"], "target_length": "medium"}},
+    {"name": "novel.continue", "method": "POST", "endpoint": "/api/novel/continue", "weight": 4,
+     "json": {"previous_content": "故事开始了。" * 400, "target_length": 500}},
+    {"name": "novel.rewrite", "method": "POST", "endpoint": "/api/novel/rewrite", "weight": 3,
+     "json": {"content": "他走了。", "target_style": "诗意"}},
+    {"name": "character.generate", "method": "POST", "endpoint": "/api/character/generate", "weight": 4,
+     "json": {"type": "主角", "setting": "未来", "name": "Alex"}},
+    {"name": "character.image", "method": "POST", "endpoint": "/api/character/image", "weight": 1,
+     "json": {"character_name": "Alex", "appearance": "银色短发，机械义眼", "style": "anime"}},
+    {"name": "script.convert", "method": "POST", "endpoint": "/api/script/convert", "weight": 3,
+     "json": {"content": "Alex走进房间。", "format": "standard"}},
+    {"name": "storyboard.generate", "method": "POST", "endpoint": "/api/storyboard/generate", "weight": 3,
+     "json": {"script": "场景：房间\nAlex进入。", "style": "cinematic", "shots": 3}},
+    {"name": "storyboard.generate_images", "method": "POST", "endpoint": "/api/storyboard/generate-images", "weight": 1,
+     "json": {"shots": [{"shot_number": i + 1, "description": f"镜头{i + 1}", "composition": "三分法", "mood": "紧张"} for i in range(3)]}},
+    {"name": "storyboard.generate_video", "method": "POST", "endpoint": "/api/storyboard/generate-video", "weight": 1,
+     "json": {"images": ["https://example.com/a.png", "https://example.com/b.png"]}, "timeout": 600},
+    {"name": "storyboard.video_job", "method": "POST", "endpoint": "/api/storyboard/video-jobs", "weight": 1,
+     "json": {"images": ["https://example.com/a.png", "https://example.com/b.png"]}},
+    # 流式
+    {"name": "novel.stream", "method": "POST", "endpoint": "/api/novel/stream", "weight": 2, "stream": True,
+     "json": {"genre": "科幻", "theme": "AI", "length": "short"}},
+    {"name": "character.stream", "method": "POST", "endpoint": "/api/character/stream", "weight": 2, "stream": True,
+     "json": {"type": "主角", "setting": "未来"}},
+    {"name": "script.stream", "method": "POST", "endpoint": "/api/script/stream", "weight": 2, "stream": True,
+     "json": {"content": "Alex走进房间。"}},
+    {"name": "storyboard.stream", "method": "POST", "endpoint": "/api/storyboard/stream", "weight": 2, "stream": True,
+     "json": {"script": "场景：房间\nAlex进入。", "shots": 3}},
+    {"name": "character.generate_stream", "method": "POST", "endpoint": "/api/character/generate/stream", "weight": 2,
+     "stream": True, "json": {"type": "主角", "setting": "未来"}},
+    {"name": "storyboard.generate_stream", "method": "POST", "endpoint": "/api/storyboard/generate/stream", "weight": 2,
+     "stream": True, "json": {"script": "场景：房间\nAlex进入。", "shots": 3}},
+    # 搜索
+    {"name": "search.materials", "method": "POST", "endpoint": "/api/search/materials", "weight": 2,
+     "json": {"query": "古代建筑", "type": "image"}},
+    {"name": "search.enhanced", "method": "POST", "endpoint": "/api/search/enhanced-search", "weight": 2,
+     "json": {"query": "赛博朋克城市设计"}},
+    {"name": "search.hot_topics", "method": "POST", "endpoint": "/api/search/hot-topics", "weight": 3,
+     "json": {"category": "technology"}},
+    {"name": "search.inspiration", "method": "POST", "endpoint": "/api/search/inspiration", "weight": 2,
+     "json": {"genre": "科幻", "theme": "记忆"}},
+    {"name": "search.generate_reference", "method": "POST", "endpoint": "/api/search/generate-reference", "weight": 1,
+     "json": {"description": "雨夜街道", "style": "realistic"}},
+    # 上传与分析（analyze 场景的URL在预热阶段填充）
+    {"name": "storyboard.upload_image", "method": "UPLOAD", "endpoint": "/api/storyboard/upload-image", "weight": 2,
+     "upload": ("reference.png", "image/png")},
+    {"name": "storyboard.upload_video", "method": "UPLOAD", "endpoint": "/api/storyboard/upload-video", "weight": 1,
+     "upload": ("clip.mp4", "video/mp4")},
+    {"name": "storyboard.analyze", "method": "POST", "endpoint": "/api/storyboard/analyze", "weight": 2,
+     "json": {"image_url": "{image_url}", "analysis_type": "composition"}},
+    {"name": "storyboard.analyze_video", "method": "POST", "endpoint": "/api/storyboard/analyze-video", "weight": 1,
+     "json": {"video_url": "{video_url}", "analysis_focus": "storyboard"}},
+    {"name": "search.analyze_image", "method": "POST", "endpoint": "/api/search/analyze-image", "weight": 1,
+     "json": {"image_url": "{image_url}", "analysis_type": "style"}},
+]
+
+
+def _sample_png() -> bytes:
+    """生成一张用于上传的测试图片"""
+    try:
+        from PIL import Image
+        buffer = io.BytesIO()
+        Image.new("RGB", (640, 360), (random.randint(0, 255), 80, 160)).save(buffer, format="PNG")
+        return buffer.getvalue()
+    except ImportError:
+        return b"\x89PNG\r\n\x1a\n" + bytes(random.getrandbits(8) for _ in range(4096))
+
+
+def _sample_video(size: int = 512 * 1024) -> bytes:
+    return b"\x00\x00\x00\x18ftypmp42" + random.randbytes(size)
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+class LoadAnalyzer(TestAnalyzer):
+    """在 TestAnalyzer 的基础上增加分位数延迟、吞吐量和按路由统计"""
+
+    def add_result(self, name, success, response_time, error=None, data=None, status=None, ttfb=None):
+        super().add_result(name, success, response_time, error=error, data=data)
+        self.results[-1]["status"] = status
+        self.results[-1]["ttfb"] = ttfb
+
+    @staticmethod
+    def _latency_summary(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        times = [r["response_time"] for r in results if r["response_time"] is not None]
+        ttfbs = [r["ttfb"] for r in results if r.get("ttfb") is not None]
+        failed = sum(1 for r in results if not r["success"])
+        summary = {
+            "requests": len(results),
+            "errors": failed,
+            "error_rate": f"{failed * 100 / len(results):.2f}%" if results else "0.00%",
+            "p50": round(_percentile(times, 50), 4),
+            "p95": round(_percentile(times, 95), 4),
+            "p99": round(_percentile(times, 99), 4),
+            "max": round(max(times), 4) if times else 0.0
+        }
+        if ttfbs:
+            summary["ttfb_p50"] = round(_percentile(ttfbs, 50), 4)
+            summary["ttfb_p95"] = round(_percentile(ttfbs, 95), 4)
+        return summary
+
+    def analyze(self, wall_time: Optional[float] = None):
+        analysis = super().analyze()
+        wall_time = wall_time or (time.time() - self.start_time if self.start_time else 0)
+        analysis["load"] = {
+            "wall_time": f"{wall_time:.2f}s",
+            "throughput_rps": round(len(self.results) / wall_time, 2) if wall_time else 0.0,
+            **self._latency_summary(self.results)
+        }
+
+        routes: Dict[str, List[Dict[str, Any]]] = {}
+        for result in self.results:
+            routes.setdefault(result["name"], []).append(result)
+        analysis["routes"] = {name: self._latency_summary(items) for name, items in sorted(routes.items())}
+
+        status_counts: Dict[str, int] = {}
+        for result in self.results:
+            key = str(result.get("status") or "exception")
+            status_counts[key] = status_counts.get(key, 0) + 1
+        analysis["status_codes"] = status_counts
+        return analysis
+
+
+class LoadRunner:
+    def __init__(self, base_url: str, concurrency: int, timeout: float):
+        self.base_url = base_url
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.analyzer = LoadAnalyzer()
+        self.placeholders: Dict[str, str] = {}
+        self.png = _sample_png()
+        self.video = _sample_video()
+
+    def _fill(self, body: Any) -> Any:
+        text = json.dumps(body, ensure_ascii=False)
+        for key, value in self.placeholders.items():
+            text = text.replace("{" + key + "}", value)
+        return json.loads(text)
+
+    async def warmup(self, client: httpx.AsyncClient):
+        """上传示例图片和视频，供分析类场景使用"""
+        try:
+            response = await client.post(
+                f"{self.base_url}/api/storyboard/upload-image",
+                files={"file": ("warmup.png", self.png, "image/png")}
+            )
+            self.placeholders["image_url"] = response.json().get("file_url", "")
+            response = await client.post(
+                f"{self.base_url}/api/storyboard/upload-video",
+                files={"file": ("warmup.mp4", self.video, "video/mp4")}
+            )
+            self.placeholders["video_url"] = response.json().get("file_url", "")
+        except Exception as e:
+            print(f"[WARN] Warmup upload failed: {str(e)}")
+
+    async def run_one(self, client: httpx.AsyncClient, scenario: Dict[str, Any]):
+        name = scenario["name"]
+        url = f"{self.base_url}{scenario['endpoint']}"
+        timeout = scenario.get("timeout", self.timeout)
+        start = time.perf_counter()
+        ttfb = None
+        status = None
+        try:
+            if scenario["method"] == "GET":
+                response = await client.get(url, timeout=timeout)
+            elif scenario["method"] == "UPLOAD":
+                filename, mime = scenario["upload"]
+                content = self.png if mime.startswith("image") else self.video
+                response = await client.post(url, files={"file": (filename, content, mime)}, timeout=timeout)
+            elif scenario.get("stream"):
+                async with client.stream("POST", url, json=self._fill(scenario["json"]), timeout=timeout) as response:
+                    async for _ in response.aiter_bytes():
+                        if ttfb is None:
+                            ttfb = time.perf_counter() - start
+            else:
+                response = await client.post(url, json=self._fill(scenario["json"]), timeout=timeout)
+
+            elapsed = time.perf_counter() - start
+            status = response.status_code
+            if status == 200:
+                self.analyzer.add_result(name, True, elapsed, status=status, ttfb=ttfb)
+            else:
+                self.analyzer.add_result(name, False, elapsed, error=f"{status}: {response.text[:200]}", status=status, ttfb=ttfb)
+        except Exception as e:
+            elapsed = time.perf_counter() - start
+            self.analyzer.add_result(name, False, elapsed, error=f"{type(e).__name__}: {str(e)[:200]}", status=status, ttfb=ttfb)
+
+    async def run(self, scenarios: List[Dict[str, Any]], total_requests: int, duration: Optional[float]):
+        population = [s for s in scenarios for _ in range(s.get("weight", 1))]
+        limits = httpx.Limits(max_connections=self.concurrency * 2, max_keepalive_connections=self.concurrency)
+        async with httpx.AsyncClient(limits=limits, timeout=self.timeout) as client:
+            await self.warmup(client)
+            self.analyzer.start_time = time.time()
+            deadline = time.perf_counter() + duration if duration else None
+            issued = 0
+
+            async def worker():
+                nonlocal issued
+                while True:
+                    if deadline is not None:
+                        if time.perf_counter() >= deadline:
+                            return
+                    elif issued >= total_requests:
+                        return
+                    issued += 1
+                    await self.run_one(client, random.choice(population))
+
+            await asyncio.gather(*[worker() for _ in range(self.concurrency)])
+        return time.time() - self.analyzer.start_time
+
+
+def print_report(analysis: Dict[str, Any]):
+    load = analysis["load"]
+    print("\n" + "=" * 60)
+    print("LOAD TEST ANALYSIS")
+    print("=" * 60)
+    print(f"\nRequests: {load['requests']}  Errors: {load['errors']} ({load['error_rate']})")
+    print(f"Wall Time: {load['wall_time']}  Throughput: {load['throughput_rps']} req/s")
+    print(f"Latency p50/p95/p99: {load['p50']:.3f}s / {load['p95']:.3f}s / {load['p99']:.3f}s")
+    print(f"Status Codes: {analysis['status_codes']}")
+
+    print(f"\n{'Route':<30}{'n':>6}{'err%':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'ttfb50':>9}")
+    for name, route in analysis["routes"].items():
+        ttfb = f"{route['ttfb_p50']:.3f}" if "ttfb_p50" in route else "-"
+        print(
+            f"{name:<30}{route['requests']:>6}{route['error_rate']:>9}"
+            f"{route['p50']:>9.3f}{route['p95']:>9.3f}{route['p99']:>9.3f}{ttfb:>9}"
+        )
+
+    print(f"\nRecommendations:")
+    for i, rec in enumerate(analysis["recommendations"], 1):
+        print(f"  {i}. [{rec['priority']}] {rec['issue']}")
+        print(f"     Solution: {rec['solution']}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="端到端并发压测")
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=200, help="总请求数（未指定 --duration 时生效）")
+    parser.add_argument("--duration", type=float, default=None, help="按时长压测（秒）")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--only", default=None, help="只运行名称包含该字符串的场景，逗号分隔")
+    parser.add_argument("--output", default="load_test_results.json")
+    args = parser.parse_args()
+
+    scenarios = SCENARIOS
+    if args.only:
+        filters = [f.strip() for f in args.only.split(",") if f.strip()]
+        scenarios = [s for s in SCENARIOS if any(f in s["name"] for f in filters)]
+
+    runner = LoadRunner(args.base_url, args.concurrency, args.timeout)
+    wall_time = await runner.run(scenarios, args.requests, args.duration)
+    analysis = runner.analyzer.analyze(wall_time)
+    print_report(analysis)
+
+    server_stats = None
+    try:
+        async with httpx.AsyncClient(timeout=10) as client:
+            server_stats = (await client.get(f"{args.base_url}/api/system/stats")).json()
+    except Exception:
+        pass
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({
+            "analysis": analysis,
+            "server_stats": server_stats,
+            "detailed_results": runner.analyzer.results
+        }, f, indent=2, ensure_ascii=False)
+    print(f"\nDetailed results saved to: {args.output}")
+    return analysis
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
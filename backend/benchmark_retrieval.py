@@ -0,0 +1,76 @@
+"""
+Retrieval Benchmark - 前文片段检索的建索引与查询耗时
+生成合成的中文长篇（按常用字频近似分布的随机文本，分章节），在较早章节中埋入一段线索，
+用包含该线索关键词的“最近内容”查询，统计建索引耗时、查询耗时分布以及线索片段是否被检索到
+
+    python benchmark_retrieval.py --chars 3000000 --queries 200
+"""
+import argparse
+import random
+import time
+from services.retrieval import ManuscriptIndex
+from utils.config import settings
+
+_COMMON = "的一是了不在人有我他这个们中来上大为和国地到以说时要就出会可也你对生能而子那得于着下自之年过发后作里"
+_RARE = "霜剑楼阁渊雪青铜镜玉佩书卷密信石碑宫灯古井山门香炉竹林寒潭孤舟旧案血衣钥匙药方残图铃铛黑袍银针"
+_CLUE = "那枚刻着云纹的青铜钥匙被埋在寒潭边的古井之下，只有沈墨知道井口石碑背面的暗记。"
+
+def build_chapters(total_chars: int, chapter_chars: int, clue_chapter: int):
+    rng = random.Random(42)
+    pool = _COMMON * 8 + _RARE
+    chapters = []
+    for number in range(1, total_chars // chapter_chars + 1):
+        paragraphs = []
+        length = 0
+        while length < chapter_chars:
+            paragraph = "".join(rng.choice(pool) for _ in range(rng.randint(60, 240))) + "。"
+            paragraphs.append(paragraph)
+            length += len(paragraph) + 1
+        if number == clue_chapter:
+            paragraphs.insert(len(paragraphs) // 2, _CLUE)
+        chapters.append((f"chapter-{number}", number, f"第{number}章", "\n".join(paragraphs)))
+    return chapters
+
+def main():
+    parser = argparse.ArgumentParser(description="Passage retrieval benchmark")
+    parser.add_argument("--chars", type=int, default=3000000, help="合成正文总字数")
+    parser.add_argument("--chapter-chars", type=int, default=5000, help="每章字数")
+    parser.add_argument("--queries", type=int, default=200, help="查询次数")
+    args = parser.parse_args()
+
+    chapters = build_chapters(args.chars, args.chapter_chars, clue_chapter=3)
+    index = ManuscriptIndex()
+    start = time.perf_counter()
+    for chapter_id, position, title, content in chapters:
+        index.add_chapter(chapter_id, position, title, (chapter_id,), content)
+    build_seconds = time.perf_counter() - start
+    stats = index.get_stats()
+    print(f"[INFO] {len(chapters)} chapters, {sum(len(c[3]) for c in chapters):,} chars, "
+          f"{stats['passages']:,} passages, {stats['terms']:,} terms, build {build_seconds:.2f}s")
+
+    # 增量：追加一章
+    start = time.perf_counter()
+    extra = build_chapters(args.chapter_chars, args.chapter_chars, clue_chapter=0)[0]
+    index.add_chapter("chapter-new", len(chapters) + 1, "新章节", ("chapter-new",), extra[3])
+    print(f"[INFO] incremental add of one chapter: {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    rng = random.Random(7)
+    searchable = {chapter_id for chapter_id, _, _, _ in chapters[:-1]}
+    timings, found = [], 0
+    for i in range(args.queries):
+        recent = chapters[-1][3][-settings.summary_recent_chars:]
+        if i % 2 == 0:
+            recent = recent[:rng.randint(0, len(recent))] + "沈墨想起寒潭边的古井和那枚青铜钥匙。" + recent
+        start = time.perf_counter()
+        hits = index.search(recent, settings.retrieval_top_k, searchable)
+        timings.append((time.perf_counter() - start) * 1000)
+        if i % 2 == 0 and any(_CLUE in passage.text for _, passage in hits[:3]):
+            found += 1
+
+    timings.sort()
+    print(f"query p50 {timings[len(timings) // 2]:.2f}ms  p95 {timings[int(len(timings) * 0.95)]:.2f}ms  "
+          f"max {timings[-1]:.2f}ms")
+    print(f"clue passage in top 3: {found}/{(args.queries + 1) // 2}")
+
+if __name__ == "__main__":
+    main()
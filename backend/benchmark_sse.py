@@ -0,0 +1,106 @@
+"""
+SSE Benchmark - 流式解码吞吐对比
+用合成的对话补全SSE字节流（随机切分成网络分块）对比两种解码方式的每秒分片数：
+- naive：逐行解码字符串 + json.loads（原 aiter_lines 写法）
+- decoder：services.sse 的字节级 SSEDecoder + iter_chat_events（orjson可用时使用orjson）
+
+    python benchmark_sse.py --chunks 20000 --rounds 5
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import List
+from services.sse import iter_chat_events
+from utils.fast_json import HAS_ORJSON
+
+def build_stream(chunks: int, network_chunk: int) -> List[bytes]:
+    """生成SSE字节流并按 network_chunk 附近的大小随机切分"""
+    rng = random.Random(42)
+    parts = []
+    for i in range(chunks):
+        payload = {
+            "id": "chatcmpl-bench",
+            "created": 1700000000,
+            "model": "glm-4.6",
+            "choices": [{"index": 0, "delta": {"role": "assistant", "content": "星辰大海的故事" * rng.randint(1, 3)}}]
+        }
+        parts.append(b"data: " + json.dumps(payload, ensure_ascii=False).encode() + b"\n\n")
+        if i % 500 == 0:
+            parts.append(b": keep-alive\n\n")
+    usage = {"prompt_tokens": 100, "completion_tokens": chunks, "total_tokens": chunks + 100}
+    parts.append(b"data: " + json.dumps({"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage}).encode() + b"\n\n")
+    parts.append(b"data: [DONE]\n\n")
+
+    raw = b"".join(parts)
+    pieces, pos = [], 0
+    while pos < len(raw):
+        size = rng.randint(network_chunk // 2, network_chunk * 2)
+        pieces.append(raw[pos:pos + size])
+        pos += size
+    return pieces
+
+async def _aiter(pieces: List[bytes]):
+    for piece in pieces:
+        yield piece
+
+async def naive(pieces: List[bytes]) -> int:
+    """逐行解码 + json.loads"""
+    count, buffer = 0, ""
+    async for piece in _aiter(pieces):
+        buffer += piece.decode("utf-8", errors="ignore")
+        lines = buffer.split("\n")
+        buffer = lines.pop()
+        for line in lines:
+            if not line.startswith("data: "):
+                continue
+            data = line[6:]
+            if data == "[DONE]":
+                return count
+            try:
+                chunk = json.loads(data)
+                if chunk.get("choices", [{}])[0].get("delta", {}).get("content", ""):
+                    count += 1
+            except:
+                continue
+    return count
+
+async def decoder(pieces: List[bytes]) -> int:
+    """SSEDecoder + iter_chat_events"""
+    count = 0
+    async for event in iter_chat_events(_aiter(pieces)):
+        if event.type == "delta":
+            count += 1
+    return count
+
+async def run(chunks: int, rounds: int, network_chunk: int):
+    pieces = build_stream(chunks, network_chunk)
+    total_bytes = sum(len(piece) for piece in pieces)
+    print(f"[INFO] {chunks} chunks, {total_bytes / 1024 / 1024:.1f}MB, "
+          f"{len(pieces)} network pieces, json parser: {'orjson' if HAS_ORJSON else 'json'}")
+
+    results = {}
+    for name, func in (("naive", naive), ("decoder", decoder)):
+        best = None
+        for _ in range(rounds):
+            start = time.perf_counter()
+            count = await func(pieces)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        assert count == chunks, f"{name} decoded {count}/{chunks} chunks"
+        results[name] = chunks / best
+        print(f"{name:<10}{chunks / best:>14,.0f} chunks/s{total_bytes / best / 1024 / 1024:>10.1f} MB/s")
+
+    print(f"speedup: {results['decoder'] / results['naive']:.2f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description="SSE decoding benchmark")
+    parser.add_argument("--chunks", type=int, default=20000, help="分片数")
+    parser.add_argument("--rounds", type=int, default=5, help="每种方式运行轮数（取最快一轮）")
+    parser.add_argument("--network-chunk", type=int, default=4096, help="网络分块平均大小（字节）")
+    args = parser.parse_args()
+    asyncio.run(run(args.chunks, args.rounds, args.network_chunk))
+
+if __name__ == "__main__":
+    main()
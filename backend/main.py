@@ -1,14 +1,36 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from api.routes import novel, character, script, storyboard, search, novel_stream, character_stream, script_stream, storyboard_stream
+from contextlib import asynccontextmanager
+from api.routes import novel, character, script, storyboard, search, novel_stream, character_stream, script_stream, storyboard_stream, system, project, pipeline
+from services.http_client import http_pool
+from services.video_jobs import video_job_manager
+from services.pipeline import pipeline_engine
+from services.image_processor import image_processor
+from utils.request_context import RequestContextMiddleware
+from utils.upload_limit import UploadSizeLimitMiddleware
+from utils.compression import CompressionMiddleware
+from utils.responses import FastJSONResponse
 from utils.config import settings
 import os
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 启动时预先创建共享连接池并清理上次遗留的执行中流水线，关闭时停止流水线、视频任务轮询、图片处理进程池并统一释放连接
+    http_pool.client
+    await pipeline_engine.recover()
+    yield
+    await pipeline_engine.aclose()
+    await video_job_manager.aclose()
+    image_processor.shutdown()
+    await http_pool.aclose()
+
 app = FastAPI(
     title="Story Universe API",
     description="故事创作平台后端API",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse
 )
 
 # 挂载静态文件目录
@@ -31,6 +53,24 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 记录当前请求路由，用于按路由统计上游用量
+app.add_middleware(RequestContextMiddleware)
+
+# 上传请求体大小限制：超限时在读取完整请求体之前返回413
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    default_limit=settings.max_file_size,
+    limits={"/api/storyboard/upload-video": settings.max_video_file_size}
+)
+
+# 压缩较大的一次性JSON/文本响应（流式响应原样转发）
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=settings.compression_min_size,
+    gzip_level=settings.compression_gzip_level,
+    brotli_quality=settings.compression_brotli_quality
+)
+
 # 注册路由
 app.include_router(novel.router, prefix="/api/novel", tags=["novel"])
 app.include_router(novel_stream.router, prefix="/api/novel", tags=["novel-stream"])
@@ -41,6 +81,9 @@ app.include_router(script_stream.router, prefix="/api/script", tags=["script-str
 app.include_router(storyboard.router, prefix="/api/storyboard", tags=["storyboard"])
 app.include_router(storyboard_stream.router, prefix="/api/storyboard", tags=["storyboard-stream"])
 app.include_router(search.router, prefix="/api/search", tags=["search"])
+app.include_router(project.router, prefix="/api/projects", tags=["projects"])
+app.include_router(pipeline.router, prefix="/api/pipeline", tags=["pipeline"])
+app.include_router(system.router, prefix="/api/system", tags=["system"])
 
 @app.get("/")
 async def root():
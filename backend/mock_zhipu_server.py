@@ -0,0 +1,283 @@
+"""
+Mock Zhipu Upstream - 本地模拟智谱API服务器
+实现 chat/completions（含SSE流式）、images/generations、videos/generations、async-result/{id}
+用于压测和本地开发，不消耗真实配额
+
+启动：
+    python mock_zhipu_server.py --port 8100 --latency lognormal:-0.7,0.5 --error-rate 0.02
+后端指向模拟服务器：
+    ZHIPU_BASE_URL=http://127.0.0.1:8100/api/paas/v4/ uvicorn main:app --port 8000
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+import uuid
+from typing import Dict, Any, List, Optional
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+import uvicorn
+
+PREFIX = "/api/paas/v4"
+
+
+class LatencyModel:
+    """延迟分布：fixed:秒 | uniform:最小,最大 | lognormal:mu,sigma | normal:均值,标准差"""
+
+    def __init__(self, spec: str = "fixed:0"):
+        self.spec = spec
+        kind, _, params = spec.partition(":")
+        self.kind = kind
+        self.params = [float(p) for p in params.split(",") if p]
+
+    def sample(self) -> float:
+        if self.kind == "fixed":
+            return self.params[0] if self.params else 0.0
+        if self.kind == "uniform":
+            return random.uniform(self.params[0], self.params[1])
+        if self.kind == "lognormal":
+            return random.lognormvariate(self.params[0], self.params[1])
+        if self.kind == "normal":
+            return max(0.0, random.gauss(self.params[0], self.params[1]))
+        raise ValueError(f"未知的延迟分布: {self.spec}")
+
+
+class MockConfig:
+    def __init__(self):
+        self.latency: Dict[str, LatencyModel] = {"default": LatencyModel("fixed:0.05")}
+        self.chunk_delay = LatencyModel("fixed:0.01")  # 流式每个chunk之间的间隔
+        self.stream_chunks = 40  # 流式输出的chunk数量
+        self.error_rate = 0.0  # 随机返回429的比例
+        self.video_render_time = LatencyModel("fixed:6")  # 视频任务从提交到完成的时间
+
+    def latency_for(self, endpoint: str) -> float:
+        return self.latency.get(endpoint, self.latency["default"]).sample()
+
+
+config = MockConfig()
+video_tasks: Dict[str, Dict[str, Any]] = {}
+stats = {"requests": 0, "errors_injected": 0, "by_endpoint": {}}
+
+app = FastAPI(title="Mock Zhipu Upstream")
+
+
+def _record(endpoint: str):
+    stats["requests"] += 1
+    stats["by_endpoint"][endpoint] = stats["by_endpoint"].get(endpoint, 0) + 1
+
+
+def _rate_limited() -> Optional[JSONResponse]:
+    if config.error_rate and random.random() < config.error_rate:
+        stats["errors_injected"] += 1
+        return JSONResponse(
+            status_code=429,
+            content={"error": {"code": "1302", "message": "您当前使用该API的并发数过高，请降低并发"}}
+        )
+    return None
+
+
+def _prompt_text(messages: List[Dict[str, Any]]) -> str:
+    parts = []
+    for message in messages or []:
+        content = message.get("content", "")
+        if isinstance(content, list):
+            parts.extend(item.get("text", "") for item in content if isinstance(item, dict))
+        else:
+            parts.append(str(content))
+    return "\n".join(parts)
+
+
+def _fake_content(messages: List[Dict[str, Any]]) -> str:
+    """根据提示词返回与真实接口形状一致的内容（JSON数组、JSON对象或正文）"""
+    prompt = _prompt_text(messages)
+    if "JSON数组" in prompt and ("分镜" in prompt or "镜头" in prompt):
+        shots = [
+            {
+                "shot_number": i + 1,
+                "shot_type": random.choice(["全景", "中景", "近景", "特写"]),
+                "angle": random.choice(["平视", "俯视", "仰视"]),
+                "movement": "固定",
+                "description": f"模拟镜头{i + 1}的画面描述",
+                "action": "角色缓慢转身",
+                "dialogue": "……",
+                "duration": "3秒",
+                "transition": "切",
+                "composition": "三分法",
+                "mood": "紧张"
+            }
+            for i in range(6)
+        ]
+        return json.dumps(shots, ensure_ascii=False)
+    if "JSON数组" in prompt:
+        return json.dumps([{"title": f"模拟条目{i + 1}", "description": "模拟描述"} for i in range(3)], ensure_ascii=False)
+    if "JSON" in prompt and "角色" in prompt:
+        return "```json\n" + json.dumps({
+            "basic_info": {"name": "模拟角色", "age": "28", "gender": "女", "occupation": "工程师"},
+            "appearance": {"height": "170cm", "build": "匀称"},
+            "personality": {"traits": ["冷静", "果断"]},
+            "background": {"childhood": "在海边小镇长大"},
+            "skills_abilities": {"professional_skills": ["编程"]},
+            "relationships": {"friendships": ["老友"]},
+            "goals_motivations": {"long_term_goals": "找到真相"},
+            "dialogue_style": {"catchphrase": "没有解决不了的问题。"}
+        }, ensure_ascii=False) + "\n```"
+    if "JSON" in prompt:
+        return json.dumps({
+            "故事梗概": "模拟的故事梗概",
+            "章节大纲": [{"chapter": i + 1, "title": f"第{i + 1}章", "summary": "模拟章节"} for i in range(10)]
+        }, ensure_ascii=False)
+    return "夜色深沉，城市的霓虹在雨中晕开。她推开门，听见远处传来的钟声。" * 8
+
+
+def _usage(messages: List[Dict[str, Any]], content: str) -> Dict[str, int]:
+    prompt_tokens = max(1, len(_prompt_text(messages)) // 2)
+    completion_tokens = max(1, len(content) // 2)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens
+    }
+
+
+@app.post(f"{PREFIX}/chat/completions")
+async def chat_completions(request: Request):
+    payload = await request.json()
+    _record("chat")
+    limited = _rate_limited()
+    if limited:
+        return limited
+
+    messages = payload.get("messages", [])
+    model = payload.get("model", "glm-4.6")
+    content = _fake_content(messages)
+    usage = _usage(messages, content)
+    completion_id = f"mock-{uuid.uuid4().hex[:12]}"
+    created = int(time.time())
+
+    if payload.get("stream"):
+        async def event_stream():
+            await asyncio.sleep(config.latency_for("chat_first_token"))
+            step = max(1, math.ceil(len(content) / config.stream_chunks))
+            for i in range(0, len(content), step):
+                chunk = {
+                    "id": completion_id,
+                    "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {"role": "assistant", "content": content[i:i + step]}}]
+                }
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                await asyncio.sleep(config.chunk_delay.sample())
+            final = {
+                "id": completion_id,
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop", "delta": {"role": "assistant", "content": ""}}],
+                "usage": usage
+            }
+            yield f"data: {json.dumps(final, ensure_ascii=False)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+    await asyncio.sleep(config.latency_for("chat"))
+    return {
+        "id": completion_id,
+        "created": created,
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "finish_reason": "stop",
+            "message": {"role": "assistant", "content": content}
+        }],
+        "usage": usage
+    }
+
+
+@app.post(f"{PREFIX}/images/generations")
+async def images_generations(request: Request):
+    payload = await request.json()
+    _record("image")
+    limited = _rate_limited()
+    if limited:
+        return limited
+    await asyncio.sleep(config.latency_for("image"))
+    return {
+        "created": int(time.time()),
+        "data": [{"url": f"https://mock.bigmodel.cn/images/{uuid.uuid4().hex}.png"}],
+        "model": payload.get("model")
+    }
+
+
+@app.post(f"{PREFIX}/videos/generations")
+async def videos_generations(request: Request):
+    payload = await request.json()
+    _record("video")
+    limited = _rate_limited()
+    if limited:
+        return limited
+    await asyncio.sleep(config.latency_for("video"))
+    task_id = uuid.uuid4().hex
+    video_tasks[task_id] = {
+        "ready_at": time.time() + config.video_render_time.sample(),
+        "model": payload.get("model")
+    }
+    return {"id": task_id, "model": payload.get("model"), "task_status": "PROCESSING"}
+
+
+@app.get(f"{PREFIX}/async-result/{{task_id}}")
+async def async_result(task_id: str):
+    _record("async_result")
+    await asyncio.sleep(config.latency_for("async_result"))
+    task = video_tasks.get(task_id)
+    if task is None:
+        return JSONResponse(status_code=404, content={"error": {"message": "任务不存在"}})
+    if time.time() < task["ready_at"]:
+        return {"id": task_id, "task_status": "PROCESSING"}
+    return {
+        "id": task_id,
+        "task_status": "SUCCESS",
+        "video_result": [{
+            "url": f"https://mock.bigmodel.cn/videos/{task_id}.mp4",
+            "cover_image_url": f"https://mock.bigmodel.cn/videos/{task_id}.jpg"
+        }]
+    }
+
+
+@app.get("/mock/stats")
+async def mock_stats():
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟智谱API服务器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency", default="fixed:0.05", help="默认延迟分布，如 lognormal:-0.7,0.5")
+    parser.add_argument(
+        "--endpoint-latency",
+        action="append",
+        default=[],
+        help="按端点覆盖延迟，如 image=uniform:2,5（端点：chat、chat_first_token、image、video、async_result）"
+    )
+    parser.add_argument("--chunk-delay", default="fixed:0.01", help="流式chunk间隔分布")
+    parser.add_argument("--stream-chunks", type=int, default=40)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="随机返回429的比例（0-1）")
+    parser.add_argument("--video-render-time", default="fixed:6", help="视频任务渲染耗时分布")
+    args = parser.parse_args()
+
+    config.latency["default"] = LatencyModel(args.latency)
+    for item in args.endpoint_latency:
+        endpoint, _, spec = item.partition("=")
+        config.latency[endpoint] = LatencyModel(spec)
+    config.chunk_delay = LatencyModel(args.chunk_delay)
+    config.stream_chunks = args.stream_chunks
+    config.error_rate = args.error_rate
+    config.video_render_time = LatencyModel(args.video_render_time)
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
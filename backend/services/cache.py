@@ -0,0 +1,246 @@
+"""
+Cache Service - 两级缓存（内存LRU + SQLite持久化）
+用于缓存上游模型的确定性结果，重复请求不再消耗token
+"""
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+from utils.config import settings
+from utils.database import connect_sqlite
+
+_EXPIRED = object()
+
+def make_cache_key(*parts: Any) -> str:
+    """对任意可JSON序列化的内容计算规范化哈希（键排序、紧凑分隔符）"""
+    canonical = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+class TieredCache:
+    """内存LRU + SQLite持久化的两级缓存
+
+    - 内存层：OrderedDict实现LRU，按条目数淘汰
+    - 持久层：SQLite表 cache_entries，按 namespace 隔离，按最近访问时间淘汰
+    - 两层都按TTL过期；值必须可JSON序列化
+    """
+
+    _EVICT_EVERY = 100  # 每写入N次检查一次持久层容量
+
+    def __init__(
+        self,
+        namespace: str,
+        max_entries: int = 1000,
+        ttl: Optional[float] = None,
+        max_persistent_entries: int = 10000,
+        persist: bool = True
+    ):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_persistent_entries = max_persistent_entries
+        self.persist = persist
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._writes = 0
+        self._stats = {
+            "memory_hits": 0,
+            "persistent_hits": 0,
+            "misses": 0,
+            "sets": 0,
+            "memory_evictions": 0,
+            "persistent_evictions": 0,
+            "expired": 0
+        }
+
+    # ---- 持久层（在线程池中执行，避免阻塞事件循环） ----
+
+    def _conn(self):
+        if self._db is None:
+            self._db = connect_sqlite()
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    expires_at REAL,
+                    last_access REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )
+            """)
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_cache_entries_access ON cache_entries (namespace, last_access)"
+            )
+            self._db.commit()
+        return self._db
+
+    def _db_get(self, key: str) -> Optional[tuple]:
+        with self._db_lock:
+            conn = self._conn()
+            row = conn.execute(
+                "SELECT value, expires_at FROM cache_entries WHERE namespace = ? AND key = ?",
+                (self.namespace, key)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            now = time.time()
+            if expires_at is not None and expires_at <= now:
+                conn.execute("DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (self.namespace, key))
+                conn.commit()
+                return (_EXPIRED, None)
+            conn.execute(
+                "UPDATE cache_entries SET last_access = ? WHERE namespace = ? AND key = ?",
+                (now, self.namespace, key)
+            )
+            conn.commit()
+            return (json.loads(value), expires_at)
+
+    def _db_set(self, key: str, value: Any, expires_at: Optional[float], evict: bool):
+        with self._db_lock:
+            conn = self._conn()
+            now = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache_entries (namespace, key, value, created_at, expires_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (self.namespace, key, json.dumps(value, ensure_ascii=False), now, expires_at, now)
+            )
+            if evict:
+                self._db_evict(conn, now)
+            conn.commit()
+
+    def _db_evict(self, conn, now: float):
+        cursor = conn.execute(
+            "DELETE FROM cache_entries WHERE namespace = ? AND expires_at IS NOT NULL AND expires_at <= ?",
+            (self.namespace, now)
+        )
+        evicted = cursor.rowcount
+        count = conn.execute(
+            "SELECT COUNT(*) FROM cache_entries WHERE namespace = ?", (self.namespace,)
+        ).fetchone()[0]
+        overflow = count - self.max_persistent_entries
+        if overflow > 0:
+            cursor = conn.execute(
+                "DELETE FROM cache_entries WHERE namespace = ? AND key IN ("
+                "SELECT key FROM cache_entries WHERE namespace = ? ORDER BY last_access ASC LIMIT ?)",
+                (self.namespace, self.namespace, overflow)
+            )
+            evicted += cursor.rowcount
+        self._stats["persistent_evictions"] += evicted
+
+    def _db_delete(self, key: Optional[str]):
+        with self._db_lock:
+            conn = self._conn()
+            if key is None:
+                conn.execute("DELETE FROM cache_entries WHERE namespace = ?", (self.namespace,))
+            else:
+                conn.execute("DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (self.namespace, key))
+            conn.commit()
+
+    # ---- 内存层 ----
+
+    def _memory_put(self, key: str, value: Any, expires_at: Optional[float]):
+        self._memory[key] = (value, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self._stats["memory_evictions"] += 1
+
+    # ---- 对外接口 ----
+
+    async def get(self, key: str) -> Optional[Any]:
+        """读取缓存，未命中或已过期返回None"""
+        entry = self._memory.get(key)
+        if entry is not None:
+            value, expires_at = entry
+            if expires_at is None or expires_at > time.time():
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return value
+            del self._memory[key]
+            self._stats["expired"] += 1
+
+        if self.persist:
+            try:
+                row = await asyncio.to_thread(self._db_get, key)
+            except Exception as e:
+                print(f"[WARN] Cache '{self.namespace}' read failed: {str(e)}")
+                row = None
+            if row is not None:
+                value, expires_at = row
+                if value is _EXPIRED:
+                    self._stats["expired"] += 1
+                else:
+                    self._memory_put(key, value, expires_at)
+                    self._stats["persistent_hits"] += 1
+                    return value
+
+        self._stats["misses"] += 1
+        return None
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        """写入缓存，ttl为空时使用默认TTL"""
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl else None
+        self._memory_put(key, value, expires_at)
+        self._stats["sets"] += 1
+
+        if self.persist:
+            self._writes += 1
+            evict = self._writes % self._EVICT_EVERY == 0
+            try:
+                await asyncio.to_thread(self._db_set, key, value, expires_at, evict)
+            except Exception as e:
+                print(f"[WARN] Cache '{self.namespace}' write failed: {str(e)}")
+
+    async def delete(self, key: str):
+        self._memory.pop(key, None)
+        if self.persist:
+            await asyncio.to_thread(self._db_delete, key)
+
+    async def clear(self):
+        self._memory.clear()
+        if self.persist:
+            await asyncio.to_thread(self._db_delete, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        hits = stats["memory_hits"] + stats["persistent_hits"]
+        lookups = hits + stats["misses"]
+        stats["hits"] = hits
+        stats["hit_rate"] = round(hits / lookups, 4) if lookups else 0.0
+        stats["memory_entries"] = len(self._memory)
+        stats["max_entries"] = self.max_entries
+        stats["ttl"] = self.ttl
+        return stats
+
+# 全局实例
+completion_cache = TieredCache(
+    "completion",
+    max_entries=settings.completion_cache_max_entries,
+    ttl=settings.completion_cache_ttl,
+    max_persistent_entries=settings.completion_cache_max_persistent_entries,
+    persist=settings.completion_cache_persist
+)
+
+# 图像/视频理解结果缓存：按（媒体内容指纹, 模型, 提示词）缓存
+analysis_cache = TieredCache(
+    "analysis",
+    max_entries=settings.analysis_cache_max_entries,
+    ttl=settings.analysis_cache_ttl,
+    max_persistent_entries=settings.analysis_cache_max_persistent_entries,
+    persist=settings.completion_cache_persist
+)
+
+# 前文分块/合并摘要缓存：按（层级, 模型, 内容哈希）缓存
+summary_cache = TieredCache(
+    "summary",
+    max_entries=settings.summary_cache_max_entries,
+    ttl=settings.summary_cache_ttl,
+    max_persistent_entries=settings.completion_cache_max_persistent_entries,
+    persist=settings.completion_cache_persist
+)
@@ -0,0 +1,149 @@
+"""
+HTTP Client Pool - 共享的长连接HTTP客户端
+所有上游调用（智谱API、MCP）复用同一个连接池，避免每个请求重新进行TCP+TLS握手
+"""
+import time
+import httpx
+from typing import Dict, Any, Optional
+from utils.config import settings
+
+
+def _http2_available() -> bool:
+    """HTTP/2 需要可选依赖 h2（httpx[http2]）"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class _InstrumentedTransport(httpx.AsyncBaseTransport):
+    """包装底层传输层，通过 httpcore trace 事件统计连接复用和排队情况"""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, stats: Dict[str, Any]):
+        self._transport = transport
+        self._stats = stats
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        stats = self._stats
+        start = time.perf_counter()
+        state = {"dequeued": False, "connected": False}
+        parent_trace = request.extensions.get("trace")
+
+        def mark_dequeued():
+            if not state["dequeued"]:
+                state["dequeued"] = True
+                stats["waiting"] -= 1
+                wait_ms = (time.perf_counter() - start) * 1000
+                stats["pool_wait_total_ms"] += wait_ms
+                stats["pool_wait_max_ms"] = max(stats["pool_wait_max_ms"], wait_ms)
+
+        async def trace(event_name: str, info: Dict[str, Any]):
+            # 第一个trace事件出现时，说明已经从连接池拿到了连接
+            mark_dequeued()
+            if event_name == "connection.connect_tcp.complete":
+                state["connected"] = True
+            if parent_trace is not None:
+                await parent_trace(event_name, info)
+
+        request.extensions = {**request.extensions, "trace": trace}
+
+        stats["requests_total"] += 1
+        stats["in_flight"] += 1
+        stats["waiting"] += 1
+        stats["peak_in_flight"] = max(stats["peak_in_flight"], stats["in_flight"])
+        try:
+            return await self._transport.handle_async_request(request)
+        except Exception:
+            stats["errors"] += 1
+            raise
+        finally:
+            mark_dequeued()
+            stats["in_flight"] -= 1
+            if state["connected"]:
+                stats["connections_opened"] += 1
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+class HTTPClientPool:
+    """应用级共享的 httpx.AsyncClient
+
+    - keep-alive 长连接，可用时启用 HTTP/2
+    - 连接池大小、超时时间均可在 utils/config.py 中配置
+    - 客户端首次使用时懒加载创建，应用关闭时由 lifespan 统一释放
+    """
+
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+        self.http2_enabled = False
+        self._stats = self._empty_stats()
+
+    @staticmethod
+    def _empty_stats() -> Dict[str, Any]:
+        return {
+            "requests_total": 0,
+            "connections_opened": 0,
+            "in_flight": 0,
+            "peak_in_flight": 0,
+            "waiting": 0,
+            "pool_wait_total_ms": 0.0,
+            "pool_wait_max_ms": 0.0,
+            "errors": 0
+        }
+
+    def _build_client(self) -> httpx.AsyncClient:
+        self.http2_enabled = settings.http2_enabled and _http2_available()
+        limits = httpx.Limits(
+            max_connections=settings.http_max_connections,
+            max_keepalive_connections=settings.http_max_keepalive_connections,
+            keepalive_expiry=settings.http_keepalive_expiry
+        )
+        transport = httpx.AsyncHTTPTransport(
+            http2=self.http2_enabled,
+            limits=limits,
+            retries=settings.http_connect_retries
+        )
+        print(f"[INFO] HTTP client pool created: max_connections={settings.http_max_connections}, http2={self.http2_enabled}")
+        return httpx.AsyncClient(
+            transport=_InstrumentedTransport(transport, self._stats),
+            timeout=self.timeout("default")
+        )
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """获取共享客户端（懒加载）"""
+        if self._client is None or self._client.is_closed:
+            self._client = self._build_client()
+        return self._client
+
+    def timeout(self, operation: str) -> httpx.Timeout:
+        """按操作类型获取超时配置：chat、stream、image、video、vision、search、mcp"""
+        read_timeout = getattr(settings, f"http_timeout_{operation}", settings.http_timeout_default)
+        return httpx.Timeout(read_timeout, connect=settings.http_connect_timeout)
+
+    async def aclose(self):
+        """关闭连接池"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            print("[INFO] HTTP client pool closed")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """连接池统计：请求数、新建连接数、复用率、排队情况"""
+        stats = dict(self._stats)
+        total = stats["requests_total"]
+        completed = total - stats["in_flight"]
+        stats["connections_reused"] = max(completed - stats["connections_opened"], 0)
+        stats["reuse_ratio"] = round(stats["connections_reused"] / completed, 4) if completed else 0.0
+        stats["pool_wait_avg_ms"] = round(stats["pool_wait_total_ms"] / total, 2) if total else 0.0
+        stats["pool_wait_total_ms"] = round(stats["pool_wait_total_ms"], 2)
+        stats["pool_wait_max_ms"] = round(stats["pool_wait_max_ms"], 2)
+        stats["http2"] = self.http2_enabled
+        stats["max_connections"] = settings.http_max_connections
+        stats["max_keepalive_connections"] = settings.http_max_keepalive_connections
+        return stats
+
+# 全局实例
+http_pool = HTTPClientPool()
@@ -0,0 +1,146 @@
+"""
+Image Processor - 图片预处理
+在进程池中用Pillow处理图片（不占用事件循环和GIL）：
+- 发送给视觉模型前按最长边缩放、重新压缩并去除EXIF等元数据
+- 为前端生成缩略图
+处理结果按原图内容哈希缓存在 uploads/derived 下，相同图片只处理一次
+"""
+import asyncio
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, Optional
+from utils.config import settings
+from utils.media import file_sha256
+
+def _render(src: str, dst: str, max_edge: int, quality: int, keep_if_smaller: bool) -> Dict[str, Any]:
+    """在子进程中执行：缩放到 max_edge 以内、转为JPEG（不写入元数据）
+
+    keep_if_smaller 为真且原图尺寸、体积都不超过处理结果时不输出文件（written=False）
+    """
+    from PIL import Image, ImageOps
+
+    before = os.path.getsize(src)
+    with Image.open(src) as image:
+        original_size = image.size
+        if getattr(image, "is_animated", False):
+            return {"written": False, "before": before, "after": before, "size": original_size}
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ("RGBA", "LA", "P"):
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+        temp = f"{dst}.{uuid.uuid4().hex}.tmp"
+        image.save(temp, format="JPEG", quality=quality, optimize=True)
+        after = os.path.getsize(temp)
+        if keep_if_smaller and after >= before and max(original_size) <= max_edge:
+            os.remove(temp)
+            return {"written": False, "before": before, "after": before, "size": original_size}
+        os.replace(temp, dst)
+        return {"written": True, "before": before, "after": after, "size": image.size}
+
+class ImageProcessor:
+    def __init__(self, output_dir: Optional[str] = None, workers: Optional[int] = None):
+        self.output_dir = output_dir or os.path.join(settings.upload_dir, "derived")
+        self.workers = workers or settings.image_process_workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._unchanged: Dict[str, str] = {}  # 无需处理的图片（输出路径 -> 原图路径）
+        self._stats = {
+            "processed": 0,
+            "cache_hits": 0,
+            "unchanged": 0,
+            "failed": 0,
+            "bytes_before": 0,
+            "bytes_after": 0
+        }
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    async def _derive(self, src: str, variant: str, max_edge: int, quality: int, keep_if_smaller: bool) -> str:
+        sha256 = await file_sha256(src)
+        dst = os.path.join(self.output_dir, sha256[:2], f"{sha256}_{variant}_{max_edge}.jpg")
+        if dst in self._unchanged:
+            self._stats["cache_hits"] += 1
+            return self._unchanged[dst]
+        if os.path.exists(dst):
+            self._stats["cache_hits"] += 1
+            return dst
+
+        # 同一图片的并发请求只处理一次
+        pending = self._inflight.get(dst)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[dst] = future
+        try:
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            result = await asyncio.get_running_loop().run_in_executor(
+                self.executor, _render, src, dst, max_edge, quality, keep_if_smaller
+            )
+        except BaseException as e:
+            self._stats["failed"] += 1
+            future.set_exception(e)
+            future.exception()  # 标记异常已取回，避免无人等待时告警
+            raise
+        finally:
+            self._inflight.pop(dst, None)
+
+        self._stats["processed"] += 1
+        self._stats["bytes_before"] += result["before"]
+        self._stats["bytes_after"] += result["after"]
+        if result["written"]:
+            print(f"[INFO] Image {variant}: {result['before']} -> {result['after']} bytes {result['size']}")
+            output = dst
+        else:
+            self._stats["unchanged"] += 1
+            self._unchanged[dst] = src
+            output = src
+        future.set_result(output)
+        return output
+
+    async def prepare_for_vision(self, path: str) -> str:
+        """返回发送给视觉模型的图片路径（缩放+重压缩+去元数据），处理失败时返回原图"""
+        try:
+            return await self._derive(
+                path, "vision", settings.vision_image_max_edge, settings.vision_image_quality, keep_if_smaller=True
+            )
+        except Exception as e:
+            print(f"[WARN] Image preprocessing failed, sending original: {str(e)}")
+            return path
+
+    async def thumbnail(self, path: str) -> Optional[str]:
+        """生成缩略图，返回缩略图路径；处理失败返回None"""
+        try:
+            return await self._derive(
+                path, "thumb", settings.thumbnail_max_edge, settings.thumbnail_quality, keep_if_smaller=False
+            )
+        except Exception as e:
+            print(f"[WARN] Thumbnail generation failed: {str(e)}")
+            return None
+
+    def shutdown(self):
+        """关闭进程池（应用关闭时调用）"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        stats["workers"] = self.workers
+        stats["saved_ratio"] = round(
+            1 - stats["bytes_after"] / stats["bytes_before"], 4
+        ) if stats["bytes_before"] else 0.0
+        return stats
+
+# 全局实例
+image_processor = ImageProcessor()
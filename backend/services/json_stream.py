@@ -0,0 +1,191 @@
+"""
+JSON Stream - 模型流式输出的增量JSON解析
+逐字符扫描增量文本（每个字符只扫描一次），在顶层值闭合时立即产出：
+- fields 模式：根对象的每个字段（如角色设定的 basic_info、appearance）
+- items 模式：数组的每个元素（根数组，或根对象中第一个数组字段，如 {"storyboard": [...]} 中的镜头）
+JSON之前的说明文字、```json 代码块标记会被跳过
+"""
+from typing import Any, Dict, List, Optional, Tuple
+from services.sse import StreamEvent
+from utils.fast_json import loads as _loads
+from utils.json_extract import extract_json, json_extract_stats, JSONExtraction
+
+class _Frame:
+    __slots__ = ("kind", "key", "index", "start", "expect_key")
+
+    def __init__(self, kind: str):
+        self.kind = kind  # "{" 或 "["
+        self.key: Optional[str] = None
+        self.index = 0
+        self.start: Optional[int] = None  # 当前值在缓冲区中的起始位置
+        self.expect_key = kind == "{"
+
+class IncrementalJSONParser:
+    """增量JSON解析器：feed() 接收任意切分的文本，返回本次新闭合的 (键或下标, 值) 列表"""
+
+    def __init__(self, mode: str = "fields"):
+        if mode not in ("fields", "items"):
+            raise ValueError(f"不支持的解析模式: {mode}")
+        self.mode = mode
+        self.buffer = ""
+        self.done = False  # 根值已闭合
+        self.failed = 0  # 闭合后仍无法解析的值数量
+        self._pos = 0
+        self._stack: List[_Frame] = []
+        self._target: Optional[_Frame] = None  # 需要产出其子值的容器
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._string_is_key = False
+        self._root_start: Optional[int] = None
+
+    def feed(self, text: str) -> List[Tuple[Any, Any]]:
+        self.buffer += text
+        emitted: List[Tuple[Any, Any]] = []
+        buffer = self.buffer
+        stack = self._stack
+        i = self._pos
+        end = len(buffer)
+        while i < end and not self.done:
+            c = buffer[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    frame = stack[-1]
+                    if self._string_is_key:
+                        frame.key = self._load(buffer[self._string_start:i + 1])
+                    elif frame.start == self._string_start:
+                        self._complete(frame, i + 1, emitted)
+                i += 1
+                continue
+            if c in " \t\r\n":
+                i += 1
+                continue
+            if not stack:
+                if c in "{[":
+                    self._root_start = i
+                    self._push(c)
+                i += 1  # 根值之前的说明文字、代码块标记直接跳过
+                continue
+
+            frame = stack[-1]
+            if c == '"':
+                self._in_string = True
+                self._string_start = i
+                self._string_is_key = frame.expect_key
+                if not frame.expect_key and frame.start is None:
+                    frame.start = i
+            elif c == ":":
+                frame.expect_key = False
+            elif c == ",":
+                if frame.start is not None:
+                    self._complete(frame, i, emitted)  # 数字、true/false/null
+                frame.expect_key = frame.kind == "{"
+            elif c in "}]":
+                if frame.start is not None:
+                    self._complete(frame, i, emitted)
+                stack.pop()
+                if stack:
+                    self._complete(stack[-1], i + 1, emitted)
+                else:
+                    self.done = True
+            elif c in "{[":
+                if frame.start is None:
+                    frame.start = i
+                self._push(c)
+            elif frame.start is None:
+                frame.start = i
+            i += 1
+        self._pos = i
+        return emitted
+
+    @property
+    def started(self) -> bool:
+        return self._root_start is not None
+
+    def text(self) -> str:
+        """根值的原始文本（未闭合时为已接收部分）"""
+        return self.buffer[self._root_start:self._pos] if self._root_start is not None else self.buffer
+
+    def _push(self, kind: str):
+        frame = _Frame(kind)
+        stack = self._stack
+        if self._target is None:
+            if self.mode == "fields" and not stack and kind == "{":
+                self._target = frame
+            elif self.mode == "items" and kind == "[" and (
+                not stack or (len(stack) == 1 and stack[0].kind == "{")
+            ):
+                self._target = frame
+        stack.append(frame)
+
+    def _complete(self, frame: _Frame, end: int, emitted: List[Tuple[Any, Any]]):
+        start = frame.start
+        frame.start = None
+        if frame.kind == "[":
+            key = frame.index
+            frame.index += 1
+        else:
+            key = frame.key
+        if frame is not self._target:
+            return
+        try:
+            emitted.append((key, _loads(self.buffer[start:end])))
+        except ValueError:
+            self.failed += 1
+            print(f"[WARN] Incremental JSON value could not be parsed: {key}")
+
+    @staticmethod
+    def _load(raw: str) -> Any:
+        try:
+            return _loads(raw)
+        except ValueError:
+            return raw.strip('"')
+
+async def stream_json_events(events, mode: str, event_name: str):
+    """把对话流（StreamEvent）转换为结构化事件流
+
+    每个闭合的字段/元素产出一个 event_name 事件（data: {"key"/"index", "value"}），
+    结束前产出 result 事件（data: {"value": 完整结果, "complete": 是否完整闭合, "repairs": 修复项,
+    "raw_content": 未能解析时的原文}）；输出不完整（如被截断）时用 extract_json 修复后作为结果。
+    usage 与 done 原样透传
+    """
+    source = f"stream.{event_name}"
+    parser = IncrementalJSONParser(mode)
+    collected: Dict[Any, Any] = {}
+    index_key = "index" if mode == "items" else "key"
+    async for event in events:
+        if event.type == "delta":
+            for key, value in parser.feed(event.content):
+                collected[key] = value
+                yield StreamEvent(event_name, data={index_key: key, "value": value})
+        elif event.type == "done":
+            value: Any = list(collected.values()) if mode == "items" else collected
+            result = {"value": value, "complete": parser.done}
+            if parser.done and not parser.failed:
+                json_extract_stats.record(source, JSONExtraction(value, ok=True))
+            else:
+                extraction = extract_json(parser.text(), source=source)
+                if extraction.ok:
+                    result["value"] = _unwrap(extraction.value) if mode == "items" else extraction.value
+                    result["repairs"] = extraction.repairs
+                else:
+                    result["raw_content"] = extraction.text
+            yield StreamEvent("result", data=result)
+            yield event
+        else:
+            yield event
+
+def _unwrap(value: Any) -> List[Any]:
+    """items 模式的结果：根数组，或根对象中第一个数组字段"""
+    if isinstance(value, list):
+        return value
+    if isinstance(value, dict):
+        for item in value.values():
+            if isinstance(item, list):
+                return item
+    return [value]
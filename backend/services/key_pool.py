@@ -0,0 +1,185 @@
+"""
+API Key Pool - 并发安全的API密钥池
+每个上游请求租用一个密钥（不再修改全局共享的headers），
+按近期429、延迟、额度状态给密钥打分，把并发请求分散到所有健康的密钥上
+"""
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Any, List, Optional
+from utils.config import settings
+from services.rate_limiter import RateGovernor, rate_governor as default_rate_governor, key_label, retry_after_seconds
+
+# 智谱错误码：余额不足/欠费、当日额度耗尽等，需要较长时间的冷却
+_QUOTA_ERROR_CODES = {"1113", "1304", "1308", "1310"}
+
+class NoHealthyKeyError(Exception):
+    """所有密钥都处于额度耗尽或失效状态"""
+
+class _KeyState:
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+        self.label = key_label(api_key)
+        self.headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        }
+        self.in_flight = 0
+        self.leases = 0
+        self.successes = 0
+        self.failures = 0
+        self.rate_limited = 0
+        self.ewma_latency = 0.0
+        self._penalty = 0.0  # 近期429惩罚分，按半衰期衰减
+        self._penalty_at = time.monotonic()
+        self.disabled_until = 0.0
+        self.disabled_reason: Optional[str] = None
+
+    def penalty(self, now: float) -> float:
+        half_life = settings.key_pool_penalty_half_life
+        return self._penalty * math.pow(0.5, (now - self._penalty_at) / half_life) if half_life else 0.0
+
+    def add_penalty(self, now: float, amount: float = 1.0):
+        self._penalty = self.penalty(now) + amount
+        self._penalty_at = now
+
+    def healthy(self, now: float) -> bool:
+        return self.disabled_until <= now
+
+    def observe_latency(self, latency: float):
+        alpha = 0.3
+        self.ewma_latency = latency if self.ewma_latency == 0 else alpha * latency + (1 - alpha) * self.ewma_latency
+
+class KeyLease:
+    """一次上游调用租用的密钥"""
+
+    def __init__(self, pool: "APIKeyPool", state: _KeyState, model: str):
+        self._pool = pool
+        self._state = state
+        self.model = model
+        self.api_key = state.api_key
+        self.label = state.label
+        self.headers = state.headers
+        self.started = time.monotonic()
+        self.observed = False
+
+    def observe(self, response) -> None:
+        """根据上游响应更新密钥健康度（429、额度耗尽、密钥失效）"""
+        self.observed = True
+        self._pool._observe(self, response)
+
+class APIKeyPool:
+    """多密钥池：租用时选择得分最低的健康密钥
+
+    得分 = 当前占用（进行中 + 限流排队）+ 近期429惩罚 + 延迟权重，
+    额度耗尽或失效的密钥在冷却期内不参与选择
+    """
+
+    def __init__(self, api_keys: List[str], name: str = "default", governor: Optional[RateGovernor] = None):
+        if not api_keys:
+            raise ValueError(f"密钥池 {name} 至少需要一个API密钥")
+        self.name = name
+        self.governor = governor or default_rate_governor
+        self._keys = [_KeyState(key) for key in api_keys]
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def _score(self, state: _KeyState, model: str, now: float) -> float:
+        load = state.in_flight + self.governor.queue_depth(state.api_key, model)
+        return (
+            load
+            + settings.key_pool_penalty_weight * state.penalty(now)
+            + state.ewma_latency / settings.key_pool_latency_scale
+        )
+
+    def _pick(self, model: str, exclude: Optional[set] = None) -> _KeyState:
+        now = time.monotonic()
+        candidates = [s for s in self._keys if s.healthy(now) and (not exclude or s.label not in exclude)]
+        if not candidates:
+            candidates = [s for s in self._keys if s.healthy(now)]
+        if not candidates:
+            raise NoHealthyKeyError(f"密钥池 {self.name} 中所有API密钥均已耗尽额度或失效")
+        return min(candidates, key=lambda s: (self._score(s, model, now), s.leases))
+
+    @asynccontextmanager
+    async def lease(self, model: str, exclude: Optional[set] = None):
+        """租用一个密钥并获取该密钥对应模型族的限流名额
+
+        exclude: 重试时希望避开的密钥标识（如刚刚返回429的密钥）
+        """
+        state = self._pick(model, exclude)
+        state.leases += 1
+        state.in_flight += 1
+        try:
+            async with self.governor.slot(state.api_key, model):
+                lease = KeyLease(self, state, model)
+                try:
+                    yield lease
+                except BaseException:
+                    state.failures += 1
+                    raise
+                if not lease.observed:
+                    state.successes += 1
+                    state.observe_latency(time.monotonic() - lease.started)
+        finally:
+            state.in_flight -= 1
+
+    def _observe(self, lease: KeyLease, response) -> None:
+        state = lease._state
+        now = time.monotonic()
+        status = response.status_code
+        if status < 400:
+            state.successes += 1
+            state.observe_latency(now - lease.started)
+            self.governor.reward(state.api_key, lease.model)
+            return
+
+        state.failures += 1
+        if status == 401:
+            self._disable(state, settings.key_pool_invalid_cooldown, "invalid")
+        elif status == 429:
+            code = _error_code(response)
+            if code in _QUOTA_ERROR_CODES:
+                self._disable(state, settings.key_pool_quota_cooldown, f"quota:{code}")
+            else:
+                state.rate_limited += 1
+                state.add_penalty(now)
+                self.governor.penalize(state.api_key, lease.model, retry_after_seconds(response))
+
+    def _disable(self, state: _KeyState, cooldown: float, reason: str):
+        state.disabled_until = time.monotonic() + cooldown
+        state.disabled_reason = reason
+        print(f"[WARN] Key {state.label} in pool '{self.name}' disabled for {cooldown:.0f}s ({reason})")
+
+    def get_stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "name": self.name,
+            "keys": [
+                {
+                    "key": s.label,
+                    "healthy": s.healthy(now),
+                    "disabled_reason": s.disabled_reason if not s.healthy(now) else None,
+                    "disabled_for": round(max(s.disabled_until - now, 0.0), 1),
+                    "in_flight": s.in_flight,
+                    "leases": s.leases,
+                    "successes": s.successes,
+                    "failures": s.failures,
+                    "rate_limited": s.rate_limited,
+                    "penalty": round(s.penalty(now), 3),
+                    "ewma_latency_ms": round(s.ewma_latency * 1000, 1)
+                }
+                for s in self._keys
+            ]
+        }
+
+def _error_code(response) -> Optional[str]:
+    try:
+        return str(response.json().get("error", {}).get("code"))
+    except Exception:
+        return None
+
+# 全局实例：普通密钥池（文本/图像/视频生成）和MAX密钥池（图像视频理解、联网搜索、MCP）
+key_pool = APIKeyPool(settings.all_zhipu_api_keys(), "standard")
+max_key_pool = APIKeyPool(settings.all_zhipu_max_api_keys(), "max")
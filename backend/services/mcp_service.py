@@ -2,14 +2,22 @@
 MCP Service - 集成智谱AI的MCP工具
 支持：图像理解、视频理解、联网搜索
 """
-import httpx
 import json
 from typing import Dict, Any, List, Optional
 from utils.config import settings
+from services.http_client import HTTPClientPool, http_pool as default_http_pool
+from services.key_pool import APIKeyPool, max_key_pool as default_max_key_pool
+from services.quota_ledger import quota_ledger
+from services.cache import analysis_cache, make_cache_key
+from services.singleflight import upstream_flight
+from services.search_cache import search_cache, normalize_query
+from services.image_processor import image_processor
+from utils.media import media_fingerprint, local_media_file, InlineMediaPayload, INLINE_MEDIA
 
 class MCPService:
-    def __init__(self):
-        self.max_api_key = settings.zhipu_max_api_key
+    def __init__(self, http_pool: Optional[HTTPClientPool] = None, key_pool: Optional[APIKeyPool] = None):
+        self.http_pool = http_pool or default_http_pool
+        self.key_pool = key_pool or default_max_key_pool
         self.base_url = settings.zhipu_base_url
         
     async def call_with_mcp(
@@ -21,11 +29,6 @@ class MCPService:
         temperature: float = 0.7
     ) -> Dict[str, Any]:
         """使用MCP工具调用GLM-4.6 MAX"""
-        headers = {
-            "Authorization": f"Bearer {self.max_api_key}",
-            "Content-Type": "application/json"
-        }
-        
         payload = {
             "model": model,
             "messages": messages,
@@ -34,17 +37,21 @@ class MCPService:
             "temperature": temperature
         }
         
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            response = await client.post(
+        async with self.key_pool.lease(model) as lease:
+            response = await self.http_pool.client.post(
                 f"{self.base_url}chat/completions",
-                headers=headers,
-                json=payload
+                headers=lease.headers,
+                json=payload,
+                timeout=self.http_pool.timeout("mcp")
             )
-            response.raise_for_status()
-            return response.json()
+            lease.observe(response)
+        response.raise_for_status()
+        result = response.json()
+        await quota_ledger.record(model, "mcp", result.get("usage"))
+        return result
     
     async def web_search(self, query: str) -> Dict[str, Any]:
-        """联网搜索 - 使用web_search_prime MCP"""
+        """联网搜索 - 使用web_search_prime MCP（相同查询同时进行时只调用一次上游）"""
         messages = [
             {
                 "role": "user",
@@ -62,15 +69,33 @@ class MCPService:
             }
         ]
         
-        return await self.call_with_mcp(messages, tools)
+        await quota_ledger.check_units("search_count")
+
+        async def call():
+            result = await self.call_with_mcp(messages, tools)
+            await quota_ledger.record("glm-4-plus", "search", pack="search_count", units=1)
+            return result
+
+        if not settings.singleflight_enabled:
+            return await call()
+        return await upstream_flight.do(f"mcp_search:{make_cache_key(messages, tools)}", call, kind="mcp_search")
     
-    async def analyze_image_url(self, image_url: str, prompt: str = "请详细描述这张图片") -> str:
-        """图像理解 - 使用GLM-4V"""
-        headers = {
-            "Authorization": f"Bearer {self.max_api_key}",
-            "Content-Type": "application/json"
-        }
-        
+    async def analyze_image_url(self, image_url: str, prompt: str = "请详细描述这张图片", cache: bool = True) -> str:
+        """图像理解 - 使用GLM-4V（相同图片 + 相同提示词的结果会被缓存）"""
+        cache_key = None
+        if cache:
+            cache_key = make_cache_key(await media_fingerprint(image_url), "glm-4v-plus", prompt)
+            cached = await analysis_cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        # 本地上传的图片上游无法访问：预处理后以base64 data URL内联发送
+        local_file = local_media_file(image_url, "image")
+        if local_file is not None:
+            prepared = await image_processor.prepare_for_vision(local_file[0])
+            if prepared != local_file[0]:
+                local_file = (prepared, "image/jpeg")
+
         payload = {
             "model": "glm-4v-plus",
             "messages": [
@@ -78,30 +103,34 @@ class MCPService:
                     "role": "user",
                     "content": [
                         {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": {"url": image_url}}
+                        {"type": "image_url", "image_url": {"url": INLINE_MEDIA if local_file else image_url}}
                     ]
                 }
             ],
             "max_tokens": 1000
         }
+        body = None
+        if local_file is not None:
+            body = InlineMediaPayload(payload, *local_file, max_bytes=settings.vision_max_inline_bytes)
         
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.post(
+        async with self.key_pool.lease(payload["model"]) as lease:
+            response = await self.http_pool.client.post(
                 f"{self.base_url}chat/completions",
-                headers=headers,
-                json=payload
+                headers={**lease.headers, **body.headers} if body else lease.headers,
+                **({"content": body} if body else {"json": payload}),
+                timeout=self.http_pool.timeout("vision")
             )
-            response.raise_for_status()
-            result = response.json()
-            return result["choices"][0]["message"]["content"]
+            lease.observe(response)
+        response.raise_for_status()
+        result = response.json()
+        await quota_ledger.record(payload["model"], "vision", result.get("usage"))
+        content = result["choices"][0]["message"]["content"]
+        if cache_key and content:
+            await analysis_cache.set(cache_key, content)
+        return content
     
     async def analyze_video_url(self, video_url: str, prompt: str = "请分析这个视频") -> str:
         """视频理解 - 使用GLM-4V"""
-        headers = {
-            "Authorization": f"Bearer {self.max_api_key}",
-            "Content-Type": "application/json"
-        }
-        
         payload = {
             "model": "glm-4v-plus",
             "messages": [
@@ -116,15 +145,18 @@ class MCPService:
             "max_tokens": 2000
         }
         
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            response = await client.post(
+        async with self.key_pool.lease(payload["model"]) as lease:
+            response = await self.http_pool.client.post(
                 f"{self.base_url}chat/completions",
-                headers=headers,
-                json=payload
+                headers=lease.headers,
+                json=payload,
+                timeout=self.http_pool.timeout("vision")
             )
-            response.raise_for_status()
-            result = response.json()
-            return result["choices"][0]["message"]["content"]
+            lease.observe(response)
+        response.raise_for_status()
+        result = response.json()
+        await quota_ledger.record(payload["model"], "vision", result.get("usage"))
+        return result["choices"][0]["message"]["content"]
     
     async def enhanced_search(
         self,
@@ -147,17 +179,22 @@ class MCPService:
         }
     
     async def get_hot_topics(self, category: str = "technology", limit: int = 5) -> List[Dict[str, Any]]:
-        """获取热点话题"""
-        query = f"最新{category}热点话题"
-        result = await self.web_search(query)
-        
-        content = result["choices"][0]["message"]["content"]
-        
-        return {
-            "category": category,
-            "topics": content,
-            "source": "web_search_mcp"
-        }
+        """获取热点话题（按分类缓存，过期后先返回旧结果并后台刷新）"""
+        async def fetch():
+            query = f"最新{category}热点话题"
+            result = await self.web_search(query)
+
+            content = result["choices"][0]["message"]["content"]
+
+            return {
+                "category": category,
+                "topics": content,
+                "source": "web_search_mcp"
+            }
+
+        return await search_cache.get_or_fetch(
+            "mcp_hot_topics", (normalize_query(category),), fetch, cacheable=lambda data: bool(data["topics"])
+        )
     
     async def get_inspiration(
         self,
@@ -208,7 +245,7 @@ class MCPService:
             }
         return {"success": False, "error": "Unknown tool"}
     
-    async def analyze_reference_image(self, image_url: str, analysis_type: str) -> Dict[str, Any]:
+    async def analyze_reference_image(self, image_url: str, analysis_type: str, cache: bool = True) -> Dict[str, Any]:
         """分析参考图片"""
         prompts = {
             "composition": "请分析这张图片的构图、布局和视觉元素",
@@ -218,7 +255,7 @@ class MCPService:
         }
         
         prompt = prompts.get(analysis_type, prompts["composition"])
-        content = await self.analyze_image_url(image_url, prompt)
+        content = await self.analyze_image_url(image_url, prompt, cache=cache)
         
         return {
             "analysis_type": analysis_type,
@@ -0,0 +1,215 @@
+"""
+Media Store - 按内容寻址的媒体存储
+上传文件按SHA-256存放在分片目录（media/ab/cd/<sha256><ext>）中，相同内容只存一份、URL稳定；
+SQLite索引记录MIME、大小、尺寸和引用计数，未被引用的对象按存放时间和总容量淘汰
+"""
+import asyncio
+import mimetypes
+import os
+import threading
+import time
+from typing import Dict, Any, List, Optional
+from utils.config import settings
+from utils.database import connect_sqlite
+
+class MediaStore:
+    def __init__(self, root: Optional[str] = None):
+        self.root = root or os.path.join(settings.upload_dir, "media")
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._puts = 0
+        self._stats = {"puts": 0, "deduplicated": 0, "bytes_saved": 0, "released": 0, "evicted": 0, "evicted_bytes": 0}
+
+    # ---- 路径 ----
+
+    def relative_path(self, sha256: str, ext: str) -> str:
+        """相对 upload_dir 的存储路径，两级分片避免单目录文件过多"""
+        return "/".join(["media", sha256[:2], sha256[2:4], f"{sha256}{ext}"])
+
+    def local_path(self, sha256: str, ext: str) -> str:
+        return os.path.join(self.root, sha256[:2], sha256[2:4], f"{sha256}{ext}")
+
+    # ---- 索引（在线程池中执行，避免阻塞事件循环） ----
+
+    def _conn(self):
+        if self._db is None:
+            self._db = connect_sqlite()
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS media_objects (
+                    sha256 TEXT PRIMARY KEY,
+                    ext TEXT NOT NULL,
+                    mime TEXT,
+                    size INTEGER NOT NULL,
+                    width INTEGER,
+                    height INTEGER,
+                    original_name TEXT,
+                    refcount INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_media_objects_unreferenced ON media_objects (refcount, last_access)"
+            )
+            self._db.commit()
+        return self._db
+
+    _COLUMNS = "sha256, ext, mime, size, width, height, original_name, refcount, created_at, last_access"
+
+    def _row_to_dict(self, row) -> Dict[str, Any]:
+        meta = dict(zip([c.strip() for c in self._COLUMNS.split(",")], row))
+        meta["path"] = self.relative_path(meta["sha256"], meta["ext"])
+        return meta
+
+    def _db_put(self, temp_path: str, sha256: str, size: int, ext: str, mime: Optional[str],
+                width: Optional[int], height: Optional[int], original_name: Optional[str]) -> tuple:
+        with self._db_lock:
+            conn = self._conn()
+            now = time.time()
+            row = conn.execute(
+                f"SELECT {self._COLUMNS} FROM media_objects WHERE sha256 = ?", (sha256,)
+            ).fetchone()
+            if row is not None and os.path.exists(self.local_path(sha256, row[1])):
+                os.remove(temp_path)
+                conn.execute(
+                    "UPDATE media_objects SET refcount = refcount + 1, last_access = ? WHERE sha256 = ?",
+                    (now, sha256)
+                )
+                conn.commit()
+                row = conn.execute(f"SELECT {self._COLUMNS} FROM media_objects WHERE sha256 = ?", (sha256,)).fetchone()
+                return self._row_to_dict(row), True
+
+            final_path = self.local_path(sha256, ext)
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.replace(temp_path, final_path)
+            conn.execute(
+                f"INSERT OR REPLACE INTO media_objects ({self._COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?, ?)",
+                (sha256, ext, mime, size, width, height, original_name, now, now)
+            )
+            conn.commit()
+            row = conn.execute(f"SELECT {self._COLUMNS} FROM media_objects WHERE sha256 = ?", (sha256,)).fetchone()
+            return self._row_to_dict(row), False
+
+    def _db_get(self, sha256: str) -> Optional[Dict[str, Any]]:
+        with self._db_lock:
+            row = self._conn().execute(
+                f"SELECT {self._COLUMNS} FROM media_objects WHERE sha256 = ?", (sha256,)
+            ).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def _db_release(self, sha256: str) -> Optional[Dict[str, Any]]:
+        with self._db_lock:
+            conn = self._conn()
+            conn.execute(
+                "UPDATE media_objects SET refcount = MAX(refcount - 1, 0), last_access = ? WHERE sha256 = ?",
+                (time.time(), sha256)
+            )
+            conn.commit()
+            row = conn.execute(f"SELECT {self._COLUMNS} FROM media_objects WHERE sha256 = ?", (sha256,)).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def _db_evict(self) -> List[Dict[str, Any]]:
+        """淘汰未被引用的对象：超过保留期的全部删除，总容量超限时按最近访问时间从旧到新删除"""
+        with self._db_lock:
+            conn = self._conn()
+            now = time.time()
+            victims = conn.execute(
+                "SELECT sha256, ext, size FROM media_objects WHERE refcount = 0 AND last_access < ?",
+                (now - settings.media_store_unreferenced_ttl,)
+            ).fetchall()
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM media_objects").fetchone()[0]
+            total -= sum(size for _, _, size in victims)
+            if total > settings.media_store_max_bytes:
+                chosen = {sha for sha, _, _ in victims}
+                for sha, ext, size in conn.execute(
+                    "SELECT sha256, ext, size FROM media_objects WHERE refcount = 0 ORDER BY last_access ASC"
+                ):
+                    if total <= settings.media_store_max_bytes:
+                        break
+                    if sha not in chosen:
+                        victims.append((sha, ext, size))
+                        total -= size
+
+            for sha, ext, size in victims:
+                try:
+                    os.remove(self.local_path(sha, ext))
+                except FileNotFoundError:
+                    pass
+                conn.execute("DELETE FROM media_objects WHERE sha256 = ?", (sha,))
+            conn.commit()
+        return [{"sha256": sha, "size": size} for sha, _, size in victims]
+
+    def _db_totals(self) -> Dict[str, Any]:
+        with self._db_lock:
+            count, total, unreferenced = self._conn().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(CASE WHEN refcount = 0 THEN 1 ELSE 0 END), 0) "
+                "FROM media_objects"
+            ).fetchone()
+        return {"objects": count, "bytes": total, "unreferenced": unreferenced}
+
+    # ---- 对外接口 ----
+
+    async def put(self, temp_path: str, sha256: str, size: int, ext: str, original_name: Optional[str] = None) -> Dict[str, Any]:
+        """把已写完并算好哈希的临时文件存入媒体库（引用计数+1），内容已存在时删除临时文件直接复用
+
+        返回索引元数据，其中 path 为相对 upload_dir 的稳定路径，deduplicated 表示是否复用了已有对象
+        """
+        ext = ext.lower()
+        mime = mimetypes.guess_type(f"file{ext}")[0]
+        width = height = None
+        if mime and mime.startswith("image/"):
+            width, height = await asyncio.to_thread(_image_size, temp_path)
+
+        meta, deduplicated = await asyncio.to_thread(
+            self._db_put, temp_path, sha256, size, ext, mime, width, height, original_name
+        )
+        self._stats["puts"] += 1
+        if deduplicated:
+            self._stats["deduplicated"] += 1
+            self._stats["bytes_saved"] += size
+
+        self._puts += 1
+        if self._puts % settings.media_store_evict_every == 0:
+            await self.evict()
+
+        meta["deduplicated"] = deduplicated
+        return meta
+
+    async def get(self, sha256: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self._db_get, sha256)
+
+    async def release(self, sha256: str) -> Optional[Dict[str, Any]]:
+        """释放一次引用，引用计数归零的对象之后可被淘汰"""
+        meta = await asyncio.to_thread(self._db_release, sha256)
+        if meta is not None:
+            self._stats["released"] += 1
+        return meta
+
+    async def evict(self) -> List[Dict[str, Any]]:
+        try:
+            evicted = await asyncio.to_thread(self._db_evict)
+        except Exception as e:
+            print(f"[WARN] Media store eviction failed: {str(e)}")
+            return []
+        if evicted:
+            self._stats["evicted"] += len(evicted)
+            self._stats["evicted_bytes"] += sum(item["size"] for item in evicted)
+            print(f"[INFO] Media store evicted {len(evicted)} unreferenced objects")
+        return evicted
+
+    async def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        stats.update(await asyncio.to_thread(self._db_totals))
+        stats["max_bytes"] = settings.media_store_max_bytes
+        return stats
+
+def _image_size(path: str) -> tuple:
+    try:
+        from PIL import Image
+        with Image.open(path) as image:
+            return image.size
+    except Exception:
+        return None, None
+
+# 全局实例
+media_store = MediaStore()
@@ -0,0 +1,431 @@
+"""
+Pipeline - 多阶段生成流水线（DAG）与检查点
+流水线由若干阶段组成，每个阶段声明依赖的阶段；依赖全部完成的阶段立即开始，
+互不依赖的分支并发执行（并发数受 pipeline_stage_concurrency 限制）。
+每个阶段的产出（以及执行中途保存的部分产出）写入SQLite检查点：
+- 重新执行（resume）时已完成的阶段直接跳过，只执行失败、被阻塞或未开始的阶段
+- 某阶段失败时只阻塞依赖它的阶段，其他分支继续执行
+- 每个阶段记录开始/结束时间、耗时和执行次数
+"""
+import asyncio
+import json
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from utils.config import settings
+from utils.database import connect_sqlite
+from services.project_store import NotFoundError
+
+# 阶段 / 流水线状态
+PENDING = "pending"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+BLOCKED = "blocked"  # 依赖的阶段失败
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pipeline_runs (
+    id TEXT PRIMARY KEY,
+    project_id TEXT,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_pipeline_runs_updated ON pipeline_runs (updated_at);
+
+CREATE TABLE IF NOT EXISTS pipeline_stages (
+    run_id TEXT NOT NULL REFERENCES pipeline_runs(id) ON DELETE CASCADE,
+    stage_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    deps TEXT NOT NULL,
+    status TEXT NOT NULL,
+    output TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    started_at REAL,
+    finished_at REAL,
+    duration REAL,
+    PRIMARY KEY (run_id, stage_id)
+);
+"""
+
+class Stage:
+    """流水线阶段：func(context) 返回可JSON序列化的产出"""
+
+    def __init__(self, stage_id: str, func: Callable[["StageContext"], Awaitable[Dict[str, Any]]],
+                 deps: Optional[List[str]] = None, kind: Optional[str] = None):
+        self.id = stage_id
+        self.func = func
+        self.deps = deps or []
+        self.kind = kind or stage_id.split(":", 1)[0]
+
+class StageContext:
+    """阶段执行上下文：流水线参数、已完成阶段的产出、本阶段上次保存的部分产出"""
+
+    def __init__(self, run: Dict[str, Any], stage: Stage, outputs: Dict[str, Any],
+                 previous: Optional[Dict[str, Any]], store: "PipelineStore", slot: asyncio.Semaphore):
+        self.run_id = run["id"]
+        self.project_id = run["project_id"]
+        self.params = run["params"]
+        self.stage_id = stage.id
+        self.outputs = outputs
+        self.previous = previous
+        self._store = store
+        self._slot = slot
+        self._holding = False
+
+    async def _acquire_slot(self):
+        await self._slot.acquire()
+        self._holding = True
+
+    def _release_slot(self):
+        if self._holding:
+            self._holding = False
+            self._slot.release()
+
+    @asynccontextmanager
+    async def yield_slot(self):
+        """等待外部任务（如远程视频渲染）期间让出阶段并发槽位，结束后重新获取"""
+        self._release_slot()
+        try:
+            yield
+        finally:
+            await self._acquire_slot()
+
+    async def checkpoint(self, output: Dict[str, Any]):
+        """保存部分产出：阶段失败后重新执行时通过 previous 取回，已完成的部分不再重做"""
+        self.previous = output
+        await self._store.save_output(self.run_id, self.stage_id, output)
+
+class PipelineStore:
+    """流水线与阶段检查点（与项目数据共用SQLite文件）"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._db = None
+        self._db_lock = threading.Lock()
+
+    def _conn(self):
+        if self._db is None:
+            self._db = connect_sqlite(self.path)
+            self._db.row_factory = _dict_factory
+            self._db.execute("PRAGMA foreign_keys=ON")
+            self._db.executescript(_SCHEMA)
+            self._db.commit()
+        return self._db
+
+    def _run(self, func, *args):
+        with self._db_lock:
+            conn = self._conn()
+            try:
+                result = func(conn, *args)
+                conn.commit()
+                return result
+            except Exception:
+                conn.rollback()
+                raise
+
+    async def _call(self, func, *args):
+        return await asyncio.to_thread(self._run, func, *args)
+
+    async def create_run(self, params: Dict[str, Any], project_id: Optional[str] = None) -> Dict[str, Any]:
+        def insert(conn):
+            now = time.time()
+            run_id = uuid.uuid4().hex
+            conn.execute(
+                "INSERT INTO pipeline_runs (id, project_id, params, status, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (run_id, project_id, json.dumps(params, ensure_ascii=False), PENDING, now, now)
+            )
+            return _get_run(conn, run_id)
+        return await self._call(insert)
+
+    async def get_run(self, run_id: str) -> Dict[str, Any]:
+        return await self._call(_get_run, run_id)
+
+    async def list_runs(self, limit: int = 50, offset: int = 0) -> List[Dict[str, Any]]:
+        def select(conn):
+            rows = conn.execute(
+                "SELECT * FROM pipeline_runs ORDER BY updated_at DESC LIMIT ? OFFSET ?", (limit, offset)
+            ).fetchall()
+            return [_decode(row, "params") for row in rows]
+        return await self._call(select)
+
+    async def set_run_status(self, run_id: str, status: str, error: Optional[str] = None):
+        def update(conn):
+            conn.execute(
+                "UPDATE pipeline_runs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                (status, error, time.time(), run_id)
+            )
+        await self._call(update)
+
+    async def sync_stages(self, run_id: str, stages: List[Stage]) -> Dict[str, Dict[str, Any]]:
+        """登记阶段（已有记录保留检查点），未完成的阶段重置为待执行，返回 {stage_id: 记录}"""
+        def sync(conn):
+            for seq, stage in enumerate(stages):
+                conn.execute(
+                    "INSERT INTO pipeline_stages (run_id, stage_id, seq, kind, deps, status) VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (run_id, stage_id) DO UPDATE SET seq = excluded.seq, deps = excluded.deps",
+                    (run_id, stage.id, seq, stage.kind, json.dumps(stage.deps), PENDING)
+                )
+            conn.execute(
+                "UPDATE pipeline_stages SET status = ?, error = NULL WHERE run_id = ? AND status != ?",
+                (PENDING, run_id, COMPLETED)
+            )
+            return {row["stage_id"]: row for row in _select_stages(conn, run_id)}
+        return await self._call(sync)
+
+    async def list_stages(self, run_id: str) -> List[Dict[str, Any]]:
+        return await self._call(_select_stages, run_id)
+
+    async def start_stage(self, run_id: str, stage_id: str, started_at: float):
+        def update(conn):
+            conn.execute(
+                "UPDATE pipeline_stages SET status = ?, error = NULL, attempts = attempts + 1, started_at = ?, "
+                "finished_at = NULL, duration = NULL WHERE run_id = ? AND stage_id = ?",
+                (RUNNING, started_at, run_id, stage_id)
+            )
+        await self._call(update)
+
+    async def save_output(self, run_id: str, stage_id: str, output: Dict[str, Any]):
+        def update(conn):
+            conn.execute(
+                "UPDATE pipeline_stages SET output = ? WHERE run_id = ? AND stage_id = ?",
+                (json.dumps(output, ensure_ascii=False), run_id, stage_id)
+            )
+        await self._call(update)
+
+    async def finish_stage(self, run_id: str, stage_id: str, status: str, started_at: Optional[float] = None,
+                           output: Optional[Dict[str, Any]] = None, error: Optional[str] = None):
+        """结束阶段；output 为空时保留已保存的部分产出"""
+        def update(conn):
+            now = time.time()
+            duration = round(now - started_at, 3) if started_at else None
+            conn.execute(
+                "UPDATE pipeline_stages SET status = ?, error = ?, finished_at = ?, duration = ?, "
+                "output = COALESCE(?, output) WHERE run_id = ? AND stage_id = ?",
+                (status, error, now if started_at else None, duration,
+                 json.dumps(output, ensure_ascii=False) if output is not None else None, run_id, stage_id)
+            )
+            conn.execute("UPDATE pipeline_runs SET updated_at = ? WHERE id = ?", (now, run_id))
+        await self._call(update)
+
+    async def mark_interrupted(self) -> int:
+        """启动时调用：上次进程退出（崩溃/重启）时仍在执行的流水线和阶段记为失败，返回受影响的流水线数"""
+        def update(conn):
+            now = time.time()
+            conn.execute(
+                "UPDATE pipeline_stages SET status = ?, error = ?, finished_at = ? WHERE status = ?",
+                (FAILED, "已中断", now, RUNNING)
+            )
+            cursor = conn.execute(
+                "UPDATE pipeline_runs SET status = ?, error = ?, updated_at = ? WHERE status IN (?, ?)",
+                (FAILED, "服务重启，流水线已中断", now, RUNNING, PENDING)
+            )
+            return cursor.rowcount
+        return await self._call(update)
+
+    async def count_runs(self) -> Dict[str, int]:
+        def count(conn):
+            rows = conn.execute("SELECT status, COUNT(*) AS n FROM pipeline_runs GROUP BY status").fetchall()
+            return {row["status"]: row["n"] for row in rows}
+        return await self._call(count)
+
+class PipelineEngine:
+    """按依赖关系调度阶段；同一流水线在进程内同时只执行一次"""
+
+    def __init__(self, store: Optional[PipelineStore] = None):
+        self.store = store or PipelineStore()
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._stats = {"runs_started": 0, "stages_run": 0, "stages_skipped": 0, "stages_failed": 0}
+
+    def is_active(self, run_id: str) -> bool:
+        task = self._tasks.get(run_id)
+        return task is not None and not task.done()
+
+    def start(self, run: Dict[str, Any], stages: List[Stage]) -> asyncio.Task:
+        """在后台执行流水线（已在执行中时抛出异常）"""
+        if self.is_active(run["id"]):
+            raise RuntimeError("流水线正在执行中")
+        _check_graph(stages)
+        task = asyncio.create_task(self._execute(run, stages))
+        self._tasks[run["id"]] = task
+        task.add_done_callback(lambda _: self._tasks.pop(run["id"], None))
+        self._stats["runs_started"] += 1
+        return task
+
+    async def _execute(self, run: Dict[str, Any], stages: List[Stage]):
+        run_id = run["id"]
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(settings.pipeline_stage_concurrency)
+        running: Dict[asyncio.Task, Stage] = {}
+        try:
+            records = await self.store.sync_stages(run_id, stages)
+            await self.store.set_run_status(run_id, RUNNING)
+            outputs = {
+                stage_id: json.loads(record["output"]) if record["output"] else None
+                for stage_id, record in records.items()
+            }
+            status = {stage.id: records[stage.id]["status"] for stage in stages}
+            self._stats["stages_skipped"] += sum(1 for value in status.values() if value == COMPLETED)
+            pending = [stage for stage in stages if status[stage.id] != COMPLETED]
+
+            while pending or running:
+                for stage in list(pending):
+                    dep_status = [status[dep] for dep in stage.deps]
+                    if any(value in (FAILED, BLOCKED) for value in dep_status):
+                        pending.remove(stage)
+                        status[stage.id] = BLOCKED
+                        await self.store.finish_stage(run_id, stage.id, BLOCKED, error="依赖的阶段失败")
+                    elif all(value == COMPLETED for value in dep_status):
+                        pending.remove(stage)
+                        status[stage.id] = RUNNING
+                        task = asyncio.create_task(self._run_stage(run, stage, outputs))
+                        running[task] = stage
+                if not running:
+                    break
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    stage = running.pop(task)
+                    status[stage.id] = COMPLETED if task.result() else FAILED
+
+            failed = [stage_id for stage_id, value in status.items() if value == FAILED]
+            if failed:
+                await self.store.set_run_status(run_id, FAILED, error=f"阶段执行失败: {', '.join(failed)}")
+            else:
+                await self.store.set_run_status(run_id, COMPLETED)
+            print(f"[INFO] Pipeline {run_id} finished: {'failed ' + ','.join(failed) if failed else 'completed'}")
+        except asyncio.CancelledError:
+            for task in list(running):
+                task.cancel()
+            # 等待执行中的阶段记录取消状态
+            await asyncio.gather(*running, return_exceptions=True)
+            await asyncio.shield(self.store.set_run_status(run_id, FAILED, error="流水线已取消"))
+            raise
+        except Exception as e:
+            print(f"[ERROR] Pipeline {run_id} aborted: {str(e)}")
+            await self.store.set_run_status(run_id, FAILED, error=str(e))
+
+    async def _run_stage(self, run: Dict[str, Any], stage: Stage, outputs: Dict[str, Any]) -> bool:
+        """执行单个阶段并写入检查点，返回是否成功"""
+        context = StageContext(run, stage, outputs, outputs.get(stage.id), self.store, self._semaphore)
+        await context._acquire_slot()
+        try:
+            started_at = time.time()
+            await self.store.start_stage(run["id"], stage.id, started_at)
+            self._stats["stages_run"] += 1
+            try:
+                output = await stage.func(context)
+            except asyncio.CancelledError:
+                await asyncio.shield(self.store.finish_stage(run["id"], stage.id, FAILED, started_at, error="已取消"))
+                raise
+            except Exception as e:
+                # 路由函数抛出的 HTTPException 只有 detail 有意义
+                error = getattr(e, "detail", None) or str(e) or type(e).__name__
+                self._stats["stages_failed"] += 1
+                print(f"[WARN] Pipeline stage {stage.id} failed: {error}")
+                await self.store.finish_stage(run["id"], stage.id, FAILED, started_at, error=str(error))
+                return False
+            outputs[stage.id] = output
+            await self.store.finish_stage(run["id"], stage.id, COMPLETED, started_at, output=output)
+            return True
+        finally:
+            # 阶段可能在让出槽位期间被取消，此时不持有槽位
+            context._release_slot()
+
+    async def recover(self):
+        """启动时把上次进程遗留的"执行中"流水线记为失败（可通过 resume 继续）"""
+        interrupted = await self.store.mark_interrupted()
+        if interrupted:
+            print(f"[WARN] Marked {interrupted} interrupted pipeline run(s) as failed")
+
+    async def describe(self, run_id: str) -> Dict[str, Any]:
+        """流水线状态：每个阶段的状态、耗时、产出，以及总耗时与各阶段耗时之和"""
+        run = await self.store.get_run(run_id)
+        stages = await self.store.list_stages(run_id)
+        started = [stage["started_at"] for stage in stages if stage["started_at"]]
+        finished = [stage["finished_at"] for stage in stages if stage["finished_at"]]
+        for stage in stages:
+            stage["deps"] = json.loads(stage["deps"])
+            stage["output"] = json.loads(stage["output"]) if stage["output"] else None
+            stage.pop("run_id", None)
+            stage.pop("seq", None)
+        counts: Dict[str, int] = {}
+        for stage in stages:
+            counts[stage["status"]] = counts.get(stage["status"], 0) + 1
+        return {
+            **run,
+            "active": self.is_active(run_id),
+            "stage_counts": counts,
+            "timing": {
+                "wall_seconds": round(max(finished) - min(started), 3) if started and finished else None,
+                "stage_seconds": round(sum(stage["duration"] or 0 for stage in stages), 3)
+            },
+            "stages": stages
+        }
+
+    async def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "active_runs": sum(1 for task in self._tasks.values() if not task.done()),
+            "runs": await self.store.count_runs()
+        }
+
+    async def aclose(self):
+        """停止执行中的流水线（状态记为失败，之后可以 resume 继续）"""
+        tasks = [task for task in self._tasks.values() if not task.done()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+def _check_graph(stages: List[Stage]):
+    """检查阶段ID唯一、依赖存在且无环"""
+    ids = {stage.id for stage in stages}
+    if len(ids) != len(stages):
+        raise ValueError("阶段ID重复")
+    deps = {stage.id: stage.deps for stage in stages}
+    for stage in stages:
+        missing = [dep for dep in stage.deps if dep not in ids]
+        if missing:
+            raise ValueError(f"阶段 {stage.id} 依赖不存在的阶段: {', '.join(missing)}")
+    visiting, visited = set(), set()
+
+    def visit(stage_id: str):
+        if stage_id in visited:
+            return
+        if stage_id in visiting:
+            raise ValueError(f"阶段依赖存在环: {stage_id}")
+        visiting.add(stage_id)
+        for dep in deps[stage_id]:
+            visit(dep)
+        visiting.discard(stage_id)
+        visited.add(stage_id)
+
+    for stage in stages:
+        visit(stage.id)
+
+def _dict_factory(cursor, row) -> Dict[str, Any]:
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+def _decode(row: Dict[str, Any], field: str) -> Dict[str, Any]:
+    row[field] = json.loads(row[field])
+    return row
+
+def _get_run(conn, run_id: str) -> Dict[str, Any]:
+    row = conn.execute("SELECT * FROM pipeline_runs WHERE id = ?", (run_id,)).fetchone()
+    if row is None:
+        raise NotFoundError("流水线不存在")
+    return _decode(row, "params")
+
+def _select_stages(conn, run_id: str) -> List[Dict[str, Any]]:
+    return conn.execute("SELECT * FROM pipeline_stages WHERE run_id = ? ORDER BY seq", (run_id,)).fetchall()
+
+# 全局实例
+pipeline_engine = PipelineEngine()
@@ -0,0 +1,448 @@
+"""
+Project Store - 项目持久化
+项目、章节、角色、剧本、分镜保存在SQLite（WAL模式）中，接口可以传ID代替完整文本；
+剧本和分镜按来源内容哈希保存，来源未变时直接复用，不再重复调用模型
+"""
+import asyncio
+import hashlib
+import json
+import threading
+import time
+import uuid
+from typing import Dict, Any, List, Optional
+from utils.database import connect_sqlite
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS projects (
+    id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    description TEXT,
+    genre TEXT,
+    style TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_projects_updated ON projects (updated_at);
+
+CREATE TABLE IF NOT EXISTS chapters (
+    id TEXT PRIMARY KEY,
+    project_id TEXT NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    title TEXT,
+    content TEXT NOT NULL,
+    content_sha256 TEXT NOT NULL,
+    char_count INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_chapters_project ON chapters (project_id, position);
+
+CREATE TABLE IF NOT EXISTS characters (
+    id TEXT PRIMARY KEY,
+    project_id TEXT NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    data TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_characters_project ON characters (project_id, name);
+
+CREATE TABLE IF NOT EXISTS scripts (
+    id TEXT PRIMARY KEY,
+    project_id TEXT REFERENCES projects(id) ON DELETE CASCADE,
+    chapter_id TEXT REFERENCES chapters(id) ON DELETE CASCADE,
+    format TEXT NOT NULL,
+    params_sha256 TEXT NOT NULL,
+    source_sha256 TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_scripts_project ON scripts (project_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_scripts_source ON scripts (source_sha256, params_sha256);
+
+CREATE TABLE IF NOT EXISTS storyboards (
+    id TEXT PRIMARY KEY,
+    project_id TEXT REFERENCES projects(id) ON DELETE CASCADE,
+    script_id TEXT REFERENCES scripts(id) ON DELETE CASCADE,
+    params_sha256 TEXT NOT NULL,
+    source_sha256 TEXT NOT NULL,
+    data TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_storyboards_project ON storyboards (project_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_storyboards_source ON storyboards (source_sha256, params_sha256);
+"""
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def _params_sha256(params: Dict[str, Any]) -> str:
+    return _sha256(json.dumps(params, sort_keys=True, ensure_ascii=False, default=str))
+
+def _new_id() -> str:
+    return uuid.uuid4().hex
+
+class NotFoundError(Exception):
+    """项目或其下的记录不存在"""
+
+class ProjectStore:
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._stats = {"artifact_hits": 0, "artifact_misses": 0, "resolved_texts": 0, "resolved_chars": 0}
+
+    # ---- 连接（所有数据库操作在线程池中执行，避免阻塞事件循环） ----
+
+    def _conn(self):
+        if self._db is None:
+            self._db = connect_sqlite(self.path)
+            self._db.row_factory = _dict_factory
+            self._db.execute("PRAGMA foreign_keys=ON")
+            self._db.executescript(_SCHEMA)
+            self._db.commit()
+        return self._db
+
+    def _run(self, func, *args):
+        with self._db_lock:
+            conn = self._conn()
+            try:
+                result = func(conn, *args)
+                conn.commit()
+                return result
+            except Exception:
+                conn.rollback()
+                raise
+
+    async def _call(self, func, *args):
+        return await asyncio.to_thread(self._run, func, *args)
+
+    # ---- 项目 ----
+
+    async def create_project(self, title: str, description: Optional[str] = None,
+                             genre: Optional[str] = None, style: Optional[str] = None) -> Dict[str, Any]:
+        def insert(conn):
+            now = time.time()
+            project_id = _new_id()
+            conn.execute(
+                "INSERT INTO projects (id, title, description, genre, style, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (project_id, title, description, genre, style, now, now)
+            )
+            return _get_project(conn, project_id)
+        return await self._call(insert)
+
+    async def list_projects(self, limit: int = 50, offset: int = 0) -> List[Dict[str, Any]]:
+        def select(conn):
+            return conn.execute(
+                "SELECT p.*, (SELECT COUNT(*) FROM chapters c WHERE c.project_id = p.id) AS chapter_count "
+                "FROM projects p ORDER BY p.updated_at DESC LIMIT ? OFFSET ?",
+                (limit, offset)
+            ).fetchall()
+        return await self._call(select)
+
+    async def get_project(self, project_id: str) -> Dict[str, Any]:
+        """项目详情：章节列表（不含正文）、角色、剧本/分镜数量"""
+        def select(conn):
+            project = _get_project(conn, project_id)
+            project["chapters"] = conn.execute(
+                "SELECT id, position, title, char_count, content_sha256, updated_at "
+                "FROM chapters WHERE project_id = ? ORDER BY position",
+                (project_id,)
+            ).fetchall()
+            project["characters"] = [_decode(row, "data") for row in conn.execute(
+                "SELECT * FROM characters WHERE project_id = ? ORDER BY name", (project_id,)
+            ).fetchall()]
+            for table in ("scripts", "storyboards"):
+                project[f"{table[:-1]}_count"] = conn.execute(
+                    f"SELECT COUNT(*) AS n FROM {table} WHERE project_id = ?", (project_id,)
+                ).fetchone()["n"]
+            return project
+        return await self._call(select)
+
+    async def update_project(self, project_id: str, **fields) -> Dict[str, Any]:
+        fields = {k: v for k, v in fields.items() if k in ("title", "description", "genre", "style") and v is not None}
+
+        def update(conn):
+            _get_project(conn, project_id)
+            if fields:
+                assignments = ", ".join(f"{name} = ?" for name in fields)
+                conn.execute(
+                    f"UPDATE projects SET {assignments}, updated_at = ? WHERE id = ?",
+                    (*fields.values(), time.time(), project_id)
+                )
+            return _get_project(conn, project_id)
+        return await self._call(update)
+
+    async def delete_project(self, project_id: str):
+        def delete(conn):
+            _get_project(conn, project_id)
+            conn.execute("DELETE FROM projects WHERE id = ?", (project_id,))
+        await self._call(delete)
+
+    # ---- 章节 ----
+
+    async def add_chapter(self, project_id: str, content: str, title: Optional[str] = None,
+                          position: Optional[int] = None, after_chapter_id: Optional[str] = None) -> Dict[str, Any]:
+        """添加章节：after_chapter_id 不为空时插入到该章之后（后续章节顺延），否则 position 为空时追加到末尾"""
+        def insert(conn):
+            _get_project(conn, project_id)
+            now = time.time()
+            pos = position
+            if after_chapter_id:
+                after = _get_chapter(conn, after_chapter_id)
+                if after["project_id"] != project_id:
+                    raise NotFoundError("章节不属于该项目")
+                pos = after["position"] + 1
+                conn.execute(
+                    "UPDATE chapters SET position = position + 1 WHERE project_id = ? AND position >= ?",
+                    (project_id, pos)
+                )
+            if pos is None:
+                pos = conn.execute(
+                    "SELECT COALESCE(MAX(position), 0) + 1 AS n FROM chapters WHERE project_id = ?", (project_id,)
+                ).fetchone()["n"]
+            chapter_id = _new_id()
+            conn.execute(
+                "INSERT INTO chapters (id, project_id, position, title, content, content_sha256, char_count, "
+                "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (chapter_id, project_id, pos, title, content, _sha256(content), len(content), now, now)
+            )
+            _touch(conn, project_id, now)
+            return _get_chapter(conn, chapter_id)
+        return await self._call(insert)
+
+    async def get_chapter(self, chapter_id: str) -> Dict[str, Any]:
+        return await self._call(_get_chapter, chapter_id)
+
+    async def update_chapter(self, chapter_id: str, content: Optional[str] = None, title: Optional[str] = None,
+                             position: Optional[int] = None) -> Dict[str, Any]:
+        def update(conn):
+            chapter = _get_chapter(conn, chapter_id)
+            now = time.time()
+            new_content = chapter["content"] if content is None else content
+            conn.execute(
+                "UPDATE chapters SET content = ?, content_sha256 = ?, char_count = ?, title = ?, position = ?, "
+                "updated_at = ? WHERE id = ?",
+                (new_content, _sha256(new_content), len(new_content),
+                 chapter["title"] if title is None else title,
+                 chapter["position"] if position is None else position, now, chapter_id)
+            )
+            _touch(conn, chapter["project_id"], now)
+            return _get_chapter(conn, chapter_id)
+        return await self._call(update)
+
+    async def delete_chapter(self, chapter_id: str):
+        def delete(conn):
+            chapter = _get_chapter(conn, chapter_id)
+            conn.execute("DELETE FROM chapters WHERE id = ?", (chapter_id,))
+            _touch(conn, chapter["project_id"], time.time())
+        await self._call(delete)
+
+    async def manuscript(self, project_id: str, until_chapter_id: Optional[str] = None) -> str:
+        """按顺序拼接项目正文（可截止到某一章，含该章）"""
+        def select(conn):
+            _get_project(conn, project_id)
+            limit_position = None
+            if until_chapter_id:
+                chapter = _get_chapter(conn, until_chapter_id)
+                if chapter["project_id"] != project_id:
+                    raise NotFoundError("章节不属于该项目")
+                limit_position = chapter["position"]
+            rows = conn.execute(
+                "SELECT title, content FROM chapters WHERE project_id = ? AND (? IS NULL OR position <= ?) "
+                "ORDER BY position",
+                (project_id, limit_position, limit_position)
+            ).fetchall()
+            return "\n\n".join(
+                (f"{row['title']}\n{row['content']}" if row["title"] else row["content"]) for row in rows
+            )
+        text = await self._call(select)
+        self._record_resolved(text)
+        return text
+
+    async def chapter_versions(self, project_id: str) -> List[Dict[str, Any]]:
+        """章节目录（不含正文），用于按内容哈希判断章节是否变化"""
+        def select(conn):
+            _get_project(conn, project_id)
+            return conn.execute(
+                "SELECT id, position, title, content_sha256, char_count FROM chapters "
+                "WHERE project_id = ? ORDER BY position",
+                (project_id,)
+            ).fetchall()
+        return await self._call(select)
+
+    async def chapter_contents(self, chapter_ids: List[str]) -> Dict[str, str]:
+        """批量读取章节正文：章节ID -> 正文"""
+        if not chapter_ids:
+            return {}
+
+        def select(conn):
+            contents = {}
+            for start in range(0, len(chapter_ids), 500):
+                batch = chapter_ids[start:start + 500]
+                placeholders = ", ".join("?" for _ in batch)
+                for row in conn.execute(
+                    f"SELECT id, content FROM chapters WHERE id IN ({placeholders})", batch
+                ).fetchall():
+                    contents[row["id"]] = row["content"]
+            return contents
+        return await self._call(select)
+
+    async def resolve_text(self, content: Optional[str], chapter_id: Optional[str] = None) -> tuple:
+        """接口传入的正文或章节ID → (正文, 章节记录或None)；两者都为空时抛出 ValueError"""
+        if chapter_id:
+            chapter = await self.get_chapter(chapter_id)
+            self._record_resolved(chapter["content"])
+            return chapter["content"], chapter
+        if content:
+            return content, None
+        raise ValueError("需要提供正文内容或章节ID")
+
+    def _record_resolved(self, text: str):
+        self._stats["resolved_texts"] += 1
+        self._stats["resolved_chars"] += len(text)
+
+    # ---- 角色 ----
+
+    async def save_character(self, project_id: str, name: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        def insert(conn):
+            _get_project(conn, project_id)
+            now = time.time()
+            character_id = _new_id()
+            conn.execute(
+                "INSERT INTO characters (id, project_id, name, data, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (character_id, project_id, name, json.dumps(data, ensure_ascii=False), now, now)
+            )
+            _touch(conn, project_id, now)
+            return _decode(conn.execute("SELECT * FROM characters WHERE id = ?", (character_id,)).fetchone(), "data")
+        return await self._call(insert)
+
+    async def list_characters(self, project_id: str) -> List[Dict[str, Any]]:
+        def select(conn):
+            _get_project(conn, project_id)
+            return [_decode(row, "data") for row in conn.execute(
+                "SELECT * FROM characters WHERE project_id = ? ORDER BY name", (project_id,)
+            ).fetchall()]
+        return await self._call(select)
+
+    async def delete_character(self, project_id: str, character_id: str):
+        def delete(conn):
+            cursor = conn.execute(
+                "DELETE FROM characters WHERE id = ? AND project_id = ?", (character_id, project_id)
+            )
+            if cursor.rowcount == 0:
+                raise NotFoundError("角色不存在")
+        await self._call(delete)
+
+    # ---- 派生产物（剧本、分镜）：按来源内容哈希 + 生成参数复用 ----
+
+    async def find_script(self, project_id: str, source: str, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """同一项目内来源和参数相同的已保存剧本（不跨项目复用，避免产物挂到其他项目下）"""
+        def select(conn):
+            return conn.execute(
+                "SELECT * FROM scripts WHERE project_id = ? AND source_sha256 = ? AND params_sha256 = ? "
+                "ORDER BY created_at DESC LIMIT 1",
+                (project_id, _sha256(source), _params_sha256(params))
+            ).fetchone()
+        return self._count_artifact(await self._call(select))
+
+    async def save_script(self, source: str, params: Dict[str, Any], content: str,
+                          project_id: Optional[str] = None, chapter_id: Optional[str] = None) -> Dict[str, Any]:
+        def insert(conn):
+            script_id = _new_id()
+            conn.execute(
+                "INSERT INTO scripts (id, project_id, chapter_id, format, params_sha256, source_sha256, content, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (script_id, project_id, chapter_id, params.get("format", "standard"),
+                 _params_sha256(params), _sha256(source), content, time.time())
+            )
+            return conn.execute("SELECT * FROM scripts WHERE id = ?", (script_id,)).fetchone()
+        return await self._call(insert)
+
+    async def get_script(self, script_id: str) -> Dict[str, Any]:
+        def select(conn):
+            row = conn.execute("SELECT * FROM scripts WHERE id = ?", (script_id,)).fetchone()
+            if row is None:
+                raise NotFoundError("剧本不存在")
+            return row
+        return await self._call(select)
+
+    async def find_storyboard(self, project_id: str, source: str, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """同一项目内来源和参数相同的已保存分镜"""
+        def select(conn):
+            row = conn.execute(
+                "SELECT * FROM storyboards WHERE project_id = ? AND source_sha256 = ? AND params_sha256 = ? "
+                "ORDER BY created_at DESC LIMIT 1",
+                (project_id, _sha256(source), _params_sha256(params))
+            ).fetchone()
+            return _decode(row, "data") if row else None
+        return self._count_artifact(await self._call(select))
+
+    async def save_storyboard(self, source: str, params: Dict[str, Any], data: List[Dict[str, Any]],
+                              project_id: Optional[str] = None, script_id: Optional[str] = None) -> Dict[str, Any]:
+        def insert(conn):
+            storyboard_id = _new_id()
+            conn.execute(
+                "INSERT INTO storyboards (id, project_id, script_id, params_sha256, source_sha256, data, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (storyboard_id, project_id, script_id, _params_sha256(params), _sha256(source),
+                 json.dumps(data, ensure_ascii=False), time.time())
+            )
+            return _decode(conn.execute("SELECT * FROM storyboards WHERE id = ?", (storyboard_id,)).fetchone(), "data")
+        return await self._call(insert)
+
+    async def list_artifacts(self, project_id: str) -> Dict[str, List[Dict[str, Any]]]:
+        """项目下的剧本与分镜（不含正文）"""
+        def select(conn):
+            _get_project(conn, project_id)
+            return {
+                "scripts": conn.execute(
+                    "SELECT id, chapter_id, format, LENGTH(content) AS char_count, created_at FROM scripts "
+                    "WHERE project_id = ? ORDER BY created_at DESC", (project_id,)
+                ).fetchall(),
+                "storyboards": conn.execute(
+                    "SELECT id, script_id, created_at FROM storyboards WHERE project_id = ? ORDER BY created_at DESC",
+                    (project_id,)
+                ).fetchall()
+            }
+        return await self._call(select)
+
+    def _count_artifact(self, row: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        self._stats["artifact_hits" if row else "artifact_misses"] += 1
+        return row
+
+    async def get_stats(self) -> Dict[str, Any]:
+        def count(conn):
+            return {
+                table: conn.execute(f"SELECT COUNT(*) AS n FROM {table}").fetchone()["n"]
+                for table in ("projects", "chapters", "characters", "scripts", "storyboards")
+            }
+        stats = dict(self._stats)
+        stats.update(await self._call(count))
+        return stats
+
+def _dict_factory(cursor, row) -> Dict[str, Any]:
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+def _decode(row: Dict[str, Any], field: str) -> Dict[str, Any]:
+    row[field] = json.loads(row[field])
+    return row
+
+def _touch(conn, project_id: str, now: float):
+    conn.execute("UPDATE projects SET updated_at = ? WHERE id = ?", (now, project_id))
+
+def _get_project(conn, project_id: str) -> Dict[str, Any]:
+    row = conn.execute("SELECT * FROM projects WHERE id = ?", (project_id,)).fetchone()
+    if row is None:
+        raise NotFoundError("项目不存在")
+    return row
+
+def _get_chapter(conn, chapter_id: str) -> Dict[str, Any]:
+    row = conn.execute("SELECT * FROM chapters WHERE id = ?", (chapter_id,)).fetchone()
+    if row is None:
+        raise NotFoundError("章节不存在")
+    return row
+
+# 全局实例
+project_store = ProjectStore()
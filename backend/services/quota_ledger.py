@@ -0,0 +1,232 @@
+"""
+Quota Ledger - 资源包用量账本
+记录每次上游调用的token、搜索、图片生成用量（按模型和路由），
+对照 utils/config.py 中配置的资源包计算剩余额度，在额度耗尽前改道或拒绝请求
+"""
+import asyncio
+import threading
+import time
+from typing import Dict, Any, List, Optional
+from utils.config import settings
+from utils.database import connect_sqlite
+from utils.request_context import current_route
+
+# 计数型资源包（按次数计），其余资源包按token计
+_COUNT_PACKS = {"search_count", "image_generate_count"}
+
+class QuotaExceededError(Exception):
+    """资源包剩余额度不足"""
+
+class QuotaLedger:
+    """持久化的资源包账本
+
+    - 每次调用写入一行 usage_ledger（SQLite），启动后首次使用时汇总已用量
+    - token型资源包按 total_tokens 扣减，计数型资源包按 units 扣减
+    - 模型与资源包的对应关系见 settings.quota_model_packs（最长前缀匹配）
+    """
+
+    def __init__(self):
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._load_lock = asyncio.Lock()
+        self._loaded = False
+        self._used: Dict[str, int] = {}
+        self._stats = {"records": 0, "rerouted": 0, "refused": 0, "write_errors": 0}
+
+    # ---- 持久层（在线程池中执行，避免阻塞事件循环） ----
+
+    def _conn(self):
+        if self._db is None:
+            self._db = connect_sqlite()
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS usage_ledger (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    created_at REAL NOT NULL,
+                    route TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    pack TEXT,
+                    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+                    completion_tokens INTEGER NOT NULL DEFAULT 0,
+                    total_tokens INTEGER NOT NULL DEFAULT 0,
+                    units INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_usage_ledger_pack ON usage_ledger (pack)")
+            self._db.commit()
+        return self._db
+
+    def _db_totals(self) -> Dict[str, int]:
+        with self._db_lock:
+            rows = self._conn().execute(
+                "SELECT pack, SUM(total_tokens), SUM(units) FROM usage_ledger WHERE pack IS NOT NULL GROUP BY pack"
+            ).fetchall()
+        return {pack: int(units if pack in _COUNT_PACKS else tokens) for pack, tokens, units in rows}
+
+    def _db_insert(self, row: tuple):
+        with self._db_lock:
+            conn = self._conn()
+            conn.execute(
+                "INSERT INTO usage_ledger (created_at, route, model, kind, pack, prompt_tokens, "
+                "completion_tokens, total_tokens, units) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                row
+            )
+            conn.commit()
+
+    def _db_breakdown(self, column: str) -> List[Dict[str, Any]]:
+        with self._db_lock:
+            rows = self._conn().execute(
+                f"SELECT {column}, COUNT(*), SUM(prompt_tokens), SUM(completion_tokens), SUM(total_tokens), SUM(units) "
+                f"FROM usage_ledger GROUP BY {column} ORDER BY SUM(total_tokens) DESC"
+            ).fetchall()
+        return [
+            {
+                column: name,
+                "calls": calls,
+                "prompt_tokens": prompt or 0,
+                "completion_tokens": completion or 0,
+                "total_tokens": total or 0,
+                "units": units or 0
+            }
+            for name, calls, prompt, completion, total, units in rows
+        ]
+
+    async def _ensure_loaded(self):
+        if self._loaded:
+            return
+        async with self._load_lock:
+            if self._loaded:
+                return
+            try:
+                self._used = await asyncio.to_thread(self._db_totals)
+            except Exception as e:
+                print(f"[WARN] Quota ledger load failed: {str(e)}")
+            self._loaded = True
+
+    # ---- 额度查询 ----
+
+    def pack_for_model(self, model: str) -> Optional[str]:
+        """模型对应的token资源包，未配置返回None（不计入资源包）"""
+        model = (model or "").lower()
+        for prefix in sorted(settings.quota_model_packs, key=len, reverse=True):
+            if model.startswith(prefix):
+                return settings.quota_model_packs[prefix]
+        return None
+
+    def remaining(self, pack: str) -> int:
+        return getattr(settings, pack, 0) - self._used.get(pack, 0)
+
+    async def route_model(self, model: str, estimated_tokens: int = 0) -> str:
+        """调用前检查模型对应资源包的剩余额度
+
+        额度不足时按 settings.quota_fallback_models 改用备选模型，没有可用备选则抛出 QuotaExceededError
+        """
+        if not settings.quota_enforce:
+            return model
+        await self._ensure_loaded()
+        tried = []
+        candidate = model
+        while candidate and candidate not in tried:
+            pack = self.pack_for_model(candidate)
+            if pack is None or self.remaining(pack) > estimated_tokens:
+                if candidate != model:
+                    self._stats["rerouted"] += 1
+                    print(f"[INFO] Quota pack for {model} nearly exhausted, routing to {candidate}")
+                return candidate
+            tried.append(candidate)
+            candidate = settings.quota_fallback_models.get(candidate)
+
+        self._stats["refused"] += 1
+        pack = self.pack_for_model(model)
+        raise QuotaExceededError(f"资源包 {pack} 剩余额度不足（剩余{self.remaining(pack)}，预计需要{estimated_tokens}），请求已拒绝")
+
+    async def check_units(self, pack: str, units: int = 1):
+        """计数型资源包（搜索、图片生成）调用前检查"""
+        if not settings.quota_enforce:
+            return
+        await self._ensure_loaded()
+        if self.remaining(pack) < units:
+            self._stats["refused"] += 1
+            raise QuotaExceededError(f"资源包 {pack} 已用完（共{getattr(settings, pack, 0)}次），请求已拒绝")
+
+    # ---- 记账 ----
+
+    async def record(
+        self,
+        model: str,
+        kind: str,
+        usage: Optional[Dict[str, Any]] = None,
+        pack: Optional[str] = None,
+        units: int = 0
+    ):
+        """记录一次上游调用
+
+        usage: 上游响应中的 usage 字段；pack 为空时按模型匹配token资源包
+        """
+        await self._ensure_loaded()
+        usage = usage or {}
+        prompt_tokens = int(usage.get("prompt_tokens") or 0)
+        completion_tokens = int(usage.get("completion_tokens") or 0)
+        total_tokens = int(usage.get("total_tokens") or prompt_tokens + completion_tokens)
+        pack = pack or self.pack_for_model(model)
+        if pack:
+            self._used[pack] = self._used.get(pack, 0) + (units if pack in _COUNT_PACKS else total_tokens)
+        self._stats["records"] += 1
+
+        row = (time.time(), current_route.get(), model, kind, pack, prompt_tokens, completion_tokens, total_tokens, units)
+        try:
+            await asyncio.to_thread(self._db_insert, row)
+        except Exception as e:
+            self._stats["write_errors"] += 1
+            print(f"[WARN] Quota ledger write failed: {str(e)}")
+
+    # ---- 统计 ----
+
+    def pack_summary(self) -> List[Dict[str, Any]]:
+        packs = sorted(set(settings.quota_model_packs.values()) | _COUNT_PACKS)
+        summary = []
+        for pack in packs:
+            total = getattr(settings, pack, 0)
+            used = self._used.get(pack, 0)
+            summary.append({
+                "pack": pack,
+                "unit": "count" if pack in _COUNT_PACKS else "tokens",
+                "total": total,
+                "used": used,
+                "remaining": max(total - used, 0),
+                "used_ratio": round(used / total, 4) if total else 0.0
+            })
+        return summary
+
+    async def get_summary(self) -> Dict[str, Any]:
+        """剩余额度 + 按模型、路由的用量明细"""
+        await self._ensure_loaded()
+        by_model = await asyncio.to_thread(self._db_breakdown, "model")
+        by_route = await asyncio.to_thread(self._db_breakdown, "route")
+        return {
+            "enforce": settings.quota_enforce,
+            "packs": self.pack_summary(),
+            "by_model": by_model,
+            "by_route": by_route
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        stats["packs"] = {p["pack"]: p["remaining"] for p in self.pack_summary()}
+        return stats
+
+def estimate_tokens(messages: List[Dict[str, Any]], max_tokens: int = 0) -> int:
+    """粗略估算一次对话调用的token消耗（中文约1.5字/token）+ 最大输出"""
+    chars = sum(len(m.get("content", "")) if isinstance(m.get("content"), str) else 1000 for m in messages)
+    return int(chars / 1.5) + (max_tokens or 0)
+
+# 全局实例
+quota_ledger = QuotaLedger()
+
+_pending_records = set()
+
+def schedule_record(model: str, kind: str, usage: Optional[Dict[str, Any]] = None, **kwargs):
+    """在后台记账（用于取消/清理路径中不能再等待的场景）"""
+    task = asyncio.get_running_loop().create_task(quota_ledger.record(model, kind, usage, **kwargs))
+    _pending_records.add(task)
+    task.add_done_callback(_pending_records.discard)
@@ -0,0 +1,189 @@
+"""
+Rate Limiter - 按API密钥和模型族的主动限流
+请求发出前先获取并发名额和令牌桶令牌，超出的请求按先来先服务排队，
+而不是等上游返回429后各自sleep重试
+"""
+import asyncio
+import hashlib
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Optional
+from utils.config import settings
+
+def key_label(api_key: str) -> str:
+    """API密钥的脱敏标识，用于日志和统计"""
+    return "key-" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:8]
+
+class RateLimitQueueTimeout(Exception):
+    """排队等待超过上限"""
+
+class _Bucket:
+    """单个（密钥, 模型族）的并发信号量 + 令牌桶"""
+
+    def __init__(self, label: str, family: str, rpm: float, concurrency: int):
+        self.label = label
+        self.family = family
+        self.rpm = rpm
+        self.concurrency = concurrency
+        self.rate = rpm / 60.0 if rpm else 0.0
+        self.capacity = max(1.0, float(min(rpm, concurrency) if concurrency else rpm)) if rpm else 0.0
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self.blocked_until = 0.0
+        self.consecutive_429 = 0
+        self._semaphore = asyncio.Semaphore(concurrency) if concurrency else None
+        self._token_lock = asyncio.Lock()
+        self.waiting = 0
+        self.in_flight = 0
+        self.admitted = 0
+        self.throttled = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _refill(self, now: float):
+        if self.rate:
+            self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    async def _take_token(self):
+        # 锁按获取顺序唤醒，保证令牌按排队顺序发放
+        async with self._token_lock:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self.blocked_until - now
+                if wait <= 0:
+                    if not self.rate or self.tokens >= 1:
+                        if self.rate:
+                            self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                await asyncio.sleep(wait)
+
+    async def acquire(self):
+        if self._semaphore is not None:
+            await self._semaphore.acquire()
+        try:
+            await self._take_token()
+        except BaseException:
+            if self._semaphore is not None:
+                self._semaphore.release()
+            raise
+
+    def release(self):
+        if self._semaphore is not None:
+            self._semaphore.release()
+
+    def penalize(self, retry_after: Optional[float] = None):
+        """上游返回429：暂停该桶的放行并清空令牌，所有排队请求一起等待"""
+        self.consecutive_429 += 1
+        self.throttled += 1
+        if retry_after is None:
+            retry_after = min(2 ** self.consecutive_429, settings.rate_limit_max_backoff)
+        self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+        self.tokens = 0.0
+
+    def reward(self):
+        self.consecutive_429 = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        self._refill(now)
+        return {
+            "key": self.label,
+            "family": self.family,
+            "rpm": self.rpm,
+            "concurrency": self.concurrency,
+            "queue_depth": self.waiting,
+            "in_flight": self.in_flight,
+            "admitted": self.admitted,
+            "throttled_429": self.throttled,
+            "tokens": round(self.tokens, 2),
+            "blocked_for": round(max(self.blocked_until - now, 0.0), 2),
+            "wait_avg_ms": round(self.wait_total / self.admitted * 1000, 2) if self.admitted else 0.0,
+            "wait_max_ms": round(self.wait_max * 1000, 2)
+        }
+
+class RateGovernor:
+    """按（API密钥, 模型族）管理限流桶，限额在 utils/config.py 的 rate_limits 中配置"""
+
+    def __init__(self, limits: Optional[Dict[str, Dict[str, float]]] = None):
+        self.limits = limits or settings.rate_limits
+        # 最长前缀优先匹配，如 glm-4.5-air 优先于 glm-4.5
+        self._families = sorted((f for f in self.limits if f != "default"), key=len, reverse=True)
+        self._buckets: Dict[tuple, _Bucket] = {}
+
+    def family_for(self, model: str) -> str:
+        model = (model or "").lower()
+        for family in self._families:
+            if model.startswith(family):
+                return family
+        return "default"
+
+    def _bucket(self, api_key: str, model: str) -> _Bucket:
+        family = self.family_for(model)
+        label = key_label(api_key)
+        bucket = self._buckets.get((label, family))
+        if bucket is None:
+            limit = self.limits.get(family) or self.limits.get("default", {})
+            bucket = _Bucket(label, family, limit.get("rpm", 0), int(limit.get("concurrency", 0)))
+            self._buckets[(label, family)] = bucket
+        return bucket
+
+    @asynccontextmanager
+    async def slot(self, api_key: str, model: str):
+        """获取一次上游调用的名额，离开上下文时释放并发名额"""
+        bucket = self._bucket(api_key, model)
+        start = time.monotonic()
+        bucket.waiting += 1
+        try:
+            await asyncio.wait_for(bucket.acquire(), timeout=settings.rate_limit_max_queue_wait)
+        except asyncio.TimeoutError:
+            raise RateLimitQueueTimeout(
+                f"请求排队超时（{bucket.family}，已等待{settings.rate_limit_max_queue_wait:.0f}秒），请稍后重试"
+            )
+        finally:
+            bucket.waiting -= 1
+
+        waited = time.monotonic() - start
+        bucket.admitted += 1
+        bucket.wait_total += waited
+        bucket.wait_max = max(bucket.wait_max, waited)
+        bucket.in_flight += 1
+        try:
+            yield bucket
+        finally:
+            bucket.in_flight -= 1
+            bucket.release()
+
+    def penalize(self, api_key: str, model: str, retry_after: Optional[float] = None):
+        bucket = self._bucket(api_key, model)
+        bucket.penalize(retry_after)
+        print(f"[WARN] Rate limit (429) on {bucket.label}/{bucket.family}, pausing admissions")
+
+    def reward(self, api_key: str, model: str):
+        self._bucket(api_key, model).reward()
+
+    def queue_depth(self, api_key: str, model: str) -> int:
+        bucket = self._buckets.get((key_label(api_key), self.family_for(model)))
+        return bucket.waiting + bucket.in_flight if bucket else 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        buckets = [bucket.get_stats() for bucket in self._buckets.values()]
+        return {
+            "buckets": buckets,
+            "queue_depth": sum(b["queue_depth"] for b in buckets),
+            "in_flight": sum(b["in_flight"] for b in buckets),
+            "throttled_429": sum(b["throttled_429"] for b in buckets)
+        }
+
+def retry_after_seconds(response) -> Optional[float]:
+    """解析429响应中的 Retry-After 头"""
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+# 全局实例
+rate_governor = RateGovernor()
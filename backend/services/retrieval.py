@@ -0,0 +1,266 @@
+"""
+Retrieval - 前文片段检索（本地、离线）
+每个项目维护一个内存倒排索引：章节切分为短片段，中文按相邻两字（bigram）、英文数字按单词建词项，
+用BM25打分；续写时以最近内容为查询，取回相关的较早片段（再次出场的人物、未解决的线索），按字数预算拼接。
+索引与项目章节按内容哈希增量同步：新增/修改的章节重新切分入索引，删除的章节标记删除，删除过多时整体压缩
+"""
+import asyncio
+import math
+import re
+import time
+from array import array
+from typing import Dict, Any, List, Optional, Tuple
+from utils.config import settings
+from services.project_store import ProjectStore, project_store as default_project_store
+from services.summarizer import split_chunks
+
+_CJK_RE = re.compile(r"[㐀-鿿豈-﫿]+")
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+_K1 = 1.2
+_B = 0.75
+
+def tokenize(text: str) -> List[str]:
+    """中文连续片段取相邻两字（单字片段取单字），英文数字取小写单词"""
+    terms: List[str] = []
+    for run in _CJK_RE.findall(text):
+        if len(run) == 1:
+            terms.append(run)
+        else:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    terms.extend(_WORD_RE.findall(text.lower()))
+    return terms
+
+class _Passage:
+    __slots__ = ("chapter_id", "position", "title", "offset", "text", "length")
+
+    def __init__(self, chapter_id: str, position: int, title: Optional[str], offset: int, text: str, length: int):
+        self.chapter_id = chapter_id
+        self.position = position
+        self.title = title
+        self.offset = offset
+        self.text = text
+        self.length = length
+
+class ManuscriptIndex:
+    """BM25倒排索引：词项 -> (片段编号数组, 词频数组)，删除的片段用标记跳过"""
+
+    def __init__(self):
+        self.passages: List[Optional[_Passage]] = []
+        self.postings: Dict[str, Tuple[array, array]] = {}
+        self.chapters: Dict[str, Tuple[tuple, List[int]]] = {}  # 章节ID -> (版本, 片段编号)
+        self.live = 0
+        self.total_length = 0
+        self.deleted = 0
+
+    def add_chapter(self, chapter_id: str, position: int, title: Optional[str], version: tuple, content: str):
+        if chapter_id in self.chapters:
+            self.remove_chapter(chapter_id)
+        ids = []
+        offset = 0
+        for chunk in split_chunks(content, settings.retrieval_passage_chars):
+            terms = tokenize(chunk)
+            doc_id = len(self.passages)
+            self.passages.append(_Passage(chapter_id, position, title, offset, chunk, len(terms)))
+            offset += len(chunk)
+            ids.append(doc_id)
+            if not terms:
+                continue
+            counts: Dict[str, int] = {}
+            for term in terms:
+                counts[term] = counts.get(term, 0) + 1
+            for term, tf in counts.items():
+                posting = self.postings.get(term)
+                if posting is None:
+                    posting = self.postings[term] = (array("I"), array("H"))
+                posting[0].append(doc_id)
+                posting[1].append(min(tf, 65535))
+            self.live += 1
+            self.total_length += len(terms)
+        self.chapters[chapter_id] = (version, ids)
+
+    def remove_chapter(self, chapter_id: str):
+        _, ids = self.chapters.pop(chapter_id)
+        for doc_id in ids:
+            passage = self.passages[doc_id]
+            if passage is not None and passage.length:
+                self.live -= 1
+                self.total_length -= passage.length
+            self.passages[doc_id] = None
+            self.deleted += 1
+
+    def needs_compaction(self) -> bool:
+        return self.deleted > 1000 and self.deleted > len(self.passages) // 4
+
+    def search(self, query: str, limit: int, chapters: Optional[set] = None) -> List[Tuple[float, _Passage]]:
+        """BM25检索；chapters 不为空时只在这些章节中检索。
+        只使用区分度最高（IDF最大）的 retrieval_max_query_terms 个查询词项，高频词项的长倒排表不参与打分
+        """
+        if not self.live:
+            return []
+        n = self.live
+        query_terms = {}
+        for term in tokenize(query):
+            posting = self.postings.get(term)
+            if posting is not None and term not in query_terms:
+                df = len(posting[0])
+                query_terms[term] = math.log(1 + (n - df + 0.5) / (df + 0.5))
+        if not query_terms:
+            return []
+        selected = sorted(query_terms.items(), key=lambda item: item[1], reverse=True)[:settings.retrieval_max_query_terms]
+
+        avgdl = self.total_length / n
+        passages = self.passages
+        scores: Dict[int, float] = {}
+        norms: Dict[int, float] = {}
+        for term, idf in selected:
+            doc_ids, tfs = self.postings[term]
+            for doc_id, tf in zip(doc_ids, tfs):
+                norm = norms.get(doc_id)
+                if norm is None:
+                    passage = passages[doc_id]
+                    if passage is None or (chapters is not None and passage.chapter_id not in chapters):
+                        norm = norms[doc_id] = -1.0
+                    else:
+                        norm = norms[doc_id] = _K1 * (1 - _B + _B * passage.length / avgdl)
+                if norm < 0:
+                    continue
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (_K1 + 1) / (tf + norm)
+
+        top = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return [(score, passages[doc_id]) for doc_id, score in top]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "chapters": len(self.chapters),
+            "passages": self.live,
+            "terms": len(self.postings),
+            "deleted": self.deleted
+        }
+
+def _searchable_chapters(versions: List[Dict[str, Any]], until_chapter_id: Optional[str], recent_chars: int) -> set:
+    """可检索的章节：截止章节之前、且不在末尾原文范围内的章节"""
+    if until_chapter_id:
+        ids = [chapter["id"] for chapter in versions]
+        if until_chapter_id in ids:
+            versions = versions[:ids.index(until_chapter_id) + 1]
+    remaining = recent_chars
+    end = len(versions)
+    while end > 0 and remaining > 0:
+        end -= 1
+        remaining -= versions[end]["char_count"]
+    return {chapter["id"] for chapter in versions[:end]}
+
+class RetrievalService:
+    def __init__(self, store: Optional[ProjectStore] = None):
+        self.store = store or default_project_store
+        self._indexes: Dict[str, ManuscriptIndex] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._stats = {
+            "queries": 0,
+            "query_ms_total": 0.0,
+            "query_ms_max": 0.0,
+            "chapters_indexed": 0,
+            "chapters_removed": 0,
+            "index_ms_total": 0.0,
+            "compactions": 0
+        }
+
+    async def _sync(self, project_id: str) -> Tuple[ManuscriptIndex, List[Dict[str, Any]]]:
+        """按章节版本（内容哈希、序号、标题）增量同步索引：新增/修改的章节重新入索引，删除的章节移出"""
+        index = self._indexes.get(project_id)
+        versions = await self.store.chapter_versions(project_id)
+        if index is None or index.needs_compaction():
+            if index is not None:
+                self._stats["compactions"] += 1
+            index = ManuscriptIndex()
+        current = {
+            chapter["id"]: (chapter["content_sha256"], chapter["position"], chapter["title"]) for chapter in versions
+        }
+
+        removed = [cid for cid in index.chapters if cid not in current]
+        changed = [
+            chapter for chapter in versions
+            if chapter["id"] not in index.chapters or index.chapters[chapter["id"]][0] != current[chapter["id"]]
+        ]
+        if removed or changed:
+            started = time.perf_counter()
+            contents = await self.store.chapter_contents([chapter["id"] for chapter in changed])
+
+            def update():
+                for chapter_id in removed:
+                    index.remove_chapter(chapter_id)
+                for chapter in changed:
+                    if chapter["id"] in contents:
+                        index.add_chapter(chapter["id"], chapter["position"], chapter["title"],
+                                          current[chapter["id"]], contents[chapter["id"]])
+
+            # 大篇幅首次建索引耗时较长，放到线程中执行（同一项目的同步由锁串行化）
+            await asyncio.to_thread(update)
+            self._stats["chapters_indexed"] += len(changed)
+            self._stats["chapters_removed"] += len(removed)
+            self._stats["index_ms_total"] += (time.perf_counter() - started) * 1000
+        self._indexes[project_id] = index
+        return index, versions
+
+    async def related_passages(
+        self,
+        project_id: str,
+        query: str,
+        until_chapter_id: Optional[str] = None,
+        recent_chars: int = 0,
+        budget_chars: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """检索与 query 相关的前文片段，按得分取到 budget_chars 字为止，再按章节顺序排列
+
+        until_chapter_id: 只检索该章及之前的章节；recent_chars: 末尾这么多字所在的章节已作为原文放入上下文，不再检索
+        """
+        budget = budget_chars or settings.retrieval_context_chars
+        lock = self._locks.setdefault(project_id, asyncio.Lock())
+        async with lock:
+            index, versions = await self._sync(project_id)
+            chapters = _searchable_chapters(versions, until_chapter_id, recent_chars)
+            started = time.perf_counter()
+            hits = index.search(query, settings.retrieval_top_k, chapters) if chapters else []
+            elapsed = (time.perf_counter() - started) * 1000
+        self._stats["queries"] += 1
+        self._stats["query_ms_total"] += elapsed
+        self._stats["query_ms_max"] = max(self._stats["query_ms_max"], elapsed)
+
+        selected, used = [], 0
+        for score, passage in hits:
+            if used + len(passage.text) > budget:
+                continue
+            selected.append((score, passage))
+            used += len(passage.text)
+        selected.sort(key=lambda item: (item[1].position, item[1].offset))
+        return [{
+            "chapter_id": passage.chapter_id,
+            "chapter_title": passage.title,
+            "position": passage.position,
+            "score": round(score, 3),
+            "text": passage.text.strip()
+        } for score, passage in selected]
+
+    def format_passages(self, passages: List[Dict[str, Any]]) -> str:
+        parts = []
+        for passage in passages:
+            heading = passage["chapter_title"] or f"第{passage['position']}部分"
+            parts.append(f"（{heading}）{passage['text']}")
+        return "\n\n".join(parts)
+
+    def drop(self, project_id: str):
+        """释放项目索引（项目删除时调用）"""
+        self._indexes.pop(project_id, None)
+        self._locks.pop(project_id, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        stats["projects"] = len(self._indexes)
+        stats["query_ms_avg"] = round(stats["query_ms_total"] / stats["queries"], 3) if stats["queries"] else 0.0
+        stats["passages"] = sum(index.live for index in self._indexes.values())
+        stats["terms"] = sum(len(index.postings) for index in self._indexes.values())
+        return stats
+
+# 全局实例
+retrieval_service = RetrievalService()
@@ -0,0 +1,120 @@
+"""
+Search Cache - 搜索结果缓存（stale-while-revalidate）
+热点话题、联网搜索、素材搜索的结果按小时级变化，但每次调用都要消耗一次 search_count 和数秒的模型调用。
+缓存键为（接口, 规范化后的查询/分类）；每个接口单独配置新鲜期和过期后可继续使用的时长：
+- 新鲜期内：直接返回缓存
+- 新鲜期后、可用期内：立即返回旧结果，后台异步刷新（同一键同时只刷新一次）
+- 超过可用期或未命中：同步获取（相同的并发未命中合并为一次）
+新鲜期按比例随机缩短，避免同一批缓存同时到期、同时刷新
+"""
+import asyncio
+import random
+import time
+import unicodedata
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+from utils.config import settings
+from services.cache import TieredCache, make_cache_key
+from services.singleflight import upstream_flight
+
+def normalize_query(text: Optional[str]) -> str:
+    """全角转半角、转小写、合并空白"""
+    return " ".join(unicodedata.normalize("NFKC", text or "").lower().split())
+
+class SearchCache:
+    def __init__(self, store: Optional[TieredCache] = None):
+        self.store = store or TieredCache(
+            "search",
+            max_entries=settings.search_cache_max_entries,
+            max_persistent_entries=settings.completion_cache_max_persistent_entries,
+            persist=settings.completion_cache_persist
+        )
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def policy(self, endpoint: str) -> tuple:
+        """接口的（新鲜期, 过期后可用时长），单位秒"""
+        return (
+            getattr(settings, f"search_cache_{endpoint}_fresh"),
+            getattr(settings, f"search_cache_{endpoint}_stale")
+        )
+
+    def _counter(self, endpoint: str) -> Dict[str, int]:
+        return self._stats.setdefault(endpoint, {
+            "fresh_hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0, "refresh_failures": 0
+        })
+
+    async def _fetch_and_store(self, endpoint: str, key: str, fetch: Callable[[], Awaitable[Any]],
+                               cacheable: Optional[Callable[[Any], bool]]) -> Any:
+        value = await fetch()
+        if cacheable is None or cacheable(value):
+            fresh, stale = self.policy(endpoint)
+            now = time.time()
+            jittered = fresh * (1 - random.uniform(0, settings.search_cache_jitter))
+            await self.store.set(key, {"value": value, "fresh_until": now + jittered, "fetched_at": now}, ttl=fresh + stale)
+        return value
+
+    def _schedule_refresh(self, endpoint: str, key: str, fetch: Callable[[], Awaitable[Any]],
+                          cacheable: Optional[Callable[[Any], bool]]):
+        if key in self._refreshing:
+            return
+        counter = self._counter(endpoint)
+
+        async def refresh():
+            try:
+                await upstream_flight.do(
+                    f"swr:{key}", lambda: self._fetch_and_store(endpoint, key, fetch, cacheable), kind="swr"
+                )
+                counter["refreshes"] += 1
+            except Exception as e:
+                counter["refresh_failures"] += 1
+                print(f"[WARN] Search cache refresh failed ({endpoint}): {str(e)}")
+            finally:
+                self._refreshing.pop(key, None)
+
+        self._refreshing[key] = asyncio.create_task(refresh())
+
+    async def get_or_fetch(
+        self,
+        endpoint: str,
+        parts: Iterable[Any],
+        fetch: Callable[[], Awaitable[Any]],
+        cacheable: Optional[Callable[[Any], bool]] = None
+    ) -> Any:
+        """按（endpoint, parts）读取缓存；fetch 为获取新结果的协程函数，cacheable 判断结果是否写入缓存"""
+        if not settings.search_cache_enabled:
+            return await fetch()
+        key = make_cache_key("search", endpoint, *parts)
+        counter = self._counter(endpoint)
+        entry = await self.store.get(key)
+        if entry is not None:
+            if entry["fresh_until"] > time.time():
+                counter["fresh_hits"] += 1
+            else:
+                counter["stale_hits"] += 1
+                self._schedule_refresh(endpoint, key, fetch, cacheable)
+            return entry["value"]
+
+        counter["misses"] += 1
+        return await upstream_flight.do(
+            f"swr:{key}", lambda: self._fetch_and_store(endpoint, key, fetch, cacheable), kind="swr"
+        )
+
+    def get_stats(self) -> Dict[str, Any]:
+        endpoints = {}
+        for endpoint, counter in self._stats.items():
+            fresh, stale = self.policy(endpoint)
+            lookups = counter["fresh_hits"] + counter["stale_hits"] + counter["misses"]
+            endpoints[endpoint] = {
+                **counter,
+                "hit_rate": round((counter["fresh_hits"] + counter["stale_hits"]) / lookups, 4) if lookups else 0.0,
+                "fresh_seconds": fresh,
+                "stale_seconds": stale
+            }
+        return {
+            "endpoints": endpoints,
+            "refreshing": len(self._refreshing),
+            "store": self.store.get_stats()
+        }
+
+# 全局实例
+search_cache = SearchCache()
@@ -0,0 +1,65 @@
+"""
+Singleflight - 合并相同的进行中上游请求
+相同请求（按请求体哈希）同时到达时只发起一次上游调用，结果分发给所有等待者。
+上游调用在独立任务中运行：某个等待者（包括发起者）断开只会取消它自己的等待，
+所有等待者都离开后才取消上游调用；调用结束即移除，之后的相同请求重新发起（结果复用交给缓存层）
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+class SingleFlight:
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def _counter(self, kind: str) -> Dict[str, int]:
+        return self._stats.setdefault(kind, {"calls": 0, "deduplicated": 0, "waiter_cancelled": 0, "upstream_cancelled": 0})
+
+    def _forget(self, key: str, call: _Call, task: asyncio.Task):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # 所有等待者都已离开时避免 "exception was never retrieved"
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]], kind: str = "default") -> Any:
+        """执行 func()；已有相同 key 的调用在进行中时等待其结果"""
+        counter = self._counter(kind)
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.create_task(func()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda task: self._forget(key, call, task))
+            counter["calls"] += 1
+        else:
+            counter["deduplicated"] += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if not call.task.cancelled():
+                # 等待者自身被取消（如客户端断开），上游调用继续为其他等待者服务
+                counter["waiter_cancelled"] += 1
+                if call.waiters == 1 and not call.task.done():
+                    counter["upstream_cancelled"] += 1
+                    call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._calls),
+            "kinds": {kind: dict(counter) for kind, counter in self._stats.items()},
+            "deduplicated": sum(counter["deduplicated"] for counter in self._stats.values())
+        }
+
+# 全局实例
+upstream_flight = SingleFlight()
@@ -0,0 +1,252 @@
+"""
+SSE - 上游流式响应的统一解码与下游事件流输出
+按字节增量解析 Server-Sent Events（不逐行解码字符串），用 orjson（未安装时回退到 json）解析数据，
+把对话补全的流式分片转换为 StreamEvent：delta（增量文本）、usage（用量）、done（结束及 finish_reason）；
+再由 event_stream 编码为带类型的下游 text/event-stream（另有 heartbeat、error 事件）
+"""
+import asyncio
+import time
+from typing import Dict, Any, List, Optional, AsyncIterator
+from utils.config import settings
+from utils.fast_json import loads as _loads, dumps as _dumps, HAS_ORJSON
+
+_DONE = b"[DONE]"
+
+class SSEStreamError(Exception):
+    """上游在流中返回了错误"""
+
+class StreamEvent:
+    """流式事件：type 为 delta / usage / done，或带 data 的自定义事件（如结构化输出的 field / shot）"""
+
+    __slots__ = ("type", "content", "finish_reason", "usage", "data")
+
+    def __init__(self, type: str, content: str = "", finish_reason: Optional[str] = None,
+                 usage: Optional[Dict[str, Any]] = None, data: Any = None):
+        self.type = type
+        self.content = content
+        self.finish_reason = finish_reason
+        self.usage = usage
+        self.data = data
+
+    def __repr__(self) -> str:
+        return f"StreamEvent({self.type!r}, content={self.content!r}, finish_reason={self.finish_reason!r})"
+
+class SSEDecoder:
+    """增量SSE解码器：feed() 接收任意切分的字节块，返回已完整的事件数据（bytes）
+
+    - 事件以空行结束，多行 data 以换行拼接（按SSE规范）
+    - 以冒号开头的注释行（心跳）计数后忽略
+    """
+
+    __slots__ = ("_buffer", "_data", "keepalives")
+
+    def __init__(self):
+        self._buffer = b""
+        self._data: List[bytes] = []
+        self.keepalives = 0
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        buffer = self._buffer + chunk if self._buffer else chunk
+        lines = buffer.split(b"\n")
+        self._buffer = lines.pop()
+        events = []
+        for line in lines:
+            if line[-1:] == b"\r":
+                line = line[:-1]
+            if not line:
+                if self._data:
+                    events.append(self._data[0] if len(self._data) == 1 else b"\n".join(self._data))
+                    self._data = []
+                continue
+            if line[0] == 58:  # b":" 注释 / 心跳
+                self.keepalives += 1
+                continue
+            field, _, value = line.partition(b":")
+            if field == b"data":
+                self._data.append(value[1:] if value[:1] == b" " else value)
+            # event / id / retry 字段对对话补全流没有意义，忽略
+        return events
+
+    def flush(self) -> List[bytes]:
+        """流结束时取出未以空行结束的最后一个事件"""
+        events = self.feed(b"\n\n") if (self._buffer or self._data) else []
+        self._buffer = b""
+        return events
+
+class _Stats:
+    def __init__(self):
+        self.streams = 0
+        self.events = 0
+        self.deltas = 0
+        self.malformed = 0
+        self.keepalives = 0
+        self.bytes = 0
+        self.errors = 0
+        # 下游事件流
+        self.clients = 0
+        self.completed = 0
+        self.disconnects = 0
+        self.heartbeats = 0
+        # 下游断开后提前取消的上游生成
+        self.cancelled = 0
+        self.tokens_generated_before_cancel = 0
+        self.tokens_saved = 0
+
+    def record_cancel(self, generated: int, saved: int):
+        self.cancelled += 1
+        self.tokens_generated_before_cancel += generated
+        self.tokens_saved += saved
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "json_parser": "orjson" if HAS_ORJSON else "json",
+            "streams": self.streams,
+            "events": self.events,
+            "deltas": self.deltas,
+            "malformed": self.malformed,
+            "keepalives": self.keepalives,
+            "bytes": self.bytes,
+            "errors": self.errors,
+            "clients": self.clients,
+            "completed": self.completed,
+            "disconnects": self.disconnects,
+            "heartbeats": self.heartbeats,
+            "cancelled": self.cancelled,
+            "tokens_generated_before_cancel": self.tokens_generated_before_cancel,
+            "tokens_saved": self.tokens_saved
+        }
+
+# 全局统计
+sse_stats = _Stats()
+
+def parse_chat_chunk(data: bytes) -> List[StreamEvent]:
+    """把一个对话补全分片转换为事件列表；在流中返回错误时抛出 SSEStreamError"""
+    try:
+        chunk = _loads(data)
+    except ValueError:
+        sse_stats.malformed += 1
+        print(f"[WARN] Malformed SSE payload skipped: {data[:200]!r}")
+        return []
+    if not isinstance(chunk, dict):
+        sse_stats.malformed += 1
+        return []
+    if chunk.get("error"):
+        error = chunk["error"]
+        message = error.get("message", error) if isinstance(error, dict) else error
+        raise SSEStreamError(f"上游流式返回错误: {message}")
+
+    events = []
+    for choice in chunk.get("choices") or ():
+        content = (choice.get("delta") or {}).get("content")
+        if content:
+            events.append(StreamEvent("delta", content))
+        if choice.get("finish_reason"):
+            events.append(StreamEvent("done", finish_reason=choice["finish_reason"]))
+    if chunk.get("usage"):
+        events.append(StreamEvent("usage", usage=chunk["usage"]))
+    return events
+
+async def iter_chat_events(byte_stream):
+    """解码对话补全的SSE字节流，产出 StreamEvent
+
+    finish_reason 与 usage 可能分属不同分片，done 事件在 [DONE] 或流结束时统一产出（只产出一次）
+    """
+    decoder = SSEDecoder()
+    finish_reason = None
+    sse_stats.streams += 1
+    try:
+        async for chunk in byte_stream:
+            sse_stats.bytes += len(chunk)
+            for data in decoder.feed(chunk):
+                sse_stats.events += 1
+                if data == _DONE:
+                    yield StreamEvent("done", finish_reason=finish_reason)
+                    return
+                for event in parse_chat_chunk(data):
+                    if event.type == "done":
+                        finish_reason = event.finish_reason
+                        continue
+                    if event.type == "delta":
+                        sse_stats.deltas += 1
+                    yield event
+
+        for data in decoder.flush():
+            if data != _DONE:
+                for event in parse_chat_chunk(data):
+                    if event.type == "done":
+                        finish_reason = event.finish_reason
+                    else:
+                        yield event
+        yield StreamEvent("done", finish_reason=finish_reason)
+    except SSEStreamError:
+        sse_stats.errors += 1
+        raise
+    finally:
+        sse_stats.keepalives += decoder.keepalives
+
+# ---- 下游事件流 ----
+
+# 禁止代理缓冲和缓存，保证事件实时到达
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def encode_event(event: str, data: Any) -> bytes:
+    return b"event: " + event.encode("ascii") + b"\ndata: " + _dumps(data) + b"\n\n"
+
+def encode_stream_event(event: StreamEvent) -> bytes:
+    if event.data is not None:
+        return encode_event(event.type, event.data)
+    if event.type == "delta":
+        return encode_event("delta", {"content": event.content})
+    if event.type == "usage":
+        return encode_event("usage", event.usage)
+    return encode_event(event.type, {"finish_reason": event.finish_reason})
+
+_END = object()
+
+async def event_stream(events: AsyncIterator[StreamEvent], heartbeat_interval: Optional[float] = None):
+    """把 StreamEvent 异步迭代器编码为下游SSE字节流
+
+    - 上游在独立任务中读取，超过 heartbeat_interval 秒没有事件时发送 heartbeat
+    - 上游出错时发送 error 事件后结束
+    - 客户端断开时（Starlette 取消响应或关闭本生成器）立即取消读取任务，从而关闭上游连接、停止生成
+    """
+    interval = heartbeat_interval or settings.sse_heartbeat_interval
+    queue: asyncio.Queue = asyncio.Queue(maxsize=64)
+
+    async def pump():
+        try:
+            async for event in events:
+                await queue.put(event)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await queue.put(e)
+            return
+        await queue.put(_END)
+
+    producer = asyncio.create_task(pump())
+    sse_stats.clients += 1
+    completed = False
+    try:
+        while True:
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout=interval)
+            except asyncio.TimeoutError:
+                sse_stats.heartbeats += 1
+                yield encode_event("heartbeat", {"ts": round(time.time(), 3)})
+                continue
+            if item is _END:
+                completed = True
+                return
+            if isinstance(item, Exception):
+                print(f"[ERROR] Stream failed: {str(item)}")
+                completed = True
+                yield encode_event("error", {"message": str(item)})
+                return
+            yield encode_stream_event(item)
+    finally:
+        if completed:
+            sse_stats.completed += 1
+        else:
+            sse_stats.disconnects += 1
+        producer.cancel()
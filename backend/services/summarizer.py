@@ -0,0 +1,158 @@
+"""
+Summarizer - 长篇前文的分层摘要
+续写时前文按章节/段落切分为稳定的分块，每块只摘要一次（按分块内容哈希缓存），
+摘要再按固定分组逐层合并成摘要树，直到总长度不超过上限；末尾一段保留原文。
+前文追加或修改时只有变化的分块及其所在分组需要重新摘要，提示词长度与前文总长度无关
+"""
+import asyncio
+import hashlib
+import re
+from typing import Dict, Any, List, Optional
+from utils.config import settings
+from services.cache import summary_cache, make_cache_key
+from services.zhipu_service import ZhipuAIService, zhipu_service as default_zhipu_service
+
+# 章节标题：单独成行的短行，以 第X章/节/回/卷 或 Chapter N 开头
+_CHAPTER_RE = re.compile(
+    r"^[ \t　]*(?:第[0-9零〇一二两三四五六七八九十百千]+[章节回卷]|chapter\s+\d+)[^\n]{0,30}$",
+    re.IGNORECASE | re.MULTILINE
+)
+
+_LEAF_PROMPT = """请为以下小说片段写一段不超过{limit}字的情节摘要。
+保留出场人物、关键事件与因果、人物关系变化、时间地点和尚未解决的伏笔，不要评论，只输出摘要。
+
+{text}"""
+
+_MERGE_PROMPT = """以下是一部小说中连续若干部分的情节摘要（按时间顺序），请合并为一段不超过{limit}字的概要。
+保留主线情节、主要人物的状态和关系、尚未解决的冲突与伏笔，只输出概要。
+
+{text}"""
+
+def split_chapters(text: str) -> List[str]:
+    """按章节标题切分（标题归入其后的章节）；没有章节标题时整体作为一章"""
+    starts = [m.start() for m in _CHAPTER_RE.finditer(text)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    return [text[a:b] for a, b in zip(starts, starts[1:] + [len(text)]) if text[a:b].strip()]
+
+def split_chunks(text: str, max_chars: int) -> List[str]:
+    """章节内按段落贪心合并为不超过 max_chars 的分块（超长段落硬切分）
+
+    分块边界只取决于所在章节从开头到该处的内容，前文末尾追加内容时前面的分块保持不变
+    """
+    chunks: List[str] = []
+    for chapter in split_chapters(text):
+        current = ""
+        for paragraph in chapter.splitlines(keepends=True):
+            while len(paragraph) > max_chars:
+                if current:
+                    chunks.append(current)
+                    current = ""
+                chunks.append(paragraph[:max_chars])
+                paragraph = paragraph[max_chars:]
+            if current and len(current) + len(paragraph) > max_chars:
+                chunks.append(current)
+                current = ""
+            current += paragraph
+        if current.strip():
+            chunks.append(current)
+    return chunks
+
+def split_recent(text: str, recent_chars: int) -> tuple:
+    """切出末尾约 recent_chars 字的原文（从段落开头开始），返回（较早部分, 最近部分）"""
+    if len(text) <= recent_chars:
+        return "", text
+    cut = len(text) - recent_chars
+    boundary = text.rfind("\n", 0, cut)
+    if boundary != -1 and cut - boundary <= recent_chars // 2:
+        cut = boundary + 1
+    return text[:cut], text[cut:]
+
+class ManuscriptSummarizer:
+    def __init__(self, service: Optional[ZhipuAIService] = None):
+        self.service = service or default_zhipu_service
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._stats = {
+            "contexts": 0,
+            "chunks": 0,
+            "nodes": 0,
+            "cache_hits": 0,
+            "summarized": 0,
+            "failures": 0,
+            "chars_in": 0,
+            "chars_out": 0
+        }
+
+    async def _summarize(self, text: str, level: int) -> str:
+        """摘要一个节点（level 0 为原文分块，更高层为下层摘要的合并），按内容哈希缓存"""
+        self._stats["nodes"] += 1
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        key = make_cache_key("summary", level, settings.summary_model, digest)
+        cached = await summary_cache.get(key)
+        if cached is not None:
+            self._stats["cache_hits"] += 1
+            return cached
+
+        limit = settings.summary_leaf_chars if level == 0 else settings.summary_merge_chars
+        prompt = (_LEAF_PROMPT if level == 0 else _MERGE_PROMPT).format(limit=limit, text=text)
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(settings.summary_concurrency)
+        async with self._semaphore:
+            response = await self.service.chat_completion(
+                model=settings.summary_model,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=limit * 2,
+                temperature=0.3,
+                thinking={"type": "disabled"}
+            )
+        message = response.get("choices", [{}])[0].get("message", {})
+        summary = (message.get("content", "") or message.get("reasoning_content", "")).strip()
+        if not summary:
+            raise Exception("摘要结果为空")
+
+        self._stats["summarized"] += 1
+        self._stats["chars_in"] += len(text)
+        self._stats["chars_out"] += len(summary)
+        await summary_cache.set(key, summary)
+        return summary
+
+    async def summarize(self, text: str) -> List[str]:
+        """逐层摘要直到总长度不超过 summary_context_chars，返回按时间顺序排列的顶层摘要"""
+        chunks = split_chunks(text, settings.summary_chunk_chars)
+        self._stats["chunks"] += len(chunks)
+        nodes = await asyncio.gather(*(self._summarize(chunk, 0) for chunk in chunks))
+
+        level = 0
+        fanout = max(settings.summary_fanout, 2)
+        while len(nodes) > 1 and sum(len(node) for node in nodes) > settings.summary_context_chars:
+            level += 1
+            groups = ["\n\n".join(nodes[i:i + fanout]) for i in range(0, len(nodes), fanout)]
+            nodes = await asyncio.gather(*(self._summarize(group, level) for group in groups))
+        return list(nodes)
+
+    async def build_context(self, content: str, related: Optional[str] = None) -> str:
+        """续写用的前文：较早部分的分层摘要 +（检索到的相关前文片段）+ 末尾原文"""
+        self._stats["contexts"] += 1
+        earlier, recent = split_recent(content, settings.summary_recent_chars)
+        if not earlier.strip():
+            return content
+        try:
+            summaries = await self.summarize(earlier)
+        except Exception:
+            self._stats["failures"] += 1
+            raise
+        context = "【前文概要】\n" + "\n\n".join(summaries)
+        if related:
+            context += "\n\n【相关前文片段】\n" + related
+        return context + "\n\n【最近内容】\n" + recent
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        stats["model"] = settings.summary_model
+        stats["compression_ratio"] = round(
+            stats["chars_out"] / stats["chars_in"], 4
+        ) if stats["chars_in"] else 0.0
+        return stats
+
+# 全局实例
+manuscript_summarizer = ManuscriptSummarizer()
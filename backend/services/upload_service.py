@@ -0,0 +1,238 @@
+"""
+Upload Service - 流式文件上传
+直接从请求体流中解析 multipart/form-data（python-multipart 推送式解析器），文件字段的数据到达即分块写入
+媒体库的临时文件（aiofiles，不阻塞事件循环），写入时同步计算SHA-256并检查大小上限，超限立即中止并删除临时文件；
+写完后按内容哈希原子移动到媒体库（相同内容只存一份）。不经过 Starlette 的 UploadFile 临时文件，磁盘上只写一份；
+统计上传吞吐量
+"""
+import hashlib
+import os
+import time
+import uuid
+import aiofiles
+import aiofiles.os
+from typing import Dict, Any, List, Optional, AsyncIterator
+from fastapi import Request
+from utils.config import settings
+from services.media_store import MediaStore, media_store as default_media_store
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+class UploadTooLargeError(Exception):
+    """上传文件超过大小上限"""
+
+class UnsupportedFileTypeError(Exception):
+    """不支持的文件格式"""
+
+class InvalidUploadError(Exception):
+    """请求不是 multipart/form-data、缺少文件字段或请求体不完整"""
+
+class MultipartFileStream:
+    """从请求体流中取出 multipart/form-data 的一个文件字段
+
+    open() 读到该字段的头部为止并返回文件名，chunks() 逐块产出文件内容；
+    解析器回调是同步的，解析出的数据先暂存，攒够 chunk_size 后由 chunks() 取走（减少写文件次数）
+    """
+
+    def __init__(self, request: Request, field: str = "file", chunk_size: int = 1024 * 1024):
+        content_type, params = parse_options_header(request.headers.get("content-type", ""))
+        if content_type != b"multipart/form-data" or not params.get(b"boundary"):
+            raise InvalidUploadError("请使用 multipart/form-data 上传文件")
+        self.field = field
+        self.chunk_size = chunk_size
+        self.filename: Optional[str] = None
+        self._request = request
+        self._stream: Optional[AsyncIterator[bytes]] = None
+        self._pending: List[bytes] = []
+        self._pending_size = 0
+        self._headers: Dict[bytes, bytes] = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._in_file = False
+        self._file_done = False
+        self._parser = MultipartParser(params[b"boundary"], {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end
+        })
+
+    # ---- 解析器回调 ----
+
+    def _on_part_begin(self):
+        self._headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        if self.filename is None and options.get(b"name") == self.field.encode() and b"filename" in options:
+            self.filename = options[b"filename"].decode("utf-8", errors="replace")
+            self._in_file = True
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if self._in_file:
+            self._pending.append(bytes(data[start:end]))
+            self._pending_size += end - start
+
+    def _on_part_end(self):
+        if self._in_file:
+            self._in_file = False
+            self._file_done = True
+
+    # ---- 读取 ----
+
+    async def _feed(self) -> bool:
+        """读取一块请求体交给解析器，请求体结束时返回False"""
+        try:
+            chunk = await self._stream.__anext__()
+        except StopAsyncIteration:
+            self._parser.finalize()
+            return False
+        if chunk:
+            self._parser.write(chunk)
+        return True
+
+    async def open(self) -> str:
+        self._stream = self._request.stream().__aiter__()
+        while self.filename is None:
+            if not await self._feed():
+                raise InvalidUploadError(f"缺少文件字段: {self.field}")
+        return self.filename
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        while True:
+            if self._pending and (self._file_done or self._pending_size >= self.chunk_size):
+                data = b"".join(self._pending)
+                self._pending = []
+                self._pending_size = 0
+                yield data
+            if self._file_done:
+                return
+            if not await self._feed() and not self._file_done:
+                raise InvalidUploadError("上传内容不完整")
+
+class UploadService:
+    def __init__(
+        self,
+        upload_dir: Optional[str] = None,
+        chunk_size: Optional[int] = None,
+        media_store: Optional[MediaStore] = None
+    ):
+        self.upload_dir = upload_dir or settings.upload_dir
+        self.media_store = media_store or default_media_store
+        self.chunk_size = chunk_size or settings.upload_chunk_size
+        self._stats = {
+            "uploads": 0,
+            "rejected_too_large": 0,
+            "failed": 0,
+            "bytes": 0,
+            "seconds": 0.0,
+            "max_throughput_mbps": 0.0
+        }
+
+    async def save(
+        self,
+        request: Request,
+        field: str = "file",
+        max_size: Optional[int] = None,
+        allowed_extensions: Optional[List[str]] = None
+    ) -> Dict[str, Any]:
+        """从请求体流中直接保存 multipart 文件字段并存入媒体库（磁盘上只写一份）
+
+        返回 {"filename", "path", "size", "sha256", "original_name", "deduplicated", "elapsed", "throughput_mbps"}，
+        path 为相对 upload_dir 的稳定路径（相同内容得到相同路径）；
+        超过 max_size 抛出 UploadTooLargeError，扩展名不在 allowed_extensions 中抛出 UnsupportedFileTypeError，
+        请求格式错误时抛出 InvalidUploadError
+        """
+        stream = MultipartFileStream(request, field, self.chunk_size)
+        filename = await stream.open()
+        return await self._store(stream.chunks(), filename, max_size, allowed_extensions)
+
+    async def _store(
+        self,
+        chunks: AsyncIterator[bytes],
+        original_name: Optional[str],
+        max_size: Optional[int],
+        allowed_extensions: Optional[List[str]]
+    ) -> Dict[str, Any]:
+        """逐块写入临时文件并计算哈希，完成后移动到媒体库"""
+        max_size = max_size or settings.max_file_size
+        file_extension = os.path.splitext(original_name or "")[1].lower()
+        if allowed_extensions is not None and file_extension not in allowed_extensions:
+            raise UnsupportedFileTypeError(f"不支持的文件格式。支持的格式: {', '.join(allowed_extensions)}")
+
+        directory = os.path.join(self.upload_dir, "tmp")
+        os.makedirs(directory, exist_ok=True)
+        temp_path = os.path.join(directory, f"{uuid.uuid4()}{file_extension}.part")
+
+        hasher = hashlib.sha256()
+        size = 0
+        start = time.monotonic()
+        try:
+            async with aiofiles.open(temp_path, "wb") as buffer:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    if size > max_size:
+                        self._stats["rejected_too_large"] += 1
+                        raise UploadTooLargeError(f"文件大小超过限制（最大{max_size // (1024 * 1024)}MB）")
+                    hasher.update(chunk)
+                    await buffer.write(chunk)
+            meta = await self.media_store.put(temp_path, hasher.hexdigest(), size, file_extension, original_name)
+        except BaseException as e:
+            if not isinstance(e, (UploadTooLargeError, InvalidUploadError)):
+                self._stats["failed"] += 1
+            try:
+                await aiofiles.os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+
+        elapsed = time.monotonic() - start
+        throughput = size / (1024 * 1024) / elapsed if elapsed > 0 else 0.0
+        self._stats["uploads"] += 1
+        self._stats["bytes"] += size
+        self._stats["seconds"] += elapsed
+        self._stats["max_throughput_mbps"] = max(self._stats["max_throughput_mbps"], throughput)
+        filename = os.path.basename(meta["path"])
+        print(f"[INFO] Upload saved: {filename} ({size} bytes, {throughput:.1f} MB/s, deduplicated={meta['deduplicated']})")
+
+        return {
+            "filename": filename,
+            "path": meta["path"],
+            "size": size,
+            "sha256": meta["sha256"],
+            "original_name": original_name,
+            "mime": meta["mime"],
+            "width": meta["width"],
+            "height": meta["height"],
+            "deduplicated": meta["deduplicated"],
+            "elapsed": round(elapsed, 3),
+            "throughput_mbps": round(throughput, 2)
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        stats["avg_throughput_mbps"] = round(
+            stats["bytes"] / (1024 * 1024) / stats["seconds"], 2
+        ) if stats["seconds"] else 0.0
+        stats["seconds"] = round(stats["seconds"], 3)
+        stats["max_throughput_mbps"] = round(stats["max_throughput_mbps"], 2)
+        return stats
+
+# 全局实例
+upload_service = UploadService()
@@ -0,0 +1,221 @@
+"""
+Video Jobs - 异步视频生成任务
+提交任务后立即返回任务ID，由单个后台轮询协程统一查询所有未完成任务的状态，
+查询间隔随任务已运行时间自适应退避，客户端通过查询或订阅获取结果
+"""
+import asyncio
+import time
+import uuid
+from typing import Dict, Any, List, Optional
+from utils.config import settings
+from services.zhipu_service import ZhipuAIService, zhipu_service as default_zhipu_service
+
+# 任务状态
+PROCESSING = "PROCESSING"
+SUCCESS = "SUCCESS"
+FAILED = "FAILED"
+
+class VideoJob:
+    def __init__(self, task_id: str, headers: Dict[str, str], request: Dict[str, Any]):
+        self.id = uuid.uuid4().hex
+        self.task_id = task_id
+        self.headers = headers  # 提交任务的密钥，不对外暴露
+        self.request = request
+        self.status = PROCESSING
+        self.video_url: Optional[str] = None
+        self.cover_image_url: Optional[str] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.polls = 0
+        self.poll_errors = 0
+        self.interval = settings.video_poll_initial_interval
+        self.next_poll_at = time.monotonic() + self.interval
+        self.done = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status != PROCESSING
+
+    def finish(self, status: str, video_url: Optional[str] = None, error: Optional[str] = None):
+        self.status = status
+        self.video_url = video_url
+        self.error = error
+        self.finished_at = time.time()
+        self.done.set()
+
+    def to_dict(self) -> Dict[str, Any]:
+        end = self.finished_at or time.time()
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "video_url": self.video_url,
+            "cover_image_url": self.cover_image_url,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "elapsed": round(end - self.created_at, 1),
+            "polls": self.polls,
+            **self.request
+        }
+
+class VideoJobManager:
+    """视频任务管理：所有任务共享一个后台轮询协程
+
+    - 每轮只查询到期的任务，并发查询数受 video_poll_concurrency 限制
+    - 任务查询间隔从 video_poll_initial_interval 开始按 video_poll_backoff 倍数增长，
+      不超过 video_poll_max_interval；没有未完成任务时轮询协程自动退出
+    - 已完成任务保留 video_job_ttl 秒后清理
+    """
+
+    _BATCH_WINDOW = 1.0  # 即将到期（N秒内）的任务并入本轮一起查询
+
+    def __init__(self, service: Optional[ZhipuAIService] = None):
+        self.service = service or default_zhipu_service
+        self._jobs: Dict[str, VideoJob] = {}
+        self._poller: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stats = {"submitted": 0, "succeeded": 0, "failed": 0, "polls": 0, "poll_errors": 0, "poll_rounds": 0}
+
+    async def submit(
+        self,
+        image_urls: List[str],
+        prompt: str = "让画面动起来",
+        quality: str = "quality",
+        size: str = "1920x1080",
+        fps: int = 30
+    ) -> VideoJob:
+        """提交视频生成任务，返回任务对象（不等待渲染完成）"""
+        task = await self.service.submit_video(
+            image_urls=image_urls,
+            prompt=prompt,
+            quality=quality,
+            size=size,
+            fps=fps
+        )
+        job = VideoJob(task["task_id"], task["headers"], {"prompt": prompt, "size": size, "fps": fps})
+        self._prune()
+        self._jobs[job.id] = job
+        self._stats["submitted"] += 1
+        self._ensure_poller()
+        return job
+
+    def get(self, job_id: str) -> Optional[VideoJob]:
+        return self._jobs.get(job_id)
+
+    def list_jobs(self) -> List[VideoJob]:
+        return sorted(self._jobs.values(), key=lambda job: job.created_at, reverse=True)
+
+    async def wait(self, job_id: str, timeout: Optional[float] = None) -> VideoJob:
+        """等待任务完成（超时后返回当前状态）"""
+        job = self._jobs.get(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        try:
+            await asyncio.wait_for(job.done.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        return job
+
+    # ---- 后台轮询 ----
+
+    def _ensure_poller(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.create_task(self._poll_loop())
+        self._wakeup.set()
+
+    async def _poll_loop(self):
+        semaphore = asyncio.Semaphore(settings.video_poll_concurrency)
+
+        async def check(job: VideoJob):
+            async with semaphore:
+                try:
+                    await self._check(job)
+                except Exception as e:
+                    # 单个任务的异常不能终止轮询协程，否则其他任务的等待方永远等不到结果
+                    print(f"[ERROR] Video job {job.id} check crashed: {str(e)}")
+                    if not job.finished:
+                        self._finish(job, FAILED, error=f"状态检查失败: {str(e)}")
+
+        while True:
+            pending = [job for job in self._jobs.values() if not job.finished]
+            if not pending:
+                return
+            now = time.monotonic()
+            due = [job for job in pending if job.next_poll_at <= now + self._BATCH_WINDOW]
+            if any(job.next_poll_at <= now for job in due):
+                self._stats["poll_rounds"] += 1
+                await asyncio.gather(*(check(job) for job in due))
+                continue
+
+            self._wakeup.clear()
+            delay = min(job.next_poll_at for job in pending) - now
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(delay, 0.05))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _check(self, job: VideoJob):
+        job.polls += 1
+        self._stats["polls"] += 1
+        try:
+            result = await self.service.get_video_result(job.task_id, job.headers)
+        except Exception as e:
+            job.poll_errors += 1
+            self._stats["poll_errors"] += 1
+            print(f"[WARN] Video job {job.id} status check failed: {str(e)}")
+            result = None
+
+        if result is not None:
+            task_status = result.get("task_status")
+            if task_status == SUCCESS:
+                video_result = result.get("video_result") or [{}]
+                if video_result[0].get("url"):
+                    job.cover_image_url = video_result[0].get("cover_image_url")
+                    self._finish(job, SUCCESS, video_url=video_result[0]["url"])
+                    print(f"[SUCCESS] Video: {job.video_url}")
+                else:
+                    self._finish(job, FAILED, error="视频URL未返回")
+                return
+            if task_status in ("FAIL", FAILED):
+                error = result.get("error")
+                error_msg = error.get("message", "Unknown") if isinstance(error, dict) else (error or "Unknown")
+                self._finish(job, FAILED, error=f"生成失败: {error_msg}")
+                return
+
+        if time.time() - job.created_at > settings.video_job_timeout:
+            self._finish(job, FAILED, error=f"超时({settings.video_job_timeout / 60:.0f}分钟)")
+            return
+        job.interval = min(job.interval * settings.video_poll_backoff, settings.video_poll_max_interval)
+        job.next_poll_at = time.monotonic() + job.interval
+
+    def _finish(self, job: VideoJob, status: str, video_url: Optional[str] = None, error: Optional[str] = None):
+        job.finish(status, video_url=video_url, error=error)
+        self._stats["succeeded" if status == SUCCESS else "failed"] += 1
+
+    def _prune(self):
+        cutoff = time.time() - settings.video_job_ttl
+        for job_id in [j.id for j in self._jobs.values() if j.finished and j.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+    async def aclose(self):
+        """停止后台轮询（应用关闭时调用）"""
+        if self._poller is not None and not self._poller.done():
+            self._poller.cancel()
+            try:
+                await self._poller
+            except asyncio.CancelledError:
+                pass
+        self._poller = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        stats["jobs"] = len(self._jobs)
+        stats["pending"] = sum(1 for job in self._jobs.values() if not job.finished)
+        stats["poller_running"] = self._poller is not None and not self._poller.done()
+        return stats
+
+# 全局实例
+video_job_manager = VideoJobManager()
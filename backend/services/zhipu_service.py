@@ -1,34 +1,53 @@
 import httpx
-import json
 import asyncio
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, AsyncIterator, Awaitable, Callable
 from utils.config import settings
+from services.http_client import HTTPClientPool, http_pool as default_http_pool
+from services.cache import completion_cache, analysis_cache, make_cache_key
+from services.key_pool import APIKeyPool, key_pool as default_key_pool, max_key_pool as default_max_key_pool
+from services.quota_ledger import quota_ledger, estimate_tokens, schedule_record
+from services.sse import iter_chat_events, sse_stats
+from services.singleflight import upstream_flight
+from utils.json_extract import extract_json
+from services.image_processor import image_processor
+from utils.media import media_fingerprint, local_media_file, InlineMediaPayload, INLINE_MEDIA
+
+async def run_bounded(calls: List[Callable[[], Awaitable[Any]]], concurrency: int, label: str = "Batch call"):
+    """有界并发执行一组调用，按完成顺序产出 (序号, 结果, 错误信息)
+
+    单个调用失败只记录错误信息，不影响其他调用；
+    客户端断开或调用方提前退出（生成器被关闭）时取消尚未完成的调用
+    """
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+    async def run(index: int, call: Callable[[], Awaitable[Any]]):
+        async with semaphore:
+            try:
+                return index, await call(), None
+            except Exception as e:
+                print(f"[ERROR] {label} {index + 1} failed: {str(e)}")
+                return index, None, str(e)
+
+    tasks = [asyncio.create_task(run(i, call)) for i, call in enumerate(calls)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
 
 class ZhipuAIService:
-    def __init__(self):
-        self.api_keys = [
-            settings.zhipu_api_key,
-            settings.zhipu_api_key_backup
-        ]
-        self.current_key_index = 0
-        self.api_key = self.api_keys[0]
-        self.max_api_key = settings.zhipu_max_api_key
+    def __init__(
+        self,
+        http_pool: Optional[HTTPClientPool] = None,
+        key_pool: Optional[APIKeyPool] = None,
+        max_key_pool: Optional[APIKeyPool] = None
+    ):
+        self.http_pool = http_pool or default_http_pool
+        # 每次请求从密钥池租用密钥，不再在共享实例上切换密钥
+        self.key_pool = key_pool or default_key_pool
+        self.max_key_pool = max_key_pool or default_max_key_pool
         self.base_url = settings.zhipu_base_url
-        self.headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        self.max_headers = {
-            "Authorization": f"Bearer {self.max_api_key}",
-            "Content-Type": "application/json"
-        }
-    
-    def switch_api_key(self):
-        """切换到下一个API密钥"""
-        self.current_key_index = (self.current_key_index + 1) % len(self.api_keys)
-        self.api_key = self.api_keys[self.current_key_index]
-        self.headers["Authorization"] = f"Bearer {self.api_key}"
-        print(f"[INFO] Switched to API key #{self.current_key_index + 1}")
 
     async def chat_completion(
         self,
@@ -39,6 +58,7 @@ class ZhipuAIService:
         use_max_key: bool = False,
         max_retries: int = 3,
         stream: bool = False,
+        cache: bool = False,
         **kwargs
     ) -> Dict[str, Any]:
         """通用聊天对话接口
@@ -46,6 +66,10 @@ class ZhipuAIService:
         密钥使用策略：
         - 普通GLM-4.6密钥：文本生成（小说、角色、剧本、分镜）
         - MAX密钥：图像/视频理解、联网搜索、MCP工具
+
+        缓存策略：temperature为0的非流式请求默认走缓存；非零温度需传 cache=True 显式开启
+        合并策略：相同请求体的非流式请求同时进行时只调用一次上游（见 singleflight）
+        额度策略：模型对应资源包不足时改用备选模型，无备选则拒绝（见 quota_ledger）
         """
         if messages is None:
             messages = []
@@ -59,29 +83,122 @@ class ZhipuAIService:
             **kwargs
         }
 
-        headers = self.max_headers if use_max_key else self.headers
-
-        for attempt in range(max_retries):
-            try:
-                async with httpx.AsyncClient(timeout=180.0) as client:
-                    response = await client.post(
-                        f"{self.base_url}chat/completions",
-                        headers=headers,
-                        json=payload
-                    )
+        pool = self.max_key_pool if use_max_key else self.key_pool
+
+        # 先按请求的模型查缓存：命中不消耗额度，资源包用完时也能返回
+        use_cache = settings.completion_cache_enabled and not stream and (temperature == 0 or cache)
+        cache_key = None
+        if use_cache:
+            cache_key = make_cache_key(payload)
+            cached = await completion_cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        # 未命中时才按额度选择模型；改用备选模型时按备选模型的请求体缓存
+        routed = await quota_ledger.route_model(model, estimate_tokens(messages, max_tokens))
+        if routed != model:
+            model = routed
+            payload["model"] = routed
+            if use_cache:
+                cache_key = make_cache_key(payload)
+                cached = await completion_cache.get(cache_key)
+                if cached is not None:
+                    return cached
+
+        async def call():
+            client = self.http_pool.client
+            for attempt in range(max_retries):
+                try:
+                    async with pool.lease(model) as lease:
+                        response = await client.post(
+                            f"{self.base_url}chat/completions",
+                            headers=lease.headers,
+                            json=payload,
+                            timeout=self.http_pool.timeout("chat")
+                        )
+                        lease.observe(response)
                     response.raise_for_status()
-                    
+
                     if stream:
                         return response  # 返回响应对象用于流式处理
-                    return response.json()
-            except httpx.HTTPStatusError as e:
-                if e.response.status_code == 429:  # Rate limit
-                    if attempt < max_retries - 1:
-                        wait_time = (2 ** attempt) * 5  # 5, 10, 20秒
-                        print(f"⚠️ 速率限制，等待 {wait_time} 秒后重试...")
-                        await asyncio.sleep(wait_time)
-                        continue
-                raise
+                    result = response.json()
+                    await quota_ledger.record(model, "chat", result.get("usage"))
+                    if cache_key and result.get("choices"):
+                        await completion_cache.set(cache_key, result)
+                    return result
+                except httpx.HTTPStatusError as e:
+                    if e.response.status_code == 429:  # Rate limit
+                        # 密钥池已记录429并暂停该密钥的放行，重试时重新租用（优先其他健康密钥）
+                        if attempt < max_retries - 1:
+                            continue
+                    raise
+
+        if stream or not settings.singleflight_enabled:
+            return await call()
+        flight_key = cache_key or make_cache_key(payload)
+        return await upstream_flight.do(f"chat:{use_max_key}:{flight_key}", call, kind="chat")
+
+    async def stream_chat_completion(
+        self,
+        model: str = "glm-4.6",
+        messages: List[Dict[str, str]] = None,
+        temperature: float = 0.7,
+        max_tokens: int = 2000,
+        **kwargs
+    ):
+        """流式对话 - 所有流式生成共用的引擎
+
+        产出 StreamEvent：delta（增量文本）、usage（用量，自动记入额度账本）、done（含 finish_reason）；
+        上游返回错误状态码或在流中返回错误时抛出异常。
+        下游断开（生成器被取消或关闭）时随上下文退出立即关闭上游连接，停止生成，
+        并按剩余的 max_tokens 估算节省的token
+        """
+        messages = messages or []
+        model = await quota_ledger.route_model(model, estimate_tokens(messages, max_tokens))
+        client = self.http_pool.client
+        generated_chars = 0
+        finished = False
+        usage_recorded = False
+        try:
+            async with self.key_pool.lease(model) as lease, client.stream(
+                "POST",
+                f"{self.base_url}chat/completions",
+                headers=lease.headers,
+                timeout=self.http_pool.timeout("stream"),
+                json={
+                    "model": model,
+                    "messages": messages,
+                    "max_tokens": max_tokens,
+                    "temperature": temperature,
+                    "stream": True,
+                    **kwargs
+                }
+            ) as response:
+                lease.observe(response)
+                if response.status_code >= 400:
+                    detail = (await response.aread()).decode("utf-8", errors="replace")
+                    raise Exception(f"流式生成失败（HTTP {response.status_code}）：{detail[:500]}")
+                async for event in iter_chat_events(response.aiter_bytes()):
+                    if event.type == "delta":
+                        generated_chars += len(event.content)
+                    elif event.type == "usage":
+                        usage_recorded = True
+                        await quota_ledger.record(model, "stream", event.usage)
+                    elif event.type == "done":
+                        finished = True
+                    yield event
+        except (asyncio.CancelledError, GeneratorExit):
+            if not finished:
+                generated = int(generated_chars / 1.5)
+                sse_stats.record_cancel(generated, max(max_tokens - generated, 0))
+                print(f"[INFO] Stream cancelled by client after ~{generated} tokens, upstream closed")
+                if not usage_recorded:
+                    # 上游不会再返回usage，按已输出内容估算记账（后台写入，不阻塞取消）
+                    schedule_record(model, "stream_cancelled", {
+                        "prompt_tokens": estimate_tokens(messages),
+                        "completion_tokens": generated
+                    })
+            raise
 
     async def generate_novel_stream(
         self,
@@ -91,7 +208,7 @@ class ZhipuAIService:
         style: str = "modern",
         prompt: Optional[str] = None
     ):
-        """小说生成 - 流式输出"""
+        """小说生成 - 流式输出（StreamEvent）"""
         length_tokens = {
             "short": 800,
             "medium": 1500,
@@ -123,32 +240,13 @@ class ZhipuAIService:
             {"role": "user", "content": f"请创作一个关于{theme}的{genre}故事。"}
         ]
 
-        async with httpx.AsyncClient(timeout=180.0) as client:
-            async with client.stream(
-                "POST",
-                f"{self.base_url}chat/completions",
-                headers=self.headers,
-                json={
-                    "model": "glm-4.6",
-                    "messages": messages,
-                    "max_tokens": max_tokens,
-                    "temperature": 0.8,
-                    "stream": True
-                }
-            ) as response:
-                async for line in response.aiter_lines():
-                    if line.startswith("data: "):
-                        data = line[6:]
-                        if data == "[DONE]":
-                            break
-                        try:
-                            chunk = json.loads(data)
-                            delta = chunk.get("choices", [{}])[0].get("delta", {})
-                            content = delta.get("content", "")
-                            if content:
-                                yield content
-                        except:
-                            continue
+        async for event in self.stream_chat_completion(
+            model="glm-4.6",
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=0.8
+        ):
+            yield event
 
     async def generate_character_stream(
         self,
@@ -157,7 +255,7 @@ class ZhipuAIService:
         name: Optional[str] = None,
         description: Optional[str] = None
     ):
-        """角色生成 - 流式输出"""
+        """角色生成 - 流式输出（StreamEvent）"""
         system_prompt = f"""
         你是一个专业的角色设计师，请根据以下要求创建一个角色：
 
@@ -184,40 +282,20 @@ class ZhipuAIService:
             {"role": "user", "content": f"请创建一个{character_type}角色。"}
         ]
 
-        async with httpx.AsyncClient(timeout=180.0) as client:
-            async with client.stream(
-                "POST",
-                f"{self.base_url}chat/completions",
-                headers=self.headers,
-                json={
-                    "model": "glm-4.6",
-                    "messages": messages,
-                    "max_tokens": 3000,
-                    "temperature": 0.7,
-                    "stream": True
-                }
-            ) as response:
-                async for line in response.aiter_lines():
-                    if line.startswith("data: "):
-                        data = line[6:]
-                        if data == "[DONE]":
-                            break
-                        try:
-                            chunk = json.loads(data)
-                            delta = chunk.get("choices", [{}])[0].get("delta", {})
-                            content = delta.get("content", "")
-                            if content:
-                                yield content
-                        except:
-                            continue
+        async for event in self.stream_chat_completion(
+            model="glm-4.6",
+            messages=messages,
+            max_tokens=3000,
+            temperature=0.7
+        ):
+            yield event
 
-    async def convert_to_script(
+    def _script_messages(
         self,
         content: str,
         script_format: str = "standard",
         characters: Optional[List[str]] = None
-    ) -> str:
-        """剧本转换"""
+    ) -> List[Dict[str, str]]:
         system_prompt = f"""
         你是一个专业的编剧，请将以下小说内容转换为{script_format}格式的剧本：
 
@@ -233,23 +311,48 @@ class ZhipuAIService:
         请直接输出剧本内容，使用标准的剧本格式。
         """
 
-        messages = [
+        return [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": content}
         ]
 
+    async def convert_to_script(
+        self,
+        content: str,
+        script_format: str = "standard",
+        characters: Optional[List[str]] = None,
+        cache: bool = False
+    ) -> str:
+        """剧本转换"""
         response = await self.chat_completion(
             model="glm-4.6",
-            messages=messages,
+            messages=self._script_messages(content, script_format, characters),
             max_tokens=2000,
             temperature=0.7,
             use_max_key=False,
+            cache=cache,
             thinking={"type": "disabled"}
         )
 
         message = response.get("choices", [{}])[0].get("message", {})
         return message.get("content", "") or message.get("reasoning_content", "")
 
+    async def convert_to_script_stream(
+        self,
+        content: str,
+        script_format: str = "standard",
+        characters: Optional[List[str]] = None
+    ):
+        """剧本转换 - 流式输出（StreamEvent）"""
+        async for event in self.stream_chat_completion(
+            model="glm-4.6",
+            messages=self._script_messages(content, script_format, characters),
+            max_tokens=2000,
+            temperature=0.7,
+            thinking={"type": "disabled"}
+        ):
+            yield event
+
     async def generate_image(
         self,
         prompt: str,
@@ -267,69 +370,109 @@ class ZhipuAIService:
         print(f"[DEBUG] Prompt: {payload['prompt'][:100]}...")
         print(f"[DEBUG] Size: {size}")
 
-        last_error = None
-        
-        for key_attempt in range(len(self.api_keys)):
-            for attempt in range(max_retries):
+        await quota_ledger.check_units("image_generate_count")
+
+        client = self.http_pool.client
+        rate_limited_keys = set()
+
+        # 每个密钥最多重试 max_retries 次；429后重新租用时避开刚被限流的密钥
+        for attempt in range(max_retries * len(self.key_pool)):
+            try:
+                async with self.key_pool.lease(payload["model"], exclude=rate_limited_keys) as lease:
+                    response = await client.post(
+                        f"{self.base_url}images/generations",
+                        headers=lease.headers,
+                        json=payload,
+                        timeout=self.http_pool.timeout("image")
+                    )
+                    lease.observe(response)
+
+                print(f"[DEBUG] Response status: {response.status_code} ({lease.label})")
+
+                response.raise_for_status()
+                result = response.json()
+
+                await quota_ledger.record(payload["model"], "image", pack="image_generate_count", units=1)
+                print(f"[DEBUG] Image generated successfully")
+                print(f"[DEBUG] Response keys: {result.keys()}")
+
+                return result["data"][0]["url"]
+            except httpx.HTTPStatusError as e:
+                error_detail = ""
                 try:
-                    async with httpx.AsyncClient(timeout=180.0) as client:
-                        response = await client.post(
-                            f"{self.base_url}images/generations",
-                            headers=self.headers,
-                            json=payload
-                        )
-                        
-                        print(f"[DEBUG] Response status: {response.status_code}")
-                        
-                        response.raise_for_status()
-                        result = response.json()
-                        
-                        print(f"[DEBUG] Image generated successfully")
-                        print(f"[DEBUG] Response keys: {result.keys()}")
-                        
-                        return result["data"][0]["url"]
-                except httpx.HTTPStatusError as e:
-                    last_error = e
-                    error_detail = ""
-                    try:
-                        error_detail = e.response.json()
-                        print(f"[ERROR] API Error Response: {error_detail}")
-                    except:
-                        error_detail = e.response.text
-                        print(f"[ERROR] API Error Text: {error_detail}")
-                    
-                    if e.response.status_code == 429:
-                        if attempt < max_retries - 1:
-                            wait_time = (2 ** attempt) * 10
-                            print(f"[WARN] Rate limit (429) on key #{self.current_key_index + 1}, waiting {wait_time}s...")
-                            await asyncio.sleep(wait_time)
-                            continue
-                        else:
-                            if key_attempt < len(self.api_keys) - 1:
-                                print(f"[INFO] Key #{self.current_key_index + 1} exhausted, switching to next key...")
-                                self.switch_api_key()
-                                break
-                            else:
-                                print(f"[ERROR] All API keys exhausted")
-                                raise Exception("图像生成配额已用完。CogView-4需要单独的图像生成配额（0.06元/次）。请检查：1) 账户余额是否充足 2) 是否有CogView-4的使用权限 3) 并发限制（V0用户5个并发）")
-                    elif e.response.status_code == 400:
-                        raise Exception(f"请求参数错误（400）：{error_detail}。请检查prompt是否符合要求。")
-                    elif e.response.status_code == 401:
-                        raise Exception(f"API密钥无效（401）：{error_detail}。请检查ZHIPU_API_KEY配置。")
-                    elif e.response.status_code == 403:
-                        raise Exception(f"无权限访问（403）：{error_detail}。该API密钥可能没有CogView-4的使用权限。")
+                    error_detail = e.response.json()
+                    print(f"[ERROR] API Error Response: {error_detail}")
+                except:
+                    error_detail = e.response.text
+                    print(f"[ERROR] API Error Text: {error_detail}")
+                
+                if e.response.status_code == 429:
+                    rate_limited_keys.add(lease.label)
+                    if attempt < max_retries * len(self.key_pool) - 1:
+                        print(f"[WARN] Rate limit (429) on {lease.label}, requeueing...")
+                        continue
                     else:
-                        print(f"[ERROR] HTTP {e.response.status_code}: {error_detail}")
-                        raise Exception(f"图像生成失败（HTTP {e.response.status_code}）：{error_detail}")
-                except Exception as e:
-                    if "图像生成" in str(e):
-                        raise  # 重新抛出已格式化的错误
-                    print(f"[ERROR] Unexpected error: {str(e)}")
-                    raise Exception(f"图像生成失败：{str(e)}")
-        
+                        print(f"[ERROR] All API keys exhausted")
+                        raise Exception("图像生成配额已用完。CogView-4需要单独的图像生成配额（0.06元/次）。请检查：1) 账户余额是否充足 2) 是否有CogView-4的使用权限 3) 并发限制（V0用户5个并发）")
+                elif e.response.status_code == 400:
+                    raise Exception(f"请求参数错误（400）：{error_detail}。请检查prompt是否符合要求。")
+                elif e.response.status_code == 401:
+                    raise Exception(f"API密钥无效（401）：{error_detail}。请检查ZHIPU_API_KEY配置。")
+                elif e.response.status_code == 403:
+                    raise Exception(f"无权限访问（403）：{error_detail}。该API密钥可能没有CogView-4的使用权限。")
+                else:
+                    print(f"[ERROR] HTTP {e.response.status_code}: {error_detail}")
+                    raise Exception(f"图像生成失败（HTTP {e.response.status_code}）：{error_detail}")
+            except Exception as e:
+                if "图像生成" in str(e):
+                    raise  # 重新抛出已格式化的错误
+                print(f"[ERROR] Unexpected error: {str(e)}")
+                raise Exception(f"图像生成失败：{str(e)}")
+
         raise Exception("图像生成失败：所有尝试均失败")
 
-    async def generate_video(
+    def _batch_concurrency(self, model: str, configured: int = 0) -> int:
+        """批量请求的并发上限：配置值，或该模型族每个密钥的并发限额 × 密钥数"""
+        if configured:
+            return configured
+        family = self.key_pool.governor.family_for(model)
+        per_key = int(self.key_pool.governor.limits.get(family, {}).get("concurrency", 0) or 5)
+        return per_key * len(self.key_pool)
+
+    def batch_chat_completion(
+        self,
+        message_lists: List[List[Dict[str, str]]],
+        model: str = "glm-4.6",
+        concurrency: Optional[int] = None,
+        **kwargs
+    ) -> AsyncIterator[tuple]:
+        """批量对话 - 有界并发，按完成顺序产出 (序号, 响应, 错误信息)
+
+        并发上限默认取该模型每个密钥的并发限额 × 密钥数（实际放行仍由密钥池/限流器控制），
+        单个请求失败不影响其他请求；各请求共用相同的 system 消息时可命中上游的前缀缓存
+        """
+        calls = [
+            lambda messages=messages: self.chat_completion(model=model, messages=messages, **kwargs)
+            for messages in message_lists
+        ]
+        return run_bounded(calls, concurrency or self._batch_concurrency(model), label="Batch chat")
+
+    def generate_images(
+        self,
+        prompts: List[str],
+        size: str = "1024x1024",
+        concurrency: Optional[int] = None
+    ) -> AsyncIterator[tuple]:
+        """批量图像生成 - 有界并发，按完成顺序产出 (序号, 图片URL, 错误信息)
+
+        并发上限默认取 CogView 每个密钥的并发限额 × 密钥数，单张失败不影响其他图片
+        """
+        if not concurrency:
+            concurrency = self._batch_concurrency("cogview-4-250304", settings.image_batch_concurrency)
+        calls = [lambda prompt=prompt: self.generate_image(prompt=prompt, size=size) for prompt in prompts]
+        return run_bounded(calls, concurrency, label="Batch image")
+
+    async def submit_video(
         self,
         image_urls: List[str],
         prompt: str = "让画面动起来",
@@ -337,8 +480,11 @@ class ZhipuAIService:
         size: str = "1920x1080",
         fps: int = 30,
         max_retries: int = 2
-    ) -> str:
-        """视频生成（CogVideoX-3）- 首尾帧生成视频"""
+    ) -> Dict[str, Any]:
+        """提交视频生成任务（CogVideoX-3，首尾帧生成视频），立即返回任务ID
+
+        返回 {"task_id", "headers"}：任务结果只能用提交任务的密钥查询，轮询由 video_jobs 统一负责
+        """
         payload = {
             "model": "cogvideox-3",
             "image_url": image_urls,
@@ -351,52 +497,26 @@ class ZhipuAIService:
         
         print(f"[DEBUG] Video generation: {len(image_urls)} frames, {size}, {fps}fps")
 
+        client = self.http_pool.client
         for attempt in range(max_retries):
             try:
-                async with httpx.AsyncClient(timeout=600.0) as client:
+                async with self.key_pool.lease(payload["model"]) as lease:
                     response = await client.post(
                         f"{self.base_url}videos/generations",
-                        headers=self.headers,
-                        json=payload
+                        headers=lease.headers,
+                        json=payload,
+                        timeout=self.http_pool.timeout("video")
                     )
-                    response.raise_for_status()
-                    result = response.json()
-                    
-                    task_id = result.get("id")
-                    print(f"[INFO] Task created: {task_id}")
-                    
-                    max_polls = 120
-                    for poll in range(max_polls):
-                        await asyncio.sleep(3)
-                        
-                        try:
-                            status_response = await client.get(
-                                f"{self.base_url}async-result/{task_id}",
-                                headers=self.headers
-                            )
-                            status_response.raise_for_status()
-                            status_result = status_response.json()
-                            
-                            task_status = status_result.get("task_status")
-                            
-                            if task_status == "SUCCESS":
-                                video_result = status_result.get("video_result", [])
-                                if video_result and len(video_result) > 0:
-                                    video_url = video_result[0].get("url")
-                                    print(f"[SUCCESS] Video: {video_url}")
-                                    return video_url
-                                raise Exception("视频URL未返回")
-                            elif task_status == "FAILED":
-                                error_msg = status_result.get("error", {}).get("message", "Unknown")
-                                raise Exception(f"生成失败: {error_msg}")
-                            elif poll % 10 == 0:
-                                print(f"[INFO] Processing... {poll*3}s")
-                        except httpx.HTTPStatusError:
-                            if poll < max_polls - 1:
-                                continue
-                            raise
-                    
-                    raise Exception("超时(6分钟)")
+                    lease.observe(response)
+                response.raise_for_status()
+                result = response.json()
+
+                task_id = result.get("id")
+                if not task_id:
+                    raise Exception("视频生成失败: 未返回任务ID")
+                print(f"[INFO] Task created: {task_id}")
+                await quota_ledger.record(payload["model"], "video", units=1)
+                return {"task_id": task_id, "headers": lease.headers}
                     
             except httpx.HTTPStatusError as e:
                 error_detail = ""
@@ -407,9 +527,7 @@ class ZhipuAIService:
                 
                 if e.response.status_code == 429:
                     if attempt < max_retries - 1:
-                        wait_time = 60
-                        print(f"[WARN] 并发限制，等待{wait_time}秒...")
-                        await asyncio.sleep(wait_time)
+                        print(f"[WARN] 并发限制，重新排队...")
                         continue
                     raise Exception("并发限制或配额不足。请稍后重试或检查配额。")
                 elif e.response.status_code == 400:
@@ -423,41 +541,78 @@ class ZhipuAIService:
                     raise
                 raise Exception(f"视频生成失败: {str(e)}")
 
+    async def get_video_result(self, task_id: str, headers: Dict[str, str]) -> Dict[str, Any]:
+        """查询视频生成任务状态（async-result），须使用提交任务时的密钥"""
+        response = await self.http_pool.client.get(
+            f"{self.base_url}async-result/{task_id}",
+            headers=headers,
+            timeout=self.http_pool.timeout("default")
+        )
+        response.raise_for_status()
+        return response.json()
+
+    async def _post_vision(self, payload: Dict[str, Any], local_file: Optional[tuple] = None) -> Dict[str, Any]:
+        """发送图像/视频理解请求
+
+        local_file 为 (路径, MIME) 时，payload 中的 INLINE_MEDIA 占位符会被替换为流式base64的data URL，
+        文件边读边编码写入请求体，内存占用与文件大小无关
+        """
+        # 额度不足时改用备选模型（quota_fallback_models 中应配置视觉模型），需在生成请求体之前确定
+        payload["model"] = await quota_ledger.route_model(payload["model"], payload["max_tokens"])
+        body = None
+        if local_file is not None:
+            body = InlineMediaPayload(payload, *local_file, max_bytes=settings.vision_max_inline_bytes)
+
+        async with self.key_pool.lease(payload["model"]) as lease:
+            if body is None:
+                response = await self.http_pool.client.post(
+                    f"{self.base_url}chat/completions",
+                    headers=lease.headers,
+                    json=payload,
+                    timeout=self.http_pool.timeout("vision")
+                )
+            else:
+                response = await self.http_pool.client.post(
+                    f"{self.base_url}chat/completions",
+                    headers={**lease.headers, **body.headers},
+                    content=body,
+                    timeout=self.http_pool.timeout("vision")
+                )
+            lease.observe(response)
+        response.raise_for_status()
+        result = response.json()
+        await quota_ledger.record(payload["model"], "vision", result.get("usage"))
+        return result
+
     async def analyze_image(
         self,
         image_url: str,
-        prompt: str = "请详细描述这张图片的内容"
+        prompt: str = "请详细描述这张图片的内容",
+        cache: bool = True
     ) -> str:
-        """图像分析（GLM-4.5V）"""
-        import base64
-        import os
+        """图像分析（GLM-4.5V）
+
+        相同媒体内容 + 相同提示词的分析结果会被缓存（cache=False 跳过缓存）
+        """
+        cache_key = None
+        if cache:
+            cache_key = make_cache_key(await media_fingerprint(image_url), "glm-4.5v", prompt)
+            cached = await analysis_cache.get(cache_key)
+            if cached is not None:
+                return cached
         
-        # 如果是本地文件路径，转换为base64
-        if image_url.startswith("http://localhost") or image_url.startswith("http://127.0.0.1"):
-            # 提取文件路径
-            file_path = image_url.replace("http://localhost:8000/", "").replace("http://127.0.0.1:8000/", "")
-            
-            if os.path.exists(file_path):
-                with open(file_path, "rb") as f:
-                    image_data = base64.b64encode(f.read()).decode('utf-8')
-                    # 获取文件扩展名
-                    ext = os.path.splitext(file_path)[1].lower()
-                    mime_type = {
-                        '.jpg': 'image/jpeg',
-                        '.jpeg': 'image/jpeg',
-                        '.png': 'image/png',
-                        '.gif': 'image/gif',
-                        '.webp': 'image/webp'
-                    }.get(ext, 'image/jpeg')
-                    image_url = f"data:{mime_type};base64,{image_data}"
-            else:
-                raise Exception(f"图片文件不存在: {file_path}")
+        # 本地上传的图片先缩放、重压缩、去除元数据，再以base64 data URL内联发送（流式编码）
+        local_file = local_media_file(image_url, "image")
+        if local_file is not None:
+            prepared = await image_processor.prepare_for_vision(local_file[0])
+            if prepared != local_file[0]:
+                local_file = (prepared, "image/jpeg")
         
         messages = [
             {
                 "role": "user",
                 "content": [
-                    {"type": "image_url", "image_url": {"url": image_url}},
+                    {"type": "image_url", "image_url": {"url": INLINE_MEDIA if local_file else image_url}},
                     {"type": "text", "text": prompt}
                 ]
             }
@@ -470,15 +625,11 @@ class ZhipuAIService:
         }
 
         try:
-            async with httpx.AsyncClient(timeout=120.0) as client:
-                response = await client.post(
-                    f"{self.base_url}chat/completions",
-                    headers=self.headers,
-                    json=payload
-                )
-                response.raise_for_status()
-                result = response.json()
-                return result["choices"][0]["message"]["content"]
+            result = await self._post_vision(payload, local_file)
+            content = result["choices"][0]["message"]["content"]
+            if cache_key and content:
+                await analysis_cache.set(cache_key, content)
+            return content
         except httpx.HTTPStatusError as e:
             error_detail = e.response.text
             print(f"[ERROR] Image analysis: {error_detail}")
@@ -490,38 +641,28 @@ class ZhipuAIService:
     async def analyze_video(
         self,
         video_url: str,
-        prompt: str = "请详细分析这个视频的内容"
+        prompt: str = "请详细分析这个视频的内容",
+        cache: bool = True
     ) -> str:
-        """视频分析（GLM-4.5V）"""
-        import base64
-        import os
+        """视频分析（GLM-4.5V）
+
+        相同媒体内容 + 相同提示词的分析结果会被缓存（cache=False 跳过缓存）
+        """
+        cache_key = None
+        if cache:
+            cache_key = make_cache_key(await media_fingerprint(video_url), "glm-4.5v", prompt)
+            cached = await analysis_cache.get(cache_key)
+            if cached is not None:
+                return cached
         
-        # 如果是本地文件路径，转换为base64
-        if video_url.startswith("http://localhost") or video_url.startswith("http://127.0.0.1"):
-            # 提取文件路径
-            file_path = video_url.replace("http://localhost:8000/", "").replace("http://127.0.0.1:8000/", "")
-            
-            if os.path.exists(file_path):
-                with open(file_path, "rb") as f:
-                    video_data = base64.b64encode(f.read()).decode('utf-8')
-                    # 获取文件扩展名
-                    ext = os.path.splitext(file_path)[1].lower()
-                    mime_type = {
-                        '.mp4': 'video/mp4',
-                        '.mov': 'video/quicktime',
-                        '.avi': 'video/x-msvideo',
-                        '.mkv': 'video/x-matroska',
-                        '.webm': 'video/webm'
-                    }.get(ext, 'video/mp4')
-                    video_url = f"data:{mime_type};base64,{video_data}"
-            else:
-                raise Exception(f"视频文件不存在: {file_path}")
+        # 本地上传的视频以base64 data URL内联发送（流式编码，不整体读入内存）
+        local_file = local_media_file(video_url, "video")
         
         messages = [
             {
                 "role": "user",
                 "content": [
-                    {"type": "video_url", "video_url": {"url": video_url}},
+                    {"type": "video_url", "video_url": {"url": INLINE_MEDIA if local_file else video_url}},
                     {"type": "text", "text": prompt}
                 ]
             }
@@ -534,15 +675,11 @@ class ZhipuAIService:
         }
 
         try:
-            async with httpx.AsyncClient(timeout=180.0) as client:
-                response = await client.post(
-                    f"{self.base_url}chat/completions",
-                    headers=self.headers,
-                    json=payload
-                )
-                response.raise_for_status()
-                result = response.json()
-                return result["choices"][0]["message"]["content"]
+            result = await self._post_vision(payload, local_file)
+            content = result["choices"][0]["message"]["content"]
+            if cache_key and content:
+                await analysis_cache.set(cache_key, content)
+            return content
         except httpx.HTTPStatusError as e:
             error_detail = e.response.text
             print(f"[ERROR] Video analysis: {error_detail}")
@@ -557,7 +694,7 @@ class ZhipuAIService:
         max_results: int = 10,
         max_retries: int = 3
     ) -> Dict[str, Any]:
-        """联网搜索（使用GLM-4-Air + web_search工具）"""
+        """联网搜索（使用GLM-4-Air + web_search工具），相同查询同时进行时只调用一次上游"""
         payload = {
             "model": "glm-4-air",
             "messages": [
@@ -579,36 +716,39 @@ class ZhipuAIService:
             "max_tokens": 3000
         }
 
-        for attempt in range(max_retries):
-            try:
-                async with httpx.AsyncClient(timeout=180.0) as client:
-                    response = await client.post(
-                        f"{self.base_url}chat/completions",
-                        headers=self.headers,
-                        json=payload
-                    )
+        await quota_ledger.check_units("search_count")
+
+        async def call():
+            client = self.http_pool.client
+            for attempt in range(max_retries):
+                try:
+                    async with self.key_pool.lease(payload["model"]) as lease:
+                        response = await client.post(
+                            f"{self.base_url}chat/completions",
+                            headers=lease.headers,
+                            json=payload,
+                            timeout=self.http_pool.timeout("search")
+                        )
+                        lease.observe(response)
                     response.raise_for_status()
-                    return response.json()
-            except httpx.HTTPStatusError as e:
-                if e.response.status_code == 429:
-                    if attempt < max_retries - 1:
-                        wait_time = (2 ** attempt) * 3
-                        print(f"[WARN] Rate limit, waiting {wait_time}s...")
-                        await asyncio.sleep(wait_time)
-                        continue
-                print(f"[ERROR] Web search failed: {str(e)}")
-                raise
-            except Exception as e:
-                print(f"[ERROR] Web search error: {str(e)}")
-                raise
+                    result = response.json()
+                    await quota_ledger.record(payload["model"], "search", result.get("usage"), pack="search_count", units=1)
+                    return result
+                except httpx.HTTPStatusError as e:
+                    if e.response.status_code == 429:
+                        if attempt < max_retries - 1:
+                            continue
+                    print(f"[ERROR] Web search failed: {str(e)}")
+                    raise
+                except Exception as e:
+                    print(f"[ERROR] Web search error: {str(e)}")
+                    raise
 
-    async def generate_storyboard(
-        self,
-        script: str,
-        style: str = "cinematic",
-        shots: int = 6
-    ) -> List[Dict[str, Any]]:
-        """分镜生成 - 确保生成完整的镜头数量"""
+        if not settings.singleflight_enabled:
+            return await call()
+        return await upstream_flight.do(f"search:{make_cache_key(payload)}", call, kind="search")
+
+    def _storyboard_messages(self, script: str, style: str = "cinematic", shots: int = 6) -> List[Dict[str, str]]:
         system_prompt = f"""
         你是一个专业的分镜师，请根据以下剧本生成{shots}个完整的分镜脚本：
 
@@ -629,33 +769,58 @@ class ZhipuAIService:
         示例格式：[{{"shot_number": 1, "shot_type": "中景", ...}}, {{"shot_number": 2, ...}}]
         """
 
-        messages = [
+        return [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": f"剧本内容：{script}\n\n请生成{shots}个完整的分镜。"}
         ]
 
+    async def generate_storyboard(
+        self,
+        script: str,
+        style: str = "cinematic",
+        shots: int = 6,
+        cache: bool = False
+    ) -> List[Dict[str, Any]]:
+        """分镜生成 - 确保生成完整的镜头数量"""
         response = await self.chat_completion(
             model="glm-4.6",
-            messages=messages,
+            messages=self._storyboard_messages(script, style, shots),
             max_tokens=4000,  # 增加到4000确保能生成完整的镜头
             temperature=0.7,
             use_max_key=False,
+            cache=cache,
             thinking={"type": "disabled"}
         )
 
         message = response.get("choices", [{}])[0].get("message", {})
         content = message.get("content", "") or message.get("reasoning_content", "")
         
-        try:
-            result = json.loads(content)
-            if isinstance(result, list):
-                return result
-            elif isinstance(result, dict) and 'storyboard' in result:
-                return result['storyboard']
-            else:
-                return [result]
-        except json.JSONDecodeError:
+        extraction = extract_json(content, source="zhipu.generate_storyboard")
+        if not extraction.ok:
             return [{"error": "无法解析分镜结果", "raw_content": content}]
+        result = extraction.value
+        if isinstance(result, list):
+            return result
+        elif isinstance(result, dict) and 'storyboard' in result:
+            return result['storyboard']
+        else:
+            return [result]
+
+    async def generate_storyboard_stream(
+        self,
+        script: str,
+        style: str = "cinematic",
+        shots: int = 6
+    ):
+        """分镜生成 - 流式输出（StreamEvent）"""
+        async for event in self.stream_chat_completion(
+            model="glm-4.6",
+            messages=self._storyboard_messages(script, style, shots),
+            max_tokens=4000,
+            temperature=0.7,
+            thinking={"type": "disabled"}
+        ):
+            yield event
 
 # 创建全局实例
 zhipu_service = ZhipuAIService()
\ No newline at end of file
@@ -0,0 +1,159 @@
+"""
+Compression - 响应压缩
+按 Accept-Encoding 协商 br（安装 brotli 时）或 gzip，只压缩超过阈值的一次性文本/JSON响应；
+流式响应（SSE、文件）和已经设置 Content-Encoding 的响应原样转发（brotli 为可选依赖）
+"""
+import gzip
+from typing import Any, Dict, Optional
+from starlette.datastructures import MutableHeaders
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+HAS_BROTLI = brotli is not None
+
+_COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript")
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """从 Accept-Encoding 中选择编码：br 优先于 gzip，q=0 视为不接受"""
+    accepted = {}
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.strip()] = quality
+    wildcard = accepted.get("*", 0.0)
+    for encoding in (("br", "gzip") if HAS_BROTLI else ("gzip",)):
+        if accepted.get(encoding, wildcard) > 0:
+            return encoding
+    return None
+
+def compress(body: bytes, encoding: str, level: Optional[int] = None) -> bytes:
+    """level 为空时使用默认压缩级别（gzip 6 / brotli 5）"""
+    if encoding == "br":
+        return brotli.compress(body, quality=5 if level is None else level)
+    return gzip.compress(body, compresslevel=6 if level is None else level, mtime=0)
+
+def add_vary(headers: MutableHeaders):
+    vary = headers.get("vary")
+    if not vary:
+        headers["vary"] = "Accept-Encoding"
+    elif "accept-encoding" not in vary.lower():
+        headers["vary"] = vary + ", Accept-Encoding"
+
+class _Stats:
+    def __init__(self):
+        self.responses = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.encodings: Dict[str, int] = {}
+        self.skipped_small = 0
+        self.skipped_streaming = 0
+
+    def record(self, encoding: str, original: int, compressed: int):
+        self.responses += 1
+        self.bytes_in += original
+        self.bytes_out += compressed
+        self.encodings[encoding] = self.encodings.get(encoding, 0) + 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "responses": self.responses,
+            "encodings": dict(self.encodings),
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "bytes_saved": self.bytes_in - self.bytes_out,
+            "ratio": round(self.bytes_out / self.bytes_in, 4) if self.bytes_in else 0.0,
+            "skipped_small": self.skipped_small,
+            "skipped_streaming": self.skipped_streaming,
+            "brotli_available": HAS_BROTLI
+        }
+
+# 全局统计
+compression_stats = _Stats()
+
+class CompressionMiddleware:
+    """纯ASGI中间件：压缩超过 minimum_size 的一次性文本/JSON响应
+
+    可压缩类型的响应头延迟到收到第一段响应体时再发送：响应体一次发完（more_body 为假）才压缩，
+    否则视为流式响应原样转发
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 5):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.levels = {"gzip": gzip_level, "br": brotli_quality}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        encoding = negotiate(headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+
+        async def compressing_send(message):
+            nonlocal start_message, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                response_headers = MutableHeaders(raw=message["headers"])
+                content_type = response_headers.get("content-type", "")
+                if ("content-encoding" in response_headers
+                        or not content_type.startswith(_COMPRESSIBLE_TYPES)
+                        or content_type.startswith("text/event-stream")
+                        or message["status"] in (204, 304)):
+                    # 不压缩的响应立即发送响应头（SSE 不因等待首个事件而延迟）
+                    passthrough = True
+                    await send(message)
+                    return
+                start_message = message
+                return
+            if start_message is None or message["type"] != "http.response.body":
+                passthrough = True
+                if start_message is not None:
+                    await send(start_message)
+                await send(message)
+                return
+
+            passthrough = True  # 只处理第一段响应体
+            response_headers = MutableHeaders(raw=start_message["headers"])
+            body = message.get("body", b"")
+            if message.get("more_body", False):
+                compression_stats.skipped_streaming += 1
+                await send(start_message)
+                await send(message)
+                return
+            if len(body) < self.minimum_size:
+                compression_stats.skipped_small += 1
+                await send(start_message)
+                await send(message)
+                return
+
+            compressed = compress(body, encoding, self.levels[encoding])
+            if len(compressed) >= len(body):
+                await send(start_message)
+                await send(message)
+                return
+            compression_stats.record(encoding, len(body), len(compressed))
+            response_headers["content-encoding"] = encoding
+            response_headers["content-length"] = str(len(compressed))
+            add_vary(response_headers)
+            await send(start_message)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, compressing_send)
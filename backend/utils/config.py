@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Optional, Dict, List
 
 class Settings(BaseSettings):
     # 基本配置
@@ -13,8 +13,19 @@ class Settings(BaseSettings):
     # 备用API密钥（用于轮换）
     zhipu_api_key_backup: str = "1a8daac8efc9495485f8694c5edfa3a4.9kb4gTmEyrWXztY4"  # 备用密钥
 
+    # 更多API密钥（JSON数组），与主密钥、备用密钥一起组成密钥池
+    zhipu_api_keys: List[str] = []
+
     # GLM-4.6 MAX API配置 - 支持图像视频理解、联网搜索、MCP
     zhipu_max_api_key: str = "e654b552ae8b47079555e9e290c98ba7.U3MuFwGafFCriCGN"
+    zhipu_max_api_keys: List[str] = []  # 更多MAX密钥（JSON数组）
+
+    # 密钥池健康评分配置
+    key_pool_penalty_half_life: float = 60.0  # 429惩罚分的半衰期（秒）
+    key_pool_penalty_weight: float = 5.0  # 429惩罚分在评分中的权重
+    key_pool_latency_scale: float = 10.0  # 延迟评分：每N秒平均延迟计1分
+    key_pool_quota_cooldown: float = 3600.0  # 额度耗尽的密钥暂停使用时间（秒）
+    key_pool_invalid_cooldown: float = 6 * 3600.0  # 失效（401）的密钥暂停使用时间（秒）
 
     # 资源包配置
     glm_4_6_tokens: int = 2000000  # 200万token GLM-4.6
@@ -23,6 +34,19 @@ class Settings(BaseSettings):
     search_count: int = 100  # 100次搜索
     image_generate_count: int = 20  # 20次图片生成
 
+    # 资源包额度控制
+    quota_enforce: bool = True  # 额度不足时改道或拒绝请求（关闭后只记账）
+    # 模型（最长前缀匹配）对应的token资源包，未列出的模型只记账不扣减
+    quota_model_packs: Dict[str, str] = {
+        "glm-4.6": "glm_4_6_tokens",
+        "glm-4.5v": "glm_4_5v_tokens",
+        "glm-4.5-air": "glm_4_5_air_tokens"
+    }
+    # 资源包不足时的备选模型
+    quota_fallback_models: Dict[str, str] = {
+        "glm-4.6": "glm-4.5-air"
+    }
+
     # 数据库配置
     database_url: str = "sqlite:///./story_universe.db"
 
@@ -34,11 +58,145 @@ class Settings(BaseSettings):
     # MCP配置
     mcp_server_url: str = "http://localhost:8001"
 
+    # 上游HTTP连接池配置
+    http_max_connections: int = 100  # 最大连接数
+    http_max_keepalive_connections: int = 20  # 最大空闲长连接数
+    http_keepalive_expiry: float = 60.0  # 空闲连接保活时间（秒）
+    http2_enabled: bool = True  # 安装h2时启用HTTP/2
+    http_connect_retries: int = 1  # 建立连接失败时的重试次数
+    http_connect_timeout: float = 10.0  # 建立连接超时（秒）
+    http_timeout_default: float = 120.0  # 各类操作的读取超时（秒）
+    http_timeout_chat: float = 180.0
+    http_timeout_stream: float = 180.0
+    http_timeout_image: float = 180.0
+    http_timeout_video: float = 600.0
+    http_timeout_vision: float = 180.0
+    http_timeout_search: float = 180.0
+    http_timeout_mcp: float = 120.0
+
+    # 上游限流配置：按（API密钥, 模型族）生效，模型名按最长前缀匹配模型族
+    # rpm：每分钟请求数（0表示不限），concurrency：同时进行的请求数（0表示不限）
+    rate_limits: Dict[str, Dict[str, float]] = {
+        "glm-4.6": {"rpm": 60, "concurrency": 10},
+        "glm-4.5v": {"rpm": 30, "concurrency": 5},
+        "glm-4.5-air": {"rpm": 60, "concurrency": 10},
+        "glm-4-air": {"rpm": 60, "concurrency": 10},
+        "glm-4-flash": {"rpm": 120, "concurrency": 20},
+        "glm-4v": {"rpm": 30, "concurrency": 5},
+        "cogview": {"rpm": 20, "concurrency": 5},  # CogView-4 V0用户5个并发
+        "cogvideox": {"rpm": 10, "concurrency": 5},
+        "default": {"rpm": 60, "concurrency": 10}
+    }
+    rate_limit_max_queue_wait: float = 120.0  # 排队等待上限（秒），超时直接报错
+    rate_limit_max_backoff: float = 30.0  # 连续429时暂停放行的最长时间（秒）
+    image_batch_concurrency: int = 0  # 分镜批量生图的并发上限（0表示按CogView并发限额×密钥数）
+    character_batch_max_size: int = 20  # 批量生成角色的单次数量上限
+
+    # 流式输出配置
+    sse_heartbeat_interval: float = 15.0  # 下游事件流无数据时的心跳间隔（秒）
+
+    # 对话结果缓存配置（温度为0的请求默认缓存，非零温度需单次请求显式开启）
+    completion_cache_enabled: bool = True
+    completion_cache_ttl: float = 7 * 24 * 3600  # 缓存有效期（秒）
+    completion_cache_max_entries: int = 500  # 内存LRU条目上限
+    completion_cache_max_persistent_entries: int = 20000  # SQLite持久层条目上限
+    completion_cache_persist: bool = True  # 是否写入SQLite持久层
+
+    # 图像/视频理解结果缓存配置
+    analysis_cache_ttl: float = 30 * 24 * 3600  # 缓存有效期（秒）
+    analysis_cache_max_entries: int = 500  # 内存LRU条目上限
+    analysis_cache_max_persistent_entries: int = 20000  # SQLite持久层条目上限
+
+    # 续写前文分层摘要配置
+    summary_model: str = "glm-4.5-air"  # 摘要使用的模型
+    summary_trigger_chars: int = 2000  # 前文超过该长度时启用摘要
+    summary_recent_chars: int = 1500  # 末尾保留原文的长度
+    summary_chunk_chars: int = 6000  # 原文分块的目标长度
+    summary_leaf_chars: int = 400  # 每个分块摘要的字数上限
+    summary_merge_chars: int = 500  # 合并摘要的字数上限
+    summary_fanout: int = 6  # 每个上层摘要合并的下层摘要数
+    summary_context_chars: int = 3000  # 前文概要总长度上限（超过则继续向上合并）
+    summary_concurrency: int = 4  # 同时进行的摘要请求数
+    summary_cache_ttl: float = 30 * 24 * 3600  # 摘要缓存有效期（秒）
+    summary_cache_max_entries: int = 2000  # 内存LRU条目上限
+
+    # 搜索结果缓存（stale-while-revalidate）：新鲜期内直接返回，过期后可用期内返回旧结果并后台刷新
+    search_cache_enabled: bool = True
+    search_cache_max_entries: int = 500  # 内存LRU条目上限
+    search_cache_jitter: float = 0.2  # 新鲜期随机缩短的最大比例，避免同时到期
+    search_cache_hot_topics_fresh: float = 3 * 3600  # /api/search/hot-topics
+    search_cache_hot_topics_stale: float = 24 * 3600
+    search_cache_enhanced_search_fresh: float = 3600  # /api/search/enhanced-search
+    search_cache_enhanced_search_stale: float = 12 * 3600
+    search_cache_materials_fresh: float = 6 * 3600  # /api/search/materials
+    search_cache_materials_stale: float = 3 * 24 * 3600
+    search_cache_mcp_hot_topics_fresh: float = 3 * 3600  # MCPService.get_hot_topics
+    search_cache_mcp_hot_topics_stale: float = 24 * 3600
+
+    # 合并相同的进行中上游请求（非流式对话、联网搜索）
+    singleflight_enabled: bool = True
+
+    # 续写前文片段检索配置（项目章节的本地BM25索引）
+    retrieval_enabled: bool = True  # 续写时是否检索相关前文片段
+    retrieval_passage_chars: int = 300  # 索引片段长度
+    retrieval_top_k: int = 20  # 候选片段数
+    retrieval_max_query_terms: int = 64  # 参与打分的查询词项上限（取IDF最高的）
+    retrieval_context_chars: int = 1500  # 相关前文片段总长度上限
+
+    # 视频生成任务配置：单个后台协程轮询所有未完成任务
+    video_poll_initial_interval: float = 5.0  # 首次查询间隔（秒）
+    video_poll_backoff: float = 1.5  # 每次查询后间隔的增长倍数
+    video_poll_max_interval: float = 30.0  # 查询间隔上限（秒）
+    video_poll_concurrency: int = 10  # 每轮同时进行的状态查询数
+    video_job_timeout: float = 600.0  # 任务最长等待时间（秒）
+    video_job_ttl: float = 3600.0  # 已完成任务保留时间（秒）
+
+    # 生成流水线（大纲 → 章节 → 剧本 → 分镜 → 图片 → 视频）
+    pipeline_stage_concurrency: int = 4  # 同时执行的阶段数（所有流水线共享）
+    pipeline_max_chapters: int = 20  # 单条流水线的章节数上限
+
+    # HTTP响应缓存与压缩
+    catalog_cache_max_age: int = 3600  # 目录类接口（类型/风格/格式列表）的 Cache-Control max-age（秒）
+    compression_min_size: int = 1024  # 响应体超过该大小时按 Accept-Encoding 压缩（gzip / br）
+    compression_gzip_level: int = 6
+    compression_brotli_quality: int = 5
+
     # 文件上传配置
     max_file_size: int = 10 * 1024 * 1024  # 10MB
+    max_video_file_size: int = 500 * 1024 * 1024  # 视频上传上限 500MB
+    upload_chunk_size: int = 1024 * 1024  # 分块写入大小 1MB
+    vision_max_inline_bytes: int = 100 * 1024 * 1024  # 本地媒体内联（base64）发送给视觉模型的大小上限
+
+    # 图片预处理配置（Pillow，进程池执行）
+    image_process_workers: int = 2  # 进程池大小
+    vision_image_max_edge: int = 2048  # 发送给视觉模型的图片最长边（像素）
+    vision_image_quality: int = 85  # 重新压缩的JPEG质量
+    thumbnail_max_edge: int = 320  # 缩略图最长边（像素）
+    thumbnail_quality: int = 80
+
+    # 媒体库配置（按内容寻址存储上传文件）
+    media_store_max_bytes: int = 5 * 1024 * 1024 * 1024  # 总容量上限 5GB，超出时淘汰未被引用的对象
+    media_store_unreferenced_ttl: float = 7 * 24 * 3600  # 未被引用的对象保留时间（秒）
+    media_store_evict_every: int = 50  # 每存入N个文件检查一次淘汰
     upload_dir: str = "uploads"
 
     class Config:
         env_file = ".env"
 
+    def all_zhipu_api_keys(self) -> List[str]:
+        """普通密钥池：主密钥 + 备用密钥 + zhipu_api_keys（去重、去空）"""
+        return _dedupe([self.zhipu_api_key, self.zhipu_api_key_backup, *self.zhipu_api_keys])
+
+    def all_zhipu_max_api_keys(self) -> List[str]:
+        """MAX密钥池：zhipu_max_api_key + zhipu_max_api_keys（去重、去空）"""
+        return _dedupe([self.zhipu_max_api_key, *self.zhipu_max_api_keys])
+
+def _dedupe(keys: List[str]) -> List[str]:
+    result = []
+    for key in keys:
+        key = (key or "").strip()
+        if key and key not in result:
+            result.append(key)
+    return result
+
 settings = Settings()
\ No newline at end of file
@@ -0,0 +1,21 @@
+import os
+import sqlite3
+from utils.config import settings
+
+def sqlite_path(database_url: str = None) -> str:
+    """从 database_url（sqlite:///./story_universe.db）解析出SQLite文件路径"""
+    url = database_url or settings.database_url
+    if not url.startswith("sqlite"):
+        raise ValueError(f"仅支持SQLite数据库: {url}")
+    path = url.split(":///", 1)[1] if ":///" in url else "story_universe.db"
+    return path or "story_universe.db"
+
+def connect_sqlite(path: str = None) -> sqlite3.Connection:
+    """创建SQLite连接：WAL模式，允许跨线程使用（调用方自行加锁）"""
+    path = path or sqlite_path()
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=30.0)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
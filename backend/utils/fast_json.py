@@ -0,0 +1,26 @@
+"""
+Fast JSON - JSON编解码
+安装 orjson 时使用 orjson，否则回退到标准库 json（orjson 为可选依赖）
+"""
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+HAS_ORJSON = orjson is not None
+
+if orjson is not None:
+    loads = orjson.loads
+
+    def dumps(data: Any) -> bytes:
+        """序列化为UTF-8字节（不转义中文）"""
+        return orjson.dumps(data)
+else:
+    loads = json.loads
+
+    def dumps(data: Any) -> bytes:
+        """序列化为UTF-8字节（不转义中文）"""
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
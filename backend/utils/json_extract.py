@@ -0,0 +1,257 @@
+"""
+JSON Extract - 从模型输出中提取JSON
+在混有说明文字、```json 代码块的文本中定位最外层JSON值并解析；严格解析失败时单次线性扫描修复常见问题：
+- 末尾多余逗号（[1, 2,] / {"a": 1,}）
+- 全角引号、冒号、逗号作为JSON分隔符（“name”：“李明”，）
+- 字符串内未转义的换行、制表符
+- 输出被截断：补全未闭合的字符串和括号，丢弃不完整的最后一项
+解析结果附带修复项列表，并按调用来源统计解析成功率
+"""
+from typing import Any, Dict, List, Optional
+from utils.fast_json import loads
+
+_OPENERS = {"{": "}", "[": "]"}
+_FULLWIDTH_QUOTES = "“”"
+_FULLWIDTH_PUNCT = {"：": ":", "，": ","}
+_CONTROL_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}
+
+class JSONExtraction:
+    """提取结果：ok 为真时 value 为解析出的值；repairs 为做过的修复；text 为去掉代码块标记后的原文"""
+
+    __slots__ = ("value", "ok", "repairs", "text", "error")
+
+    def __init__(self, value: Any = None, ok: bool = False, repairs: Optional[List[str]] = None,
+                 text: str = "", error: Optional[str] = None):
+        self.value = value
+        self.ok = ok
+        self.repairs = repairs if repairs is not None else []
+        self.text = text
+        self.error = error
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"ok": self.ok, "repairs": self.repairs, "error": self.error}
+
+class _Stats:
+    def __init__(self):
+        self.attempts = 0
+        self.strict = 0
+        self.repaired = 0
+        self.failed = 0
+        self.repairs: Dict[str, int] = {}
+        self.sources: Dict[str, Dict[str, int]] = {}
+
+    def record(self, source: str, result: JSONExtraction):
+        self.attempts += 1
+        outcome = "failed" if not result.ok else ("repaired" if _is_repaired(result.repairs) else "strict")
+        setattr(self, outcome, getattr(self, outcome) + 1)
+        for repair in result.repairs:
+            self.repairs[repair] = self.repairs.get(repair, 0) + 1
+        counts = self.sources.setdefault(source, {"attempts": 0, "strict": 0, "repaired": 0, "failed": 0})
+        counts["attempts"] += 1
+        counts[outcome] += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "attempts": self.attempts,
+            "strict": self.strict,
+            "repaired": self.repaired,
+            "failed": self.failed,
+            "success_rate": round((self.strict + self.repaired) / self.attempts, 4) if self.attempts else 0.0,
+            "repairs": dict(self.repairs),
+            "sources": {name: dict(counts) for name, counts in self.sources.items()}
+        }
+
+# 全局统计
+json_extract_stats = _Stats()
+
+# 只是去掉代码块/说明文字，不算修复
+_COSMETIC = {"code_fence", "surrounding_text"}
+
+def _is_repaired(repairs: List[str]) -> bool:
+    return any(repair not in _COSMETIC for repair in repairs)
+
+def strip_code_fence(text: str) -> str:
+    """去掉首尾的 ``` / ```json 代码块标记"""
+    text = (text or "").strip()
+    if text.startswith("```"):
+        newline = text.find("\n")
+        text = text[newline + 1:] if newline != -1 else text[3:]
+        if text.lower().startswith("json"):
+            text = text[4:]
+    if text.endswith("```"):
+        text = text[:-3]
+    return text.strip()
+
+def _find_start(text: str) -> int:
+    """第一个 { 或 [ 的位置（全角引号开头的对象同样以 { 开头）"""
+    positions = [p for p in (text.find("{"), text.find("[")) if p != -1]
+    return min(positions) if positions else -1
+
+def _scan_end(text: str, start: int) -> int:
+    """从 start 开始匹配括号，返回最外层值结束后的位置；未闭合返回 -1"""
+    depth = 0
+    in_string = False
+    escape = False
+    for i in range(start, len(text)):
+        c = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif c == "\\":
+                escape = True
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c in "{[":
+            depth += 1
+        elif c in "}]":
+            depth -= 1
+            if depth == 0:
+                return i + 1
+    return -1
+
+def _repair(text: str, repairs: List[str]) -> str:
+    """单次扫描修复，返回修复后的JSON文本"""
+    out: List[str] = []
+    closers: List[str] = []
+    in_string = False
+    quote = '"'  # 当前字符串的开引号（'"' 或全角引号）
+    escape = False
+    expect_value = False  # 对象中已写出冒号、尚未写出值
+    safe_point = None  # 最近一个完整值之后的位置：(len(out), 当时未闭合的括号)
+    used = set()
+
+    def mark(repair: str):
+        if repair not in used:
+            used.add(repair)
+            repairs.append(repair)
+
+    def last_significant() -> int:
+        i = len(out) - 1
+        while i >= 0 and out[i] in " \t\r\n":
+            i -= 1
+        return i
+
+    for c in text:
+        if in_string:
+            if escape:
+                escape = False
+                out.append(c)
+            elif c == "\\":
+                escape = True
+                out.append(c)
+            elif c == '"' and quote != '"':
+                out.append('\\"')  # 全角引号字符串中的ASCII引号
+            elif (c == '"' and quote == '"') or (quote != '"' and c in _FULLWIDTH_QUOTES):
+                in_string = False
+                out.append('"')
+            elif c in _CONTROL_ESCAPES:
+                mark("control_chars")
+                out.append(_CONTROL_ESCAPES[c])
+            else:
+                out.append(c)
+            continue
+
+        if c == '"' or c in _FULLWIDTH_QUOTES:
+            if c != '"':
+                mark("fullwidth_quotes")
+            in_string = True
+            quote = c
+            out.append('"')
+            expect_value = False
+        elif c in _FULLWIDTH_PUNCT:
+            mark("fullwidth_punctuation")
+            c = _FULLWIDTH_PUNCT[c]
+            expect_value = c == ":"
+            if c == ",":
+                safe_point = (len(out), list(closers))
+            out.append(c)
+        elif c in _OPENERS:
+            closers.append(_OPENERS[c])
+            out.append(c)
+            expect_value = False
+        elif c in "}]":
+            if not closers:
+                break  # 多余的右括号
+            i = last_significant()
+            if i >= 0 and out[i] == ",":
+                mark("trailing_comma")
+                del out[i]
+            out.append(closers.pop())
+            expect_value = False
+            if not closers:
+                return "".join(out)
+        elif c == ",":
+            safe_point = (len(out), list(closers))
+            out.append(c)
+        else:
+            if c == ":":
+                expect_value = True
+            elif c not in " \t\r\n":
+                expect_value = False
+            out.append(c)
+
+    # 输出被截断
+    mark("truncated")
+    if in_string:
+        if escape:
+            out.pop()
+        out.append('"')
+    if expect_value:
+        out.append("null")
+    candidate = "".join(out).rstrip().rstrip(",") + "".join(reversed(closers))
+    try:
+        loads(candidate)
+        return candidate
+    except ValueError:
+        pass
+    # 最后一项不完整（如截断在键名或数字中间），退回到最近一个完整值之后
+    if safe_point is not None:
+        position, open_closers = safe_point
+        mark("dropped_incomplete_tail")
+        return "".join(out[:position]).rstrip() + "".join(reversed(open_closers))
+    return candidate
+
+def extract_json(text: str, source: str = "unknown", expect: Optional[type] = None) -> JSONExtraction:
+    """从模型输出中提取最外层JSON值
+
+    source: 调用来源（用于统计）；expect: 期望的类型（list / dict），不符时视为失败
+    """
+    repairs: List[str] = []
+    raw = (text or "").strip()
+    cleaned = strip_code_fence(raw)
+    if cleaned != raw:
+        repairs.append("code_fence")
+    result = JSONExtraction(text=cleaned, repairs=repairs)
+
+    start = _find_start(cleaned)
+    if start == -1:
+        result.error = "未找到JSON"
+    else:
+        end = _scan_end(cleaned, start)
+        candidate = cleaned[start:end] if end != -1 else cleaned[start:]
+        if start > 0 or (end != -1 and cleaned[end:].strip()):
+            repairs.append("surrounding_text")
+        try:
+            result.value = loads(candidate)
+            result.ok = True
+        except ValueError:
+            try:
+                # 修复扫描自行识别根值结束位置（全角引号字符串中的括号也能正确跳过）
+                result.value = loads(_repair(cleaned[start:], repairs))
+                result.ok = True
+            except ValueError as e:
+                result.error = str(e)
+
+    if result.ok and expect is not None and not isinstance(result.value, expect):
+        result.ok = False
+        result.error = f"类型不符：期望{expect.__name__}"
+
+    json_extract_stats.record(source, result)
+    if result.ok and _is_repaired(repairs):
+        print(f"[INFO] JSON repaired ({source}): {', '.join(repairs)}")
+    elif not result.ok:
+        print(f"[ERROR] JSON extraction failed ({source}): {result.error}")
+        print(f"[DEBUG] Content: {cleaned[:500]}")
+    return result
@@ -0,0 +1,131 @@
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import re
+import aiofiles
+from functools import lru_cache
+from typing import Optional
+from urllib.parse import unquote
+from utils.config import settings
+
+# 本服务对外返回的上传文件URL前缀，上传目录挂载在 /uploads
+_LOCAL_PREFIXES = ("http://localhost:8000/", "http://127.0.0.1:8000/")
+_UPLOADS_MOUNT = "uploads/"
+# 媒体库中的文件名即内容SHA-256
+_CONTENT_ADDRESSED = re.compile(r"^[0-9a-f]{64}$")
+
+def local_media_path(url: str) -> Optional[str]:
+    """把本服务的上传文件URL转换为本地路径，非本地URL返回None
+
+    路径解析（含 ../ 和符号链接）后必须位于上传目录内，否则抛出异常，
+    避免读取 .env 等文件并内联发送给上游模型
+    """
+    for prefix in _LOCAL_PREFIXES:
+        if url.startswith(prefix):
+            relative = unquote(url[len(prefix):].split("?", 1)[0].split("#", 1)[0])
+            root = os.path.realpath(settings.upload_dir)
+            path = os.path.realpath(os.path.join(root, relative[len(_UPLOADS_MOUNT):]))
+            if not relative.startswith(_UPLOADS_MOUNT) or os.path.commonpath([root, path]) != root:
+                raise Exception("只能访问上传目录中的文件")
+            return path
+    return None
+
+@lru_cache(maxsize=1024)
+def _file_sha256(path: str, size: int, mtime_ns: int) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+async def file_sha256(path: str) -> str:
+    """本地文件内容SHA-256（媒体库文件直接取文件名，其余文件按大小和修改时间缓存计算结果）"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if _CONTENT_ADDRESSED.match(stem):
+        return stem
+    stat = os.stat(path)
+    return await asyncio.to_thread(_file_sha256, path, stat.st_size, stat.st_mtime_ns)
+
+async def media_fingerprint(url: str) -> str:
+    """媒体内容指纹：本地文件按内容SHA-256，data URL按内容哈希，远程URL按URL本身
+
+    本地路径经 local_media_path 校验，上传目录之外的文件不会被读取（抛出异常）
+    """
+    path = local_media_path(url)
+    if path is not None and os.path.isfile(path):
+        return "sha256:" + await file_sha256(path)
+    if url.startswith("data:"):
+        return "data:" + hashlib.sha256(url.encode("utf-8")).hexdigest()
+    return f"url:{url}"
+
+# 本地媒体的MIME类型
+MEDIA_MIME_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.gif': 'image/gif',
+    '.webp': 'image/webp',
+    '.mp4': 'video/mp4',
+    '.mov': 'video/quicktime',
+    '.avi': 'video/x-msvideo',
+    '.mkv': 'video/x-matroska',
+    '.webm': 'video/webm'
+}
+
+# payload中表示本地媒体data URL的占位符
+INLINE_MEDIA = "__inline_media_data_url__"
+
+class MediaTooLargeError(Exception):
+    """本地媒体超过内联发送的大小上限"""
+
+class InlineMediaPayload:
+    """流式JSON请求体：把payload中的 INLINE_MEDIA 占位符替换为本地文件的base64 data URL
+
+    文件按块读取、按块编码后直接写入请求体，不在内存中拼出完整的base64字符串和JSON；
+    Content-Length 预先算出，每次迭代都重新读取文件，因此请求可以重试
+    """
+
+    # 3的倍数，保证分块编码拼接后与整体编码一致
+    CHUNK_SIZE = 3 * 256 * 1024
+
+    def __init__(self, payload: dict, path: str, mime: str, max_bytes: Optional[int] = None):
+        size = os.path.getsize(path)
+        if max_bytes and size > max_bytes:
+            raise MediaTooLargeError(
+                f"文件过大（{size / (1024 * 1024):.1f}MB），超过内联发送上限{max_bytes // (1024 * 1024)}MB"
+            )
+        body = json.dumps(payload)
+        if body.count(INLINE_MEDIA) != 1:
+            raise ValueError("payload中必须且只能包含一个 INLINE_MEDIA 占位符")
+        before, after = body.split(INLINE_MEDIA)
+        self.path = path
+        self.size = size
+        self._prefix = f"{before}data:{mime};base64,".encode("utf-8")
+        self._suffix = after.encode("utf-8")
+        self.content_length = len(self._prefix) + 4 * ((size + 2) // 3) + len(self._suffix)
+
+    @property
+    def headers(self) -> dict:
+        return {"Content-Type": "application/json", "Content-Length": str(self.content_length)}
+
+    async def __aiter__(self):
+        yield self._prefix
+        async with aiofiles.open(self.path, "rb") as f:
+            while True:
+                chunk = await f.read(self.CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield base64.b64encode(chunk)
+        yield self._suffix
+
+def local_media_file(url: str, kind: str) -> Optional[tuple]:
+    """本地上传文件的 (路径, MIME)；非本地URL返回None，文件不存在时抛出异常"""
+    path = local_media_path(url)
+    if path is None:
+        return None
+    if not os.path.isfile(path):
+        raise Exception(f"{'图片' if kind == 'image' else '视频'}文件不存在: {os.path.basename(path)}")
+    default = "image/jpeg" if kind == "image" else "video/mp4"
+    return path, MEDIA_MIME_TYPES.get(os.path.splitext(path)[1].lower(), default)
@@ -0,0 +1,20 @@
+from contextvars import ContextVar
+
+# 当前请求的路由路径，用于把上游用量归属到具体API
+current_route: ContextVar[str] = ContextVar("current_route", default="internal")
+
+class RequestContextMiddleware:
+    """纯ASGI中间件：为每个HTTP请求设置 current_route（对流式响应同样生效）"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = current_route.set(scope.get("path", "unknown"))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_route.reset(token)
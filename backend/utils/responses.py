@@ -0,0 +1,102 @@
+"""
+Responses - JSON响应类与目录类接口的HTTP缓存
+- FastJSONResponse：用 utils.fast_json 序列化（orjson可用时使用orjson），作为全局默认响应类
+- catalog：目录类接口（类型、风格、格式等常量列表）首次调用时序列化一次并预先压缩，
+  之后直接返回缓存的字节；带强ETag和 Cache-Control，If-None-Match 命中时返回304
+"""
+import hashlib
+import json
+from typing import Any, Callable, Dict, List, Optional
+from fastapi import Request
+from fastapi.responses import JSONResponse
+from starlette.responses import Response
+from utils.config import settings
+from utils.fast_json import dumps
+from utils.compression import negotiate, compress, HAS_BROTLI
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        try:
+            return dumps(content)
+        except TypeError:
+            # orjson 不支持的类型（如非字符串键）退回标准库
+            return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+class _Stats:
+    def __init__(self):
+        self.responses = 0
+        self.not_modified = 0
+        self.bytes_sent = 0
+        self.bytes_saved = 0  # 304省去的响应体 + 压缩省去的字节
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "responses": self.responses,
+            "not_modified": self.not_modified,
+            "bytes_sent": self.bytes_sent,
+            "bytes_saved": self.bytes_saved
+        }
+
+# 全局统计
+catalog_stats = _Stats()
+
+def _etag_matches(if_none_match: str, etags: List[str]) -> bool:
+    """If-None-Match 使用弱比较：忽略 W/ 前缀"""
+    if if_none_match.strip() == "*":
+        return True
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return any(etag in candidates for etag in etags)
+
+class CachedBody:
+    """预先序列化的响应体及其压缩版本；不同编码的表示使用不同的强ETag"""
+
+    def __init__(self, content: Any):
+        self.body = dumps(content)
+        digest = hashlib.sha256(self.body).hexdigest()[:32]
+        self.variants = {None: (self.body, f'"{digest}"')}
+        for encoding in (("br", "gzip") if HAS_BROTLI else ("gzip",)):
+            compressed = compress(self.body, encoding, level=11 if encoding == "br" else 9)
+            if len(compressed) < len(self.body):
+                self.variants[encoding] = (compressed, f'"{digest}-{encoding}"')
+        self.etags = [etag for _, etag in self.variants.values()]
+
+    def response(self, request: Request, max_age: int) -> Response:
+        encoding = negotiate(request.headers.get("accept-encoding", ""))
+        if encoding not in self.variants:
+            encoding = None
+        body, etag = self.variants[encoding]
+        headers = {"etag": etag, "cache-control": f"public, max-age={max_age}", "vary": "Accept-Encoding"}
+
+        catalog_stats.responses += 1
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and _etag_matches(if_none_match, self.etags):
+            catalog_stats.not_modified += 1
+            catalog_stats.bytes_saved += len(body)
+            return Response(status_code=304, headers=headers)
+
+        if encoding is not None:
+            headers["content-encoding"] = encoding
+        catalog_stats.bytes_sent += len(body)
+        catalog_stats.bytes_saved += len(self.body) - len(body)
+        return Response(content=body, media_type="application/json", headers=headers)
+
+def catalog(func: Callable):
+    """目录类接口装饰器：接口返回值在进程内不变，首次调用后缓存序列化结果
+
+    用法（放在 @router.get 与函数定义之间）：
+        @router.get("/genres")
+        @catalog
+        async def get_novel_genres(): ...
+    """
+    cached: Optional[CachedBody] = None
+
+    async def endpoint(request: Request) -> Response:
+        nonlocal cached
+        if cached is None:
+            cached = CachedBody(await func())
+        return cached.response(request, settings.catalog_cache_max_age)
+
+    # 不使用 functools.wraps：FastAPI 会沿 __wrapped__ 读取原函数签名，丢失 request 参数
+    endpoint.__name__ = func.__name__
+    endpoint.__doc__ = func.__doc__
+    return endpoint
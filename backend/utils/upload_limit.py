@@ -0,0 +1,80 @@
+import json
+from typing import Dict, Optional
+
+class UploadSizeLimitMiddleware:
+    """纯ASGI中间件：限制 multipart 上传请求体大小
+
+    Content-Length 超限时不读取请求体直接返回413；分块传输（无Content-Length）时
+    边接收边计数，超限后停止向应用转发数据并把应用的响应替换为413
+    """
+
+    # multipart 边界和表单头的额外开销
+    _OVERHEAD = 64 * 1024
+
+    def __init__(self, app, default_limit: int, limits: Optional[Dict[str, int]] = None):
+        self.app = app
+        self.default_limit = default_limit
+        self.limits = limits or {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT"):
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        if not headers.get(b"content-type", b"").startswith(b"multipart/form-data"):
+            await self.app(scope, receive, send)
+            return
+
+        limit = self.limits.get(scope["path"], self.default_limit) + self._OVERHEAD
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            await self._reject(send, limit)
+            return
+
+        received = 0
+        exceeded = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            if exceeded:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    exceeded = True
+                    return {"type": "http.disconnect"}
+            return message
+
+        response_started = False
+
+        async def guarded_send(message):
+            nonlocal response_started
+            if exceeded:
+                if not response_started:
+                    response_started = True
+                    await self._reject(send, limit)
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        await self.app(scope, limited_receive, guarded_send)
+        if exceeded and not response_started:
+            await self._reject(send, limit)
+
+    async def _reject(self, send, limit: int):
+        body = json.dumps(
+            {"detail": f"文件大小超过限制（最大{(limit - self._OVERHEAD) // (1024 * 1024)}MB）"},
+            ensure_ascii=False
+        ).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("latin-1")),
+                (b"connection", b"close")
+            ]
+        })
+        await send({"type": "http.response.body", "body": body})